@@ -1,11 +1,12 @@
 import argparse
 import socket
 from . import ui
+from .simulate import PsychometricObserver
 
 def start(class_name):
     parser = argparse.ArgumentParser(description='Description of your program')
     parser.add_argument('-u','--ui',
-                        help = 'select UI (terminal/ gui/ egui) deflaut: terminal',
+                        help = 'select UI (terminal/ gui/ egui/ simulate) deflaut: terminal',
                         default = 'terminal',
                         dest = 'ui')
     parser.add_argument('-l','--l',
@@ -20,6 +21,11 @@ def start(class_name):
                         3: audio only on server""",
                         default = 3,
                         dest = 'audio_flag')
+    parser.add_argument('-t','--threshold',
+                        help = 'threshold of the model observer of -u simulate, default: start value of the variable',
+                        type = float,
+                        default = None,
+                        dest = 'threshold')
     args = parser.parse_args()
 
     experiment = class_name()
@@ -37,5 +43,10 @@ def start(class_name):
         your_ip =  socket.gethostbyname(socket.gethostname())
         print('Type http://'+your_ip+':8888/active/ in your browser to connect to the experiment.\n (Server and client must be on the same network.)')
         ui.Gui(experiment, extern = True, audio_flag = args.audio_flag)
+    if str.lower(args.ui) == 'simulate':
+        observer = None
+        if args.threshold is not None:
+            observer = PsychometricObserver(args.threshold)
+        ui.Model(experiment, observer)
 
 
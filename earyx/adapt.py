@@ -1,4 +1,6 @@
 import earyx.exception as exp
+from earyx.simulate import psychometric
+import numpy as np
 
 
 class Adapt():
@@ -9,17 +11,17 @@ class Adapt():
     def init_adapt(self):
         pass
 
-    def adapt(self, trials):
+    def adapt(self, history):
         pass
 
-    def __call__(self, trials):
-        return self.adapt(trials)
+    def __call__(self, history):
+        return self.adapt(history)
 
 
 class Adapt1up2down(Adapt):
     reversals = -1
 
-    def adapt(self, trials):
+    def adapt(self, history):
         """
         Set new value of reversal variable self.reversals and stepsize
         variable self.step according to the adaptive 1up-2down paradigm.
@@ -28,32 +30,34 @@ class Adapt1up2down(Adapt):
 
         Parameters
         ----------
-        trials : List with all trials
+        history : :class:`earyx.run.History`
+            answered trials of the run
 
         Returns
         -------
         result : (none)
         Updated self.step and self.reversals
         """
-        if len(trials) >= 3:
-            if (all([trials[-1].is_correct, trials[-2].is_correct]) and
-                not trials[-3].is_correct):
+        correct = history.is_correct
+        if len(history) >= 3:
+            if (all([correct[-1], correct[-2]]) and
+                not correct[-3]):
                 if self.minstep == self.step:
                     self.reversals += 1
                 self.step = max(self.minstep, self.step/2)
 
-            if (not trials[-1].is_correct and
-                all([trials[-2].is_correct, trials[-3].is_correct])):
+            if (not correct[-1] and
+                all([correct[-2], correct[-3]])):
                 if self.minstep == self.step:
                     self.reversals += 1
 
             # check for end of run
             if self.reversals == self.max_reversals:
                 raise exp.RunFinishedException()
-        if not trials[-1].is_correct:
+        if not correct[-1]:
             return self.step
-        if (len(trials) >= 2 and
-            trials[-2].is_correct):
+        if (len(history) >= 2 and
+            correct[-2]):
             return -self.step
         return 0
 
@@ -62,7 +66,7 @@ class Adapt2up1down(Adapt):
 
     reversals = -1
 
-    def adapt(self, trials):
+    def adapt(self, history):
         """
         Set new value of reversal variable self.reversals and stepsize
         variable self.step according to the adaptive 2up-1down paradigm.
@@ -71,8 +75,8 @@ class Adapt2up1down(Adapt):
 
         Parameters
         ----------
-        trials : list (of trials)
-            List with all trials
+        history : :class:`earyx.run.History`
+            answered trials of the run
         
         Returns
         -------
@@ -83,15 +87,16 @@ class Adapt2up1down(Adapt):
         ------
         RunFinishException
         """
-        if len(trials) >= 3:
-            if (not all([trials[-2].is_correct, trials[-3].is_correct]) and
-                trials[-1].is_correct is True):
+        correct = history.is_correct
+        if len(history) >= 3:
+            if (not all([correct[-2], correct[-3]]) and
+                correct[-1]):
                 if self.minstep == self.step:
                     self.reversals += 1
                 self.step = max(self.minstep, self.step/2)
 
-            if (trials[-3].is_correct is True and
-                not all([trials[-1].is_correct, trials[-2].is_correct])):
+            if (correct[-3] and
+                not all([correct[-1], correct[-2]])):
                 if self.minstep == self.step:
                     self.reversals += 1
 
@@ -99,10 +104,10 @@ class Adapt2up1down(Adapt):
             if self.reversals == self.max_reversals:
                 raise exp.RunFinishedException()
 
-        if trials[-1].is_correct is True:
+        if correct[-1]:
             return -self.step
-        if (len(trials) >= 2 and
-            trials[-2].is_correct is False):
+        if (len(history) >= 2 and
+            not correct[-2]):
             return self.step
         return 0
 
@@ -111,7 +116,7 @@ class Adapt1up3down(Adapt):
 
     reversals = -1
 
-    def adapt(self, trials):
+    def adapt(self, history):
         """
         Set new value of reversal variable self.reversals and stepsize
         variable self.step according to the adaptive 3up-1down paradigm.
@@ -120,26 +125,28 @@ class Adapt1up3down(Adapt):
 
         Parameters
         ----------
-        trials : List with all trials
+        history : :class:`earyx.run.History`
+            answered trials of the run
 
         Returns
         -------
         result : (none)
         Updated self.step and self.reversals
         """
-        if len(trials) >= 4:
-            if (all([trials[-1].is_correct,
-                     trials[-2].is_correct,
-                     trials[-3].is_correct]) and
-                not trials[-4].is_correct):
+        correct = history.is_correct
+        if len(history) >= 4:
+            if (all([correct[-1],
+                     correct[-2],
+                     correct[-3]]) and
+                not correct[-4]):
                 if self.minstep == self.step:
                     self.reversals += 1
                     self.step = max(self.minstep, self.step/2)
 
-            if (not trials[-1].is_correct and
-                all([trials[-2].is_correct,
-                     trials[-3].is_correct,
-                     trials[-4].is_correct])):
+            if (not correct[-1] and
+                all([correct[-2],
+                     correct[-3],
+                     correct[-4]])):
                 if self.minstep == self.step:
                     self.reversals += 1
 
@@ -147,11 +154,11 @@ class Adapt1up3down(Adapt):
             if self.reversals == self.max_reversals:
                 raise exp.RunFinishedException()
 
-        if trials[-1].is_correct is False:
+        if not correct[-1]:
             return self.step
-        if (len(trials) >= 3 and
-            trials[-2].is_correct is True and
-            trials[-3].is_correct is True):
+        if (len(history) >= 3 and
+            correct[-2] and
+            correct[-3]):
             return -self.step
         return 0
 
@@ -160,7 +167,7 @@ class AdaptWUD(Adapt):
 
     reversals = -1
 
-    def adapt(self, trials):
+    def adapt(self, history):
         """
         Set new value of reversal variable self.reversals and stepsize
         variable self.step according to the "weighted up-down" paradigm.
@@ -169,20 +176,22 @@ class AdaptWUD(Adapt):
 
         Parameters
         ----------
-        trials : List with all trials
+        history : :class:`earyx.run.History`
+            answered trials of the run
 
         Returns
         -------
         result : (none)
         Updated self.step and self.reversals
         """
-        if len(trials) >= 2:
-            if (trials[-1].is_correct and not trials[-2].is_correct):
+        correct = history.is_correct
+        if len(history) >= 2:
+            if (correct[-1] and not correct[-2]):
                 if self.minstep == self.step:
                     self.reversals += 1
                     self.step = max(self.minstep, self.step/2)
 
-            if (not trials[-1].is_correct and trials[-2].is_correct):
+            if (not correct[-1] and correct[-2]):
                 if self.minstep == self.step:
                     self.reversals += 1
             # check for end of run
@@ -195,7 +204,277 @@ class AdaptWUD(Adapt):
         step_down = self.start_step
         step_up = self.pc_convergence/(1-self.pc_convergence)*step_down
 
-        if trials[-1].is_correct is False:
+        if not correct[-1]:
             return step_up
         else:
             return -step_down
+
+
+class AdaptKUpNDown(Adapt):
+    """Generic transformed up-down rule
+
+    The variable goes up after `k` consecutive wrong answers and down after
+    `n` consecutive correct answers (Levitt, "Transformed up-down procedures
+    in psychoacoustics", 1971, JASA 49, p.467-477). A reversal is a change of
+    direction. Reversals are counted once the step reached `minstep` and the
+    run ends after `max_reversals` of them. The rule keeps run-length
+    counters instead of looking back over the trials, so each answer costs
+    O(1).
+
+    Use ``exp.add_adapt_setting("KUpNDown", max_reversals, start_step,
+    min_step, k=1, n=3)`` for a 1-up 3-down rule.
+
+    Attributes
+    ----------
+    k : int
+        consecutive wrong answers for a step up
+    n : int
+        consecutive correct answers for a step down
+    step_rule : str
+        change of the step at each reversal: 'halve' halves it down to
+        `minstep`, 'minstep' jumps to `minstep`
+    num_correct, num_wrong : int
+        current run lengths of correct and wrong answers
+    direction : int
+        1 if the last step went up, -1 if it went down, 0 before the first
+        step
+    """
+    k = 1
+    n = 2
+    step_rule = 'halve'
+    reversals = -1
+    num_correct = 0
+    num_wrong = 0
+    direction = 0
+
+    def adapt(self, history):
+        """
+        Update the counters with the last answer and return the step of the
+        variable.
+
+        Parameters
+        ----------
+        history : :class:`earyx.run.History`
+            answered trials of the run
+
+        Returns
+        -------
+        result : float
+            step of the variable
+
+        Raises
+        ------
+        RunFinishedException
+        """
+        if history.is_correct[-1]:
+            self.num_correct += 1
+            self.num_wrong = 0
+            if self.num_correct < self.n:
+                return 0
+            self.num_correct = 0
+            direction = -1
+        else:
+            self.num_wrong += 1
+            self.num_correct = 0
+            if self.num_wrong < self.k:
+                return 0
+            self.num_wrong = 0
+            direction = 1
+
+        if direction == -self.direction:
+            if self.minstep == self.step:
+                self.reversals += 1
+            if self.step_rule == 'halve':
+                self.step = max(self.minstep, self.step/2)
+            elif self.step_rule == 'minstep':
+                self.step = self.minstep
+            else:
+                raise ValueError("unknown step_rule %s" % self.step_rule)
+            # check for end of run
+            if self.reversals == self.max_reversals:
+                raise exp.RunFinishedException()
+        self.direction = direction
+        return direction*self.step
+
+
+class Posterior():
+    """Posterior over threshold and slope of a logistic psychometric
+    function on a grid
+
+    The probabilities of a correct answer for all stimulus levels and grid
+    points are computed once. An answer multiplies the posterior in place
+    with one row of this table. The posterior is not saved, adapt rules
+    rebuild it from the :class:`earyx.run.History` of a loaded run.
+
+    Parameters
+    ----------
+    levels : numpy array
+        possible stimulus levels, evenly spaced
+    thresholds, slopes : numpy array
+        grid of the psychometric function, see
+        :func:`earyx.simulate.psychometric`
+    guess, lapse : float
+    """
+
+    def __init__(self, levels, thresholds, slopes, guess, lapse):
+        self.levels = levels
+        threshold, slope = np.meshgrid(thresholds, slopes, indexing='ij')
+        self.threshold = threshold.ravel()
+        self.slope = slope.ravel()
+        self._correct = psychometric(levels[:, None], self.threshold,
+                                     self.slope, guess, lapse)
+        self._wrong = 1 - self._correct
+        # negative entropy of an answer at each level and grid point
+        self._entropy = (_xlogx(self._correct) + _xlogx(self._wrong))
+        self.prob = np.full(len(self.threshold), 1/len(self.threshold))
+
+    def update(self, level, is_correct):
+        """multiply the posterior with the likelihood of an answer"""
+        table = self._correct if is_correct else self._wrong
+        self.prob *= table[self.level_idx(level)]
+        self.prob /= self.prob.sum()
+
+    def level_idx(self, level):
+        """index of the stimulus level closest to level"""
+        step = self.levels[1] - self.levels[0] if len(self.levels) > 1 else 1
+        idx = int(round((level - self.levels[0])/step))
+        return min(max(idx, 0), len(self.levels)-1)
+
+    def expected_entropy(self):
+        """expected entropy of the posterior after a trial at each level"""
+        correct = self._correct @ self.prob
+        wrong = 1 - correct
+        return (-np.sum(_xlogx(self.prob)) - self._entropy @ self.prob +
+                _xlogx(correct) + _xlogx(wrong))
+
+    def mean(self, values):
+        return float(values @ self.prob)
+
+    def sd(self, values):
+        return float(np.sqrt(max(((values - self.mean(values))**2) @
+                                 self.prob, 0)))
+
+
+class AdaptPsi(Adapt):
+    """Psi method (Kontsevich and Tyler, "Bayesian adaptive estimation of
+    psychometric slope and threshold", 1999, Vision Research 39, p.2729-2737)
+
+    The rule keeps a :class:`Posterior` over threshold and slope. The next
+    level is the one which minimises the expected entropy of the posterior.
+    Levels and thresholds are spaced by `minstep`. The run ends after
+    `max_trials` trials, `max_reversals` is not used. All trials belong to
+    the measurement phase.
+
+    Use ``exp.add_adapt_setting("Psi", start_step=8, min_step=1,
+    max_trials=40, guess=1/3)``.
+
+    Attributes
+    ----------
+    max_trials : int
+    guess, lapse : float
+        guess and lapse rate of the psychometric function, guess should be
+        1/num_afc
+    level_range : tuple (optional)
+        lowest and highest stimulus level and threshold, default: start value
+        of the variable -/+ 5 times `start_step`
+    slope_range : tuple
+        smallest and largest slope of the grid, see
+        :func:`earyx.simulate.psychometric`
+    num_slopes : int
+        number of logarithmically spaced slopes of the grid
+    posterior : :class:`Posterior`
+    estimate, estimate_sd : float
+        posterior mean and standard deviation of the threshold
+    slope_estimate : float
+        posterior mean of the slope
+    """
+    max_trials = 30
+    guess = 1/3
+    lapse = 0.02
+    level_range = None
+    slope_range = (0.05, 2)
+    num_slopes = 10
+    posterior = None
+    estimate = None
+    estimate_sd = None
+    slope_estimate = None
+    reversals = -1
+
+    def adapt(self, history):
+        """
+        Update the posterior with the last answer and return the step to the
+        next level.
+
+        Parameters
+        ----------
+        history : :class:`earyx.run.History`
+            answered trials of the run
+
+        Returns
+        -------
+        result : float
+            step of the variable
+
+        Raises
+        ------
+        RunFinishedException
+        """
+        if not isinstance(self.posterior, Posterior):
+            self.posterior = self.create_posterior(history.variable[0])
+            for variable, is_correct in zip(history.variable[:-1],
+                                            history.is_correct[:-1]):
+                self.posterior.update(variable, is_correct)
+            # all trials measure the threshold
+            self.start_measurement_idx = 0
+        self.posterior.update(history.variable[-1], history.is_correct[-1])
+        self.estimate = self.posterior.mean(self.posterior.threshold)
+        self.estimate_sd = self.posterior.sd(self.posterior.threshold)
+        self.slope_estimate = self.posterior.mean(self.posterior.slope)
+        if len(history) >= self.max_trials:
+            raise exp.RunFinishedException()
+        return self.next_level() - self.variable
+
+    def create_posterior(self, start):
+        """returns the uniform prior of the run"""
+        if self.level_range is None:
+            low, high = start - 5*self.start_step, start + 5*self.start_step
+        else:
+            low, high = self.level_range
+        levels = np.arange(low, high + self.minstep/2, self.minstep)
+        return Posterior(levels, levels, self.slopes(), self.guess,
+                         self.lapse)
+
+    def slopes(self):
+        return np.geomspace(self.slope_range[0], self.slope_range[1],
+                            self.num_slopes)
+
+    def next_level(self):
+        levels = self.posterior.levels
+        return float(levels[np.argmin(self.posterior.expected_entropy())])
+
+
+class AdaptQuest(AdaptPsi):
+    """QUEST (Watson and Pelli, "QUEST: A Bayesian adaptive psychometric
+    method", 1983, Perception & Psychophysics 33, p.113-120)
+
+    Like :class:`AdaptPsi` with a known slope. The next level is the
+    posterior mean of the threshold.
+
+    Attributes
+    ----------
+    slope : float
+        slope of the psychometric function, see
+        :func:`earyx.simulate.psychometric`
+    """
+    slope = 0.5
+
+    def slopes(self):
+        return np.array([self.slope])
+
+    def next_level(self):
+        posterior = self.posterior
+        return float(posterior.levels[posterior.level_idx(self.estimate)])
+
+
+def _xlogx(values):
+    return values*np.log(np.maximum(values, 1e-300))
@@ -0,0 +1,660 @@
+"""
+This module provides the audio engine of earyx. Instead of opening a new
+stream for every trial, :class:`AudioEngine` keeps one callback driven output
+stream open for the whole session. Complete trial signals are queued and
+played back gapless and sample-accurately one after another. For every
+queued signal a :class:`Playback` reports when its signal parts (pre signal,
+intervals, between signals, ...) actually started.
+
+:class:`ProcessAudioEngine` has the same interface but runs the output stream
+in a child process, which reads the signals from a shared memory ring buffer.
+Plotting, synthesis or serialisation in the main process then cannot delay
+the audio callback.
+
+It is part of the earyx toolbox for psychoacoustic experiments.
+"""
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque
+import itertools
+import queue
+import time
+import numpy as np
+import sounddevice as sd
+
+
+class Playback():
+    """Handle of a signal queued in an :class:`AudioEngine`
+
+    Attributes
+    ----------
+    buffer : numpy array
+        complete signal with shape (SAMPLES, CHANNELS), float32
+    offsets : list of int
+        first sample of each signal part within the buffer
+    sample_rate : int
+    onset : float
+        stream time at which the first sample is played back. None until
+        playback has started.
+    onset_ns : int
+        the same moment as value of :func:`time.perf_counter_ns`, the clock
+        of all other trial timestamps
+    """
+
+    def __init__(self, buffer, offsets, sample_rate):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.sample_rate = sample_rate
+        self.onset = None
+        self.onset_ns = None
+        self._started = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def onsets(self):
+        """stream times at which the signal parts start, None before start"""
+        if self.onset is None:
+            return None
+        return [self.onset + offset/self.sample_rate for offset in self.offsets]
+
+    @property
+    def onsets_ns(self):
+        """onsets of the signal parts in perf_counter_ns, None before start"""
+        if self.onset_ns is None:
+            return None
+        return [self.onset_ns + offset*1000000000//self.sample_rate
+                for offset in self.offsets]
+
+    def timing(self):
+        """returns the onsets as dict for :attr:`Trial.timing`"""
+        if self.onset is None:
+            return {}
+        return {'first_sample': self.onset, 'onsets': self.onsets,
+                'first_sample_ns': self.onset_ns, 'onsets_ns': self.onsets_ns}
+
+    @property
+    def duration(self):
+        return len(self.buffer)/self.sample_rate
+
+    def wait_started(self, timeout=None):
+        """block until the first sample was passed to the device"""
+        return self._started.wait(timeout)
+
+    def wait(self, timeout=None):
+        """block until the last sample was passed to the device"""
+        return self._finished.wait(timeout)
+
+    def _read(self, pos, num):
+        return self.buffer[pos:pos+num]
+
+    def _start(self, onset, onset_ns):
+        self.onset = onset
+        self.onset_ns = onset_ns
+        self._started.set()
+
+    def _finish(self):
+        self._finished.set()
+
+
+class Loop(Playback):
+    """Signal played repeatedly until the engine is stopped
+
+    The gain of some signal parts, e.g. the test signal of a matching
+    experiment, can be changed while the loop plays. The audio callback
+    ramps linearly to a new gain within `ramp` seconds, so changes do not
+    click. Onsets refer to the first repetition.
+
+    Attributes
+    ----------
+    gain : float
+        target gain of the variable parts
+    """
+
+    def __init__(self, buffer, offsets, sample_rate, parts, ramp):
+        super().__init__(buffer, offsets, sample_rate)
+        bounds = offsets + [len(buffer)]
+        self.regions = [(bounds[idx], bounds[idx+1]) for idx in parts]
+        self.gain = 1.0
+        self._gain = 1.0
+        self._step = 0.0
+        self._ramp = max(int(ramp*sample_rate), 1)
+
+    def set_gain(self, gain):
+        """ramp the variable parts to a new linear gain"""
+        self._step = (gain - self._gain)/self._ramp
+        self.gain = gain
+
+    def _read(self, pos, num):
+        data = self.buffer[pos:pos+num]
+        if self._step == 0 and self._gain == 1:
+            return data
+        gains = self._gain + self._step*np.arange(1, num+1)
+        if self._step > 0:
+            gains = np.minimum(gains, self.gain)
+        elif self._step < 0:
+            gains = np.maximum(gains, self.gain)
+        if num:
+            self._gain = gains[-1]
+        if self._gain == self.gain:
+            self._step = 0.0
+        data = data.copy()
+        for start, end in self.regions:
+            first, last = max(start - pos, 0), min(end - pos, num)
+            if first < last:
+                data[first:last] *= gains[first:last, None]
+        return data
+
+
+class AudioEngine():
+    """Persistent output stream playing queued signals without gaps
+
+    Parameters
+    ----------
+    sample_rate : int
+    channels : int (optional)
+        number of output channels. Default: 2
+    channel_map : list of int (optional)
+        output channel of each signal channel. Without a map signals with one
+        channel are played on all output channels and signal channel i on
+        output channel i. Default: None
+    device : int or str (optional)
+        output device, see :mod:`sounddevice`. Default: system default
+    latency : str or float (optional)
+        Default: 'low'
+    blocksize : int (optional)
+        Default: 0, which lets the host choose an optimal block size
+
+    Attributes
+    ----------
+    underruns : int
+        number of output underflows reported by the device
+    """
+    backend = 'stream'
+
+    def __init__(self, sample_rate, channels=2, channel_map=None, device=None,
+                 latency='low', blocksize=0):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.channel_map = channel_map
+        self.underruns = 0
+        self._queue = deque()
+        self._current = None
+        self._pos = 0
+        self._stream = sd.OutputStream(samplerate=sample_rate,
+                                       channels=channels, dtype='float32',
+                                       device=device, latency=latency,
+                                       blocksize=blocksize,
+                                       callback=self._callback)
+        self._stream.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def time(self):
+        """current stream time, the clock of all onsets"""
+        return self._stream.time
+
+    def play(self, signal):
+        """queue signal for playback
+
+        The signal starts directly after all previously queued signals.
+
+        Parameters
+        ----------
+        signal : list of numpy arrays
+            signal parts as returned by `build_signal`, each with shape
+            (SAMPLES,) or (SAMPLES, CHANNELS)
+
+        Returns
+        -------
+        playback : :class:`Playback`
+        """
+        buffer, offsets = join_parts(signal)
+        playback = Playback(buffer, offsets, self.sample_rate)
+        self._queue.append(playback)
+        return playback
+
+    def loop(self, signal, parts, ramp=0.02):
+        """queue signal for playback in a loop
+
+        Parameters
+        ----------
+        signal : list of numpy arrays
+            signal parts, see :func:`play`
+        parts : list of int
+            indices of the parts whose gain can be changed
+        ramp : float (optional)
+            duration of gain ramps in seconds. Default: 0.02
+
+        Returns
+        -------
+        loop : :class:`Loop`
+        """
+        buffer, offsets = join_parts(signal)
+        if not len(buffer):
+            raise ValueError("Can not loop an empty signal")
+        loop = Loop(buffer, offsets, self.sample_rate, parts, ramp)
+        self._queue.append(loop)
+        return loop
+
+    def stop(self):
+        """stop current playback and drop all queued signals"""
+        while self._queue:
+            self._queue.popleft()._finish()
+        current = self._current
+        self._current = None
+        if current is not None:
+            current._finish()
+
+    def close(self):
+        self.stop()
+        self._stream.stop()
+        self._stream.close()
+
+    def _callback(self, outdata, frames, stream_time, status):
+        now_ns = time.perf_counter_ns()
+        if status.output_underflow:
+            self.underruns += 1
+        filled = 0
+        while filled < frames:
+            current = self._current
+            if current is None:
+                if not self._queue:
+                    break
+                current = self._current = self._queue.popleft()
+                self._pos = 0
+                onset = (stream_time.outputBufferDacTime +
+                         filled/self.sample_rate)
+                current._start(onset, now_ns + int((onset -
+                                                    stream_time.currentTime)*1e9))
+            num = min(frames - filled, len(current.buffer) - self._pos)
+            _route(outdata[filled:filled+num], current._read(self._pos, num),
+                   self.channel_map)
+            filled += num
+            self._pos += num
+            if self._pos == len(current.buffer):
+                if isinstance(current, Loop):
+                    self._pos = 0
+                    continue
+                current._finish()
+                self._current = None
+        outdata[filled:] = 0
+
+
+class ProcessAudioEngine():
+    """Output stream in a child process fed by a shared memory ring buffer
+
+    Same interface as :class:`AudioEngine`. Queued signals are copied into
+    the ring buffer by a feeder thread as soon as there is space. The child
+    process only reads the ring buffer in its audio callback and publishes
+    onsets and ends of the signals in the shared memory header, which a
+    receiver thread polls.
+
+    Parameters
+    ----------
+    sample_rate : int
+    channels : int (optional)
+        Default: 2
+    channel_map : list of int (optional)
+        see :class:`AudioEngine`
+    device : int or str (optional)
+    latency : str or float (optional)
+        Default: 'low'
+    blocksize : int (optional)
+        Default: 0
+    buffer_time : float (optional)
+        length of the ring buffer in seconds. Default: 2
+
+    Signals are written to the ring buffer ahead of time, so this engine
+    can not play a :class:`Loop`.
+
+    Attributes
+    ----------
+    underruns : int
+        number of output underflows reported by the device plus the number
+        of callbacks which found the ring buffer empty during a signal
+    """
+    backend = 'process'
+
+    def __init__(self, sample_rate, channels=2, channel_map=None, device=None,
+                 latency='low', blocksize=0, buffer_time=2):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.channel_map = channel_map
+        self.capacity = int(buffer_time*sample_rate)
+        size = _HEADER_SIZE + self.capacity*channels*4
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        (self._header, self._clock, self._marks,
+         self._ring) = _map(self._shm, self.capacity, channels)
+        self._header[:] = 0
+        self._clock[:] = 0
+        self._marks[:] = 0
+        self._ids = itertools.count()
+        self._playbacks = {}
+        self._queued = 0
+        self._feed_queue = deque()
+        self._feed_event = threading.Event()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._closed = False
+        ctx = multiprocessing.get_context('spawn')
+        self._commands = ctx.Queue()
+        self._events = ctx.Queue()
+        self._process = ctx.Process(target=_audio_process, daemon=True,
+                                    args=(self._shm.name, self.capacity,
+                                          channels, sample_rate, device,
+                                          latency, blocksize, self._commands,
+                                          self._events))
+        self._process.start()
+        try:
+            ready = self._events.get(timeout=10)
+        except queue.Empty:
+            ready = None
+        if ready != 'ready':
+            self._process.terminate()
+            self._shm.close()
+            self._shm.unlink()
+            raise RuntimeError('audio process could not open output stream')
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def underruns(self):
+        return int(self._header[_UNDERRUNS])
+
+    @property
+    def time(self):
+        """current stream time, the clock of all onsets"""
+        stream_time, perf_time = self._clock
+        return stream_time + time.perf_counter() - perf_time
+
+    def play(self, signal):
+        """queue signal for playback, see :func:`AudioEngine.play`"""
+        buffer, offsets = join_parts(signal)
+        playback = Playback(buffer, offsets, self.sample_rate)
+        with self._lock:
+            idx = next(self._ids)
+            start = self._queued
+            self._queued += len(playback.buffer)
+            self._playbacks[idx] = playback
+            self._commands.put(('mark', idx, start, self._queued))
+            self._feed_queue.append(playback)
+        self._feed_event.set()
+        return playback
+
+    def stop(self):
+        """stop current playback and drop all queued signals"""
+        with self._lock:
+            self._generation += 1
+            self._feed_queue.clear()
+            self._queued = int(self._header[_WRITE])
+            self._header[_SKIP] = self._queued
+            playbacks = list(self._playbacks.values())
+            self._playbacks.clear()
+        for playback in playbacks:
+            playback._finish()
+
+    def close(self):
+        if self._closed:
+            return
+        self.stop()
+        self._closed = True
+        self._feed_event.set()
+        self._commands.put(('close',))
+        self._process.join(1)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._receiver.join(1)
+        self._feeder.join(1)
+        del self._header, self._clock, self._marks, self._ring
+        self._shm.close()
+        self._shm.unlink()
+
+    def _feed(self):
+        """copy queued signals into the ring buffer"""
+        wait = 0.25*self.capacity/self.sample_rate
+        while not self._closed:
+            if not self._feed_queue:
+                self._feed_event.wait(wait)
+                self._feed_event.clear()
+                continue
+            with self._lock:
+                if not self._feed_queue:
+                    continue
+                buffer = self._feed_queue[0].buffer
+                generation = self._generation
+            pos = 0
+            while pos < len(buffer) and not self._closed:
+                with self._lock:
+                    if generation != self._generation:
+                        break
+                    write = int(self._header[_WRITE])
+                    read = max(int(self._header[_READ]),
+                               int(self._header[_SKIP]))
+                    num = min(self.capacity - (write - read), len(buffer) - pos)
+                    if num > 0:
+                        _ring_write(self._ring, write, buffer[pos:pos+num],
+                                    self.channel_map)
+                        self._header[_WRITE] = write + num
+                        pos += num
+                if num <= 0:
+                    time.sleep(wait)
+            with self._lock:
+                if (generation == self._generation and self._feed_queue
+                        and self._feed_queue[0].buffer is buffer):
+                    self._feed_queue.popleft()
+
+    def _receive(self):
+        """dispatch onsets and ends which the audio process publishes in the
+        shared memory header
+
+        The stream callback must not block, so it only counts started and
+        finished signals and writes the onsets to a ring of mark slots,
+        which this thread polls.
+        """
+        started = finished = 0
+        while not self._closed:
+            time.sleep(_POLL_TIME)
+            num_started = int(self._header[_STARTED])
+            for count in range(max(started, num_started - _MARK_SLOTS),
+                               num_started):
+                idx, onset, onset_ns = self._marks[count % _MARK_SLOTS]
+                with self._lock:
+                    playback = self._playbacks.get(int(idx))
+                if playback is not None:
+                    playback._start(float(onset), int(onset_ns))
+            started = num_started
+            num_finished = int(self._header[_FINISHED])
+            for idx in range(finished, num_finished):
+                with self._lock:
+                    playback = self._playbacks.pop(idx, None)
+                if playback is not None:
+                    playback._finish()
+            finished = num_finished
+
+
+def open_engine(backend, sample_rate, channels=1, channel_map=None,
+                current=None):
+    """open an audio engine or reuse the current one
+
+    Parameters
+    ----------
+    backend : str
+        'stream' for :class:`AudioEngine`, 'process' for
+        :class:`ProcessAudioEngine`
+    sample_rate : int
+    channels : int (optional)
+        number of signal channels to play. At least two output channels are
+        opened. Default: 1
+    channel_map : list of int (optional)
+        see :class:`AudioEngine`
+    current : engine (optional)
+        engine which is returned if it fits, otherwise it is closed
+
+    Returns
+    -------
+    engine : :class:`AudioEngine` or :class:`ProcessAudioEngine`
+    """
+    if channel_map is not None:
+        channels = max(channel_map) + 1
+    channels = max(channels, 2)
+    if current is not None:
+        if (current.backend == backend and
+                current.sample_rate == sample_rate and
+                current.channels >= channels and
+                current.channel_map == channel_map):
+            return current
+        current.close()
+    if backend == 'process':
+        return ProcessAudioEngine(sample_rate, channels, channel_map)
+    return AudioEngine(sample_rate, channels, channel_map)
+
+
+def num_channels(signal):
+    """returns the number of channels of a list of signal parts"""
+    return max([np.shape(part)[1] if np.ndim(part) == 2 else 1
+                for part in signal] + [1])
+
+
+def join_parts(signal):
+    """join signal parts to one float32 buffer
+
+    Mono parts keep one channel unless they are joined with multichannel
+    parts, then they are repeated on all channels.
+
+    Parameters
+    ----------
+    signal : list of numpy arrays
+        signal parts, each with shape (SAMPLES,) or (SAMPLES, CHANNELS)
+
+    Returns
+    -------
+    buffer : numpy array
+        signal with shape (SAMPLES, CHANNELS)
+    offsets : list of int
+        first sample of each part within the buffer
+    """
+    channels = num_channels(signal)
+    parts = [np.asarray(part, dtype='float32') for part in signal]
+    parts = [np.broadcast_to(part.reshape(-1, 1), (len(part), channels))
+             if part.ndim == 1 else part for part in parts]
+    offsets = [int(offset) for offset in
+               np.cumsum([0] + [len(part) for part in parts[:-1]])]
+    buffer = np.ascontiguousarray(np.concatenate(parts))
+    return buffer, offsets
+
+
+def _route(out, data, channel_map):
+    """write data with shape (FRAMES, SIGNAL_CHANNELS) to the output channels"""
+    if channel_map is not None:
+        out[:] = 0
+        out[:, channel_map] = data
+    elif data.shape[1] == 1 or data.shape[1] == out.shape[1]:
+        out[:] = data
+    else:
+        out[:] = 0
+        out[:, :data.shape[1]] = data
+
+
+# layout of the shared memory: int64 header, float64 clock, float64 mark
+# slots (id, onset, onset_ns) of the last started signals, float32 ring.
+# Signals are marked and finish in the order of their ids, so the number of
+# finished signals is the id of the next one to finish.
+_WRITE, _READ, _SKIP, _UNDERRUNS, _STARTED, _FINISHED = range(6)
+_MARK_SLOTS = 64
+_HEADER_SIZE = 6*8 + 2*8 + _MARK_SLOTS*3*8
+_POLL_TIME = 0.002
+
+
+def _map(shm, capacity, channels):
+    header = np.ndarray(6, dtype=np.int64, buffer=shm.buf)
+    clock = np.ndarray(2, dtype=np.float64, buffer=shm.buf, offset=6*8)
+    marks = np.ndarray((_MARK_SLOTS, 3), dtype=np.float64, buffer=shm.buf,
+                       offset=8*8)
+    ring = np.ndarray((capacity, channels), dtype=np.float32, buffer=shm.buf,
+                      offset=_HEADER_SIZE)
+    return header, clock, marks, ring
+
+
+def _ring_write(ring, pos, data, channel_map):
+    idx = pos % len(ring)
+    first = min(len(data), len(ring) - idx)
+    _route(ring[idx:idx+first], data[:first], channel_map)
+    _route(ring[:len(data)-first], data[first:], channel_map)
+
+
+def _audio_process(name, capacity, channels, sample_rate, device, latency,
+                   blocksize, commands, events):
+    """main function of the child process of :class:`ProcessAudioEngine`"""
+    shm = shared_memory.SharedMemory(name=name)
+    header, clock, slots, ring = _map(shm, capacity, channels)
+    marks = deque()  # [id, start, end, started] of queued signals
+
+    def callback(outdata, frames, stream_time, status):
+        now_ns = time.perf_counter_ns()
+        clock[1] = now_ns/1e9
+        clock[0] = stream_time.currentTime
+        if status.output_underflow:
+            header[_UNDERRUNS] += 1
+        skip = int(header[_SKIP])
+        read = max(int(header[_READ]), skip)
+        num = min(int(header[_WRITE]) - read, frames)
+        idx = read % capacity
+        first = min(num, capacity - idx)
+        outdata[:first] = ring[idx:idx+first]
+        outdata[first:num] = ring[:num-first]
+        outdata[num:] = 0
+        end = read + num
+        header[_READ] = end
+        dac = stream_time.outputBufferDacTime
+        while marks:
+            mark = marks[0]
+            if mark[1] < skip:  # queued before the last stop
+                header[_FINISHED] += 1
+                marks.popleft()
+                continue
+            if not mark[3] and mark[1] < end:
+                mark[3] = True
+                onset = dac + (mark[1]-read)/sample_rate
+                # fill the slot before the counter publishes it
+                slots[header[_STARTED] % _MARK_SLOTS] = (
+                    mark[0], onset,
+                    now_ns + int((onset-stream_time.currentTime)*1e9))
+                header[_STARTED] += 1
+            if mark[2] > end:
+                if num < frames and mark[3]:
+                    header[_UNDERRUNS] += 1
+                break
+            header[_FINISHED] += 1
+            marks.popleft()
+
+    try:
+        stream = sd.OutputStream(samplerate=sample_rate, channels=channels,
+                                 dtype='float32', device=device,
+                                 latency=latency, blocksize=blocksize,
+                                 callback=callback)
+    except Exception:
+        events.put('failed')
+        raise
+    with stream:
+        events.put('ready')
+        while True:
+            command = commands.get()
+            if command[0] == 'close':
+                break
+            marks.append(list(command[1:]) + [False])
+    del header, clock, slots, ring
+    shm.close()
@@ -0,0 +1,236 @@
+"""
+This module contains a persistent cache of run signals. Deterministic
+:func:`init_run` methods, e.g. the `htc` reference of
+:class:`PhaseCurvature`, are then computed once for all subjects and
+sessions. The cache is switched on with the experiment option `run_cache`.
+
+Every cached run is stored as a JSON manifest with the attributes
+:func:`init_run` set plus one `.npy` file per numpy array. Arrays are opened
+memory mapped copy-on-write, so concurrent sessions share their pages until
+an experiment changes them.
+When the cache grows beyond its size the least recently used runs are
+removed.
+
+:class:`TrialCache` keeps the attributes set by :func:`init_trial` in memory
+for experiments whose trial signals only depend on the run parameters and the
+variable, see the experiment option `trial_cache_size`. A staircase which
+returns to a level then reuses the signals of its last visit.
+
+It is part of the earyx toolbox for psychoacoustic experiments.
+"""
+from earyx.stimulus import Stimulus, from_json
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+
+class StimulusCache():
+    """Persistent cache of the attributes set by :func:`init_run`
+
+    Parameters
+    ----------
+    path : str (optional)
+        cache directory. Default: `EARYX_CACHE` environment variable or
+        ~/.cache/earyx
+    max_bytes : int (optional)
+        size of the cache. Default: 1 GiB
+    """
+
+    def __init__(self, path=None, max_bytes=2**30):
+        if path is None:
+            path = os.environ.get('EARYX_CACHE', os.path.join(
+                os.path.expanduser('~'), '.cache', 'earyx'))
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(experiment, run):
+        """returns the cache key of a run or None if the source of the
+        experiment is not available
+
+        The key covers the source of the modules which define the experiment
+        class and its base classes outside of earyx, the source of earyx
+        itself, e.g. of the helpers in :mod:`earyx.utils`, the parameters
+        and adapt setting of the run, `sample_rate` and `calib`.
+        """
+        modules = dict.fromkeys(
+            inspect.getmodule(cls) for cls in type(experiment).__mro__
+            if cls.__module__.split('.')[0] not in ('earyx', 'builtins'))
+        try:
+            source = [inspect.getsource(module) for module in modules]
+        except (OSError, TypeError):
+            return None
+        adapt = [setting for setting in experiment.adapt_settings
+                 if all(getattr(run, name, None) == value
+                        for name, value in setting.items() if name != 'type')]
+        description = json.dumps([source, _earyx_digest(), run._parameters,
+                                  adapt, run.sample_rate, run.calib],
+                                 sort_keys=True, default=str)
+        return hashlib.md5(description.encode()).hexdigest()
+
+    def load(self, key):
+        """returns the cached attributes of key or None"""
+        manifest = os.path.join(self.path, key + '.json')
+        try:
+            with open(manifest) as f:
+                entry = json.load(f)
+            attrs = {name: _decode(value, self.path)
+                     for name, value in entry.items()}
+        except (OSError, ValueError):
+            return None
+        os.utime(manifest)  # most recently used
+        return attrs
+
+    def store(self, key, attrs):
+        """store attributes of a run, returns False if an attribute can not
+        be stored"""
+        try:
+            entry = {name: _encode(value, self.path, '%s.%s' % (key, name))
+                     for name, value in attrs.items()}
+            data = json.dumps(entry)
+        except (TypeError, ValueError):
+            self.remove(key)
+            return False
+        _write_atomic(os.path.join(self.path, key + '.json'),
+                      lambda f: f.write(data.encode()))
+        self.evict()
+        return True
+
+    def evict(self):
+        """remove least recently used runs until the cache fits into
+        `max_bytes`"""
+        sizes = {}
+        used = {}
+        for name in os.listdir(self.path):
+            key = name.split('.')[0]
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            sizes[key] = sizes.get(key, 0) + stat.st_size
+            if name.endswith('.json'):
+                used[key] = stat.st_mtime
+        total = sum(sizes.values())
+        for key in sorted(used, key=used.get):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= sizes[key]
+
+    def remove(self, key):
+        """remove all files of key"""
+        for name in os.listdir(self.path):
+            if name.split('.')[0] == key:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+class TrialCache():
+    """Bounded in-memory cache of the attributes set by :func:`init_trial`
+
+    The least recently used entry is dropped when more than `max_size`
+    entries are stored.
+
+    Parameters
+    ----------
+    max_size : int
+        maximal number of cached trials
+
+    Attributes
+    ----------
+    hits : int
+        number of trials whose attributes were found in the cache
+    misses : int
+        number of trials for which :func:`init_trial` was called
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(run, trial):
+        """returns the cache key of trial, its run parameters and variable"""
+        return (json.dumps(run._parameters, sort_keys=True, default=str),
+                trial.variable)
+
+    def get(self, key):
+        """returns the cached attributes of key or None"""
+        attrs = self.entries.get(key)
+        if attrs is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return attrs
+
+    def put(self, key, attrs):
+        """store attributes of a trial"""
+        self.entries[key] = attrs
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _encode(value, path, name):
+    if isinstance(value, np.ndarray):
+        _write_atomic(os.path.join(path, name + '.npy'),
+                      lambda f: np.save(f, value))
+        return {'npy': name + '.npy'}
+    if isinstance(value, Stimulus):
+        return {'stimulus': value.to_json()}
+    if isinstance(value, list) and any(isinstance(val, np.ndarray)
+                                       for val in value):
+        return {'list': [_encode(val, path, '%s.%d' % (name, idx))
+                         for idx, val in enumerate(value)]}
+    json.dumps(value)  # raises TypeError for other objects
+    return {'value': value}
+
+
+def _decode(entry, path):
+    if 'npy' in entry:
+        return np.load(os.path.join(path, entry['npy']), mmap_mode='c')
+    if 'stimulus' in entry:
+        return from_json(entry['stimulus'])
+    if 'list' in entry:
+        return [_decode(val, path) for val in entry['list']]
+    return entry['value']
+
+
+@lru_cache(maxsize=None)
+def _earyx_digest():
+    """returns the md5 of the source files of earyx"""
+    md5 = hashlib.md5()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for path, dirs, files in sorted(os.walk(root)):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                with open(os.path.join(path, name), 'rb') as f:
+                    md5.update(f.read())
+    return md5.hexdigest()
+
+
+def _write_atomic(file_name, write):
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(file_name),
+                                   suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            write(f)
+        os.replace(tmp, file_name)
+    except BaseException:
+        os.remove(tmp)
+        raise
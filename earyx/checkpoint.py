@@ -0,0 +1,185 @@
+"""This module contains a class for incremental checkpoints of running
+experiments.
+
+It is part of the earyx toolbox for psychoacoustic experiments.
+"""
+from earyx.trial import Trial
+from earyx.run import History, RunningStats
+import json
+import os
+import shutil
+
+
+class Checkpoint():
+    """Incremental checkpoint of a running experiment
+
+    The checkpoint directory contains a header with the structural state of
+    the experiment at session start and a journal. Every presented and every
+    answered trial appends one line to the journal, so writing a checkpoint
+    costs the same for the first and the thousandth trial. The temporary
+    directory of the experiment's :class:`SaveLoad` is moved into the
+    checkpoint directory, so all signals written there survive a restart.
+    :func:`SaveLoad.clear_temp` at the end of the experiment removes the
+    checkpoint.
+
+    Attributes
+    ----------
+    path : str
+        checkpoint directory
+    experiment : Experiment-like object
+        experiment to checkpoint
+    info : dict
+        JSON serializable session information stored in the header
+    """
+
+    def __init__(self, path, experiment, info):
+        """create checkpoint and write its header
+
+        Parameters
+        ----------
+        path : str
+            checkpoint directory, must not exist yet
+        experiment : Experiment-like object
+        info : dict
+            session information, e.g. experiment name and ui settings
+        """
+        self.path = path
+        self.experiment = experiment
+        self.info = info
+        shutil.move(experiment._sl.temp_path, path)
+        experiment._sl.temp_path = path
+        header = {'info': info,
+                  'struct': json.loads(json.dumps(experiment,
+                                                  default=experiment._sl.to_json))}
+        with open(os.path.join(path, 'header.json'), 'w') as f:
+            json.dump(header, f)
+        self._journal = open(os.path.join(path, 'journal.txt'), 'a')
+
+    def present(self, run, trial):
+        """record a trial which is presented but not answered yet
+
+        Signals of the trial are saved, so the trial can be presented again
+        after a restart.
+        """
+        self.experiment._sl.unify_signals(trial)
+        self._write({'event': 'present', 'run': self._run_idx(run),
+                     'trial': self.experiment._sl.to_json(trial)})
+
+    def answer(self, run, trial):
+        """record an answered trial and the state of its run after adapt"""
+        self._write({'event': 'answer', 'run': self._run_idx(run),
+                     'trial': self.experiment._sl.to_json(trial),
+                     'state': self._run_state(run)})
+
+    def update_run(self, run):
+        """record the state of a run, e.g. after it was skipped"""
+        self._write({'event': 'run', 'run': self._run_idx(run),
+                     'state': self._run_state(run)})
+
+    def close(self):
+        self._journal.close()
+
+    @staticmethod
+    def read_info(path):
+        """returns the session information of the checkpoint at path"""
+        with open(os.path.join(path, 'header.json')) as f:
+            return json.load(f)['info']
+
+    @classmethod
+    def restore(cls, path, experiment):
+        """restore experiment state from checkpoint
+
+        Parameters
+        ----------
+        path : str
+            checkpoint directory
+        experiment : Experiment-like object
+            newly created experiment of the checkpointed class
+
+        Returns
+        -------
+        checkpoint : :class:`Checkpoint`
+            checkpoint to continue with
+        pending : tuple
+            (run, trial, signal) of the trial that was presented but not
+            answered, or None
+        """
+        sl = experiment._sl
+        sl.clear_temp()
+        sl.temp_path = path
+        for name in os.listdir(path):
+            if name[-4:] == '.wav':
+                # read on first access within the signal memory budget
+                sl.signals.add_file(name[:-4], os.path.join(path, name))
+        with open(os.path.join(path, 'header.json')) as f:
+            header = json.load(f)
+        sct = header['struct']
+        for idx, run in enumerate(experiment.runs):
+            del sct['runs'][idx]['trials']
+            run.__dict__.update(sct['runs'][idx])
+            run.history = History.from_json(run.history)
+            sl.separate_signals(run)
+        del sct['runs']
+        experiment.__dict__.update(sct)
+        sl.separate_signals(experiment)
+
+        pending = None
+        with open(os.path.join(path, 'journal.txt')) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # incomplete last line
+                    break
+                run = experiment.runs[entry['run']]
+                if entry['event'] == 'present':
+                    pending = (run, entry['trial'])
+                    continue
+                if entry['event'] == 'answer':
+                    trial = Trial.create_trial()
+                    trial.__dict__.update(entry['trial'])
+                    run.trials.append(trial)
+                    run.history.append(trial.variable, trial.answer,
+                                       trial.is_correct)
+                    pending = None
+                    reversals = getattr(run, 'reversals', None)
+                run.__dict__.update(entry['state'])
+                if entry['event'] == 'answer':
+                    # run state is journaled after adapt
+                    run.history.adapted(
+                        0 if run.finished else run.variable - trial.variable,
+                        getattr(run, 'reversals', None) != reversals)
+
+        for run in experiment.runs:
+            run.stats = RunningStats.from_run(run)
+            # runs prepared after the header was written
+            sl.separate_signals(run)
+
+        if pending:
+            run, dct = pending
+            trial = Trial.create_trial()
+            trial.__dict__.update(dct)
+            sl.separate_signals(trial)
+            pending = (run, trial, experiment.build_signal(trial))
+
+        checkpoint = cls.__new__(cls)
+        checkpoint.path = path
+        checkpoint.experiment = experiment
+        checkpoint.info = header['info']
+        checkpoint._journal = open(os.path.join(path, 'journal.txt'), 'a')
+        return checkpoint, pending
+
+    def _run_idx(self, run):
+        return self.experiment.runs.index(run)
+
+    def _run_state(self, run):
+        state = self.experiment._sl._create_dict(run)
+        del state['trials']
+        del state['history']
+        del state['stats']
+        state.pop('posterior', None)
+        del state['_parameters']
+        return state
+
+    def _write(self, entry):
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
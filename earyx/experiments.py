@@ -7,12 +7,16 @@ Class :class:`AFCExperiment` and :class:`MatchingExperiment` inherit from
 It is part of the earyx toolbox for psychoacoustic experiments. 
 """
 import random
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
 from itertools import product
 import earyx.adapt
+import earyx.stopping
 import earyx.exception as expt
-from earyx.run import Run
+from earyx.run import Run, RunningStats
 from earyx.trial import Trial
-from earyx.saveload import SaveLoad
+from earyx.saveload import SaveLoad, load_signal
+from earyx.cache import StimulusCache, TrialCache
 import datetime
 import time
 import numpy as np
@@ -80,6 +84,60 @@ class Experiment():
     task : str
         Description of experiment and description of what the test subjects have
         to do. This message is displayed befor the experimetn starts.
+    stream_audio : boolean (optional)
+        If **True** the browser GUI receives the trial signal in chunks of
+        `stream_chunk_size` samples and starts playback after the first chunk
+        instead of waiting for the whole signal. Default: False
+    stream_chunk_size : int (optional)
+        Number of samples per streamed chunk. Default: 8192
+    stream_window : int (optional)
+        Number of streamed chunks which may be in flight before the server
+        waits for the client connection to catch up. Default: 4
+    audio_backend : str (optional)
+        How audio is played from python. 'stream' plays from a callback in
+        the experiment process, 'process' from a separate process which
+        cannot be delayed by plotting or signal generation. Default: 'stream'
+    channel_map : list of int (optional)
+        Output channel of each signal channel. Signals can have the shape
+        (SAMPLES,) or (SAMPLES, CHANNELS). If **None** mono signals are
+        played on all output channels and signal channel i on output channel
+        i. Default: None
+    lazy_runs : boolean (optional)
+        If **True** :func:`init_run` of a run is called when its first trial
+        is built, see :func:`prepare_run`, so errors in `init_run` show up
+        during the session. The signals of a finished run are replaced by
+        empty lists, see :func:`release_run`. If **False** all runs are
+        initialized at experiment start and keep their signals.
+        Default: False
+    init_processes : int (optional)
+        Number of processes which call :func:`init_run` of all runs at
+        experiment start if `lazy_runs` is **False**. **None** uses all
+        cores. Default: 1
+    run_seed : int (optional)
+        seed of the random generators during :func:`init_run`, see
+        :func:`prepare_run`. Default: random, saved with the experiment
+    run_cache : boolean or str (optional)
+        If **True** or a directory, the attributes set by :func:`init_run`
+        are stored in `stimulus_cache`, a persistent
+        :class:`earyx.cache.StimulusCache`, and later sessions load them
+        instead of calling `init_run`. Only use it if `init_run` returns the
+        same signals for the same parameters. Default: False
+    run_cache_size : int (optional)
+        size of the run cache in bytes. Default: 1 GiB
+    trial_cache_size : int (optional)
+        If larger than 0, :func:`init_trial` is treated as a pure function of
+        the run parameters and the variable, and the attributes it sets for
+        the last `trial_cache_size` distinct pairs are kept in
+        `trial_cache`, a :class:`earyx.cache.TrialCache` with hit and miss
+        counters. Default: 0
+    signal_memory : int (optional)
+        bytes of saved signals kept in memory. Older signals are moved to
+        temporary files and the trials of finished runs only keep handles to
+        them, see :class:`earyx.saveload.SignalStore`. Default: 256 MiB
+    stopping_rules : list (optional)
+        list of stopping rules which end a run before its adapt rule does.
+        For simple handling there is the method :func:`add_stopping_rule`.
+        Default: []
     """
 
     def __init__(self):
@@ -111,7 +169,30 @@ class Experiment():
         self.feedback = True
         self.debug = True
         self.visual_indicator = True
+        self.stream_audio = False
+        self.stream_chunk_size = 8192
+        self.stream_window = 4
+        self.audio_backend = 'stream'
+        self.channel_map = None
+        self.lazy_runs = False
+        self.init_processes = 1
+        self.run_seed = None
+        self.run_cache = False
+        self.run_cache_size = 2**30
+        self.trial_cache_size = 0
+        self.signal_memory = 2**28
+        self.stopping_rules = []
         self.init_experiment(self)
+        if self.run_seed is None:
+            self.run_seed = random.getrandbits(32)
+        self.trial_cache = (TrialCache(self.trial_cache_size)
+                            if self.trial_cache_size else None)
+        self.stimulus_cache = None
+        if self.run_cache:
+            self.stimulus_cache = StimulusCache(
+                None if self.run_cache is True else self.run_cache,
+                self.run_cache_size)
+        self._sl.signals.max_bytes = self.signal_memory
         self.time_to_signal(self)
         self._sl.unify_signals(self)
         self._generate_runs()
@@ -138,18 +219,88 @@ class Experiment():
                 params.update(param)
 
             adapt_settings = combi[0]
-            AdaptClass = getattr(earyx.adapt,
-                                      "Adapt%s" % adapt_settings["type"])
-            RunClass = type('Run'+adapt_settings["type"],(Run,AdaptClass,),{})
+            RunClass = _run_class(adapt_settings["type"])
             run = RunClass(params, self.variable["start_val"],
                                  adapt_settings, self.reference_signal,
                                  self.pre_signal, self.between_signal,
                                  self.post_signal, self.sample_rate, self.calib)
-            
+            self.runs.append(run)
+        if self.lazy_runs:
+            return
+        if (self.init_processes != 1 and len(self.runs) > 1 and
+                'fork' in multiprocessing.get_all_start_methods()):
+            self._prepare_runs_parallel()
+        for run in self.runs:
+            if not run.prepared:
+                self.prepare_run(run)
+
+    def prepare_run(self, run):
+        """build the signals of a run
+
+        :func:`init_run` is called, the signals are converted and saved. With
+        `lazy_runs` this happens when the first trial of the run is built by
+        :func:`next_trial`, else at experiment start. The random generators
+        of :mod:`random` and :mod:`numpy.random` are seeded from `run_seed`
+        and the index of the run during :func:`init_run`, so the signals of a
+        run do not depend on the order in which runs are prepared.
+
+        Parameters
+        ----------
+        run : :class:`Run`
+        """
+        self._init_run(self.runs.index(run))
+        self._sl.unify_signals(run)
+        run.prepared = True
+
+    def _init_run(self, idx):
+        run = self.runs[idx]
+        key = None
+        cache = self.stimulus_cache
+        if cache is not None:
+            key = cache.key(self, run)
+            attrs = cache.load(key) if key else None
+            if attrs is not None:
+                run.__dict__.update(attrs)
+                return
+        before = dict(run.__dict__)
+        states = random.getstate(), np.random.get_state()
+        seed = int(np.random.SeedSequence([self.run_seed, idx]).generate_state(1)[0])
+        random.seed(seed)
+        np.random.seed(seed)
+        try:
             self.init_run(run)
             self.time_to_signal(run)
-            self.runs.append(run)
+        finally:
+            random.setstate(states[0])
+            np.random.set_state(states[1])
+        if key:
+            cache.store(key, _changed_attrs(run, before))
+
+    def _prepare_runs_parallel(self):
+        """call :func:`init_run` of all runs in a pool of forked processes,
+        signals are returned through shared memory"""
+        global _pool_experiment
+        _pool_experiment = self
+        try:
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(self.init_processes) as pool:
+                for idx, name, arrays, attrs in pool.imap_unordered(
+                        _init_run_in_pool, range(len(self.runs))):
+                    run = self.runs[idx]
+                    run.__dict__.update(attrs)
+                    if name:
+                        run.__dict__.update(_unpack_arrays(name, arrays))
+        finally:
+            _pool_experiment = None
+        for run in self.runs:
             self._sl.unify_signals(run)
+            run.prepared = True
+
+    def release_run(self, run):
+        """drop the signals of a finished run if `lazy_runs` is set, they
+        are already saved"""
+        for name in self._sl.signal_names:
+            setattr(run, name, [])
 
     def add_parameter(self,name,values,unit,description=""):
         """Adds a new parameter to the experiment.
@@ -224,6 +375,9 @@ class Experiment():
             2up1down
             1up3down
             WUD (weighted up down)
+            KUpNDown (any transformed up-down rule, see
+            :class:`earyx.adapt.AdaptKUpNDown`)
+            Psi and Quest (Bayesian rules, see :class:`earyx.adapt.AdaptPsi`)
         max_reversals : int
             number of reversals the trial is running
         start_step : int
@@ -233,12 +387,39 @@ class Experiment():
         kwargs : dict (optional)
             dict of keywords and arguments may used for special adapt method
             WUD needs key: pc_convergence  value: float 0..1
+            KUpNDown takes keys k and n (int) and step_rule ('halve' or
+            'minstep')
+            Psi and Quest take keys max_trials, guess, lapse, level_range
+            and slope_range or slope
         """
         new_adapt = {"type": adapt_method, "max_reversals": max_reversals,
                      "start_step": start_step, "minstep": min_step}
         new_adapt.update(kwargs)
         self.adapt_settings.append(new_adapt)
 
+    def add_stopping_rule(self, rule="Confidence", **kwargs):
+        """Add a rule which ends runs as soon as their estimate is precise
+        enough.
+
+        Rules are checked after each :func:`adapt`, see
+        :mod:`earyx.stopping`.
+
+        Parameters
+        ----------
+        rule : str
+            Confidence (confidence interval of the mean of the measurement
+            phase, keys width and confidence),
+            Posterior (posterior standard deviation of Bayesian adapt rules,
+            key sd) or
+            StableMedian (median of the measurement phase, keys window and
+            tolerance)
+        kwargs : dict (optional)
+            settings of the rule, all rules take min_trials
+        """
+        new_rule = {"type": rule}
+        new_rule.update(kwargs)
+        self.stopping_rules.append(new_rule)
+
     def build_signal(self):
         """ specific build is made by  method of the different experiment classes.
         """
@@ -261,28 +442,66 @@ class Experiment():
         """
         trial.answer = answer
         trial.is_correct = trial.answer == trial.correct_answer
+        trial.timing.setdefault('answer', time.perf_counter_ns())
         run.trials.append(trial)
+        run.history.append(trial.variable, trial.answer, trial.is_correct)
+        if run.start_measurement_idx is not None:
+            run.stats.add(trial.variable)
 
     def adapt(self, run):
-        """ apply selected adapt rule to variable"""
+        """ apply selected adapt rule to variable and check the stopping
+        rules"""
         try:
-            step = run.adapt(run.trials)
-        except expt.RunFinishedException:
-            run.finished = time.strftime('%d-%b-%Y__%H:%M:%S')
-            if self.discard_unfinished_runs:
-                for tr in run.trials:
-                    self._sl.unify_signals(tr)
-                self._sl.update_struct()
-            raise
+            self._adapt(run)
+            self._check_stopping(run)
+        finally:
+            run.trials[-1].timing['adapt_done'] = time.perf_counter_ns()
+
+    def _adapt(self, run):
+        reversals = getattr(run, 'reversals', None)
+        start_measurement_idx = run.start_measurement_idx
+        finished = None
+        try:
+            step = run.adapt(run.history)
+        except expt.RunFinishedException as e:
+            finished = e
+        if (start_measurement_idx is None and
+                run.start_measurement_idx is not None):
+            # rules like Psi count the answered trials to the measurement
+            run.stats = RunningStats.from_run(run)
+        if finished is not None:
+            run.history.adapted(0, True)
+            self._finish_run(run)
+            raise finished
+        run.history.adapted(step, getattr(run, 'reversals', None) != reversals)
         run.variable += step
         if not self.discard_unfinished_runs:
             self._sl.unify_signals(run.trials[-1])
+            self._sl.release_signals(run.trials[-1])
             self._sl.update_struct()
-        if abs(step) == run.minstep and not run.start_measurement_idx:
+        if abs(step) == run.minstep and run.start_measurement_idx is None:
             run.start_measurement_idx = len(run.trials)
             if not self.discard_unfinished_runs:
                 self._sl.update_struct()
             raise expt.RunStartMeasurement
+
+    def _check_stopping(self, run):
+        for setting in self.stopping_rules:
+            rule = getattr(earyx.stopping, "Stop%s" % setting["type"])(setting)
+            if rule(run):
+                run.stopped_by = setting["type"]
+                self._finish_run(run)
+                raise expt.RunFinishedException()
+
+    def _finish_run(self, run):
+        run.finished = time.strftime('%d-%b-%Y__%H:%M:%S')
+        # without discard_unfinished_runs only the last trial is not saved yet
+        for tr in run.trials:
+            self._sl.unify_signals(tr)
+            self._sl.release_signals(tr)
+        self._sl.update_struct()
+        if self.lazy_runs:
+            self.release_run(run)
         
 
     def load(self):
@@ -366,19 +585,125 @@ class Experiment():
         signal : list of numpy arrays
         
         """
+        if not run.prepared:
+            self.prepare_run(run)
         trial = self.generate_trial(run)
         trial.correct_answer = self.correct_answer()
-        self.init_trial(trial)
-        self.time_to_signal(trial)
+        trial.seed = random.getrandbits(31)
+        trial.timing['synthesis_start'] = time.perf_counter_ns()
+        self._init_trial(run, trial)
         signal = self.build_signal(trial)
+        trial.timing['synthesis_end'] = time.perf_counter_ns()
         return trial, signal
 
+    def _init_trial(self, run, trial):
+        if self.trial_cache is None:
+            self.init_trial(trial)
+            self.time_to_signal(trial)
+            return
+        key = self.trial_cache.key(run, trial)
+        attrs = self.trial_cache.get(key)
+        if attrs is not None:
+            trial.__dict__.update(attrs)
+            return
+        before = dict(trial.__dict__)
+        self.init_trial(trial)
+        self.time_to_signal(trial)
+        attrs = _changed_attrs(trial, before)
+        for name, value in attrs.items():
+            if isinstance(value, np.ndarray):
+                # the saved copy is contiguous, so unify_signals keeps it
+                attrs[name] = np.ascontiguousarray(value)
+        trial.__dict__.update(attrs)
+        self.trial_cache.put(key, attrs)
+
     def skip_run(self, run):
         """ sets skipped to True
         """
         run.skipped = True
 
  
+_run_classes = {}
+
+
+def _run_class(adapt_type):
+    """returns the run class of an adapt rule, created once per rule"""
+    if adapt_type not in _run_classes:
+        AdaptClass = getattr(earyx.adapt, "Adapt%s" % adapt_type)
+        _run_classes[adapt_type] = type('Run'+adapt_type, (Run, AdaptClass,),
+                                        {})
+    return _run_classes[adapt_type]
+
+
+_pool_experiment = None
+
+
+def _init_run_in_pool(idx):
+    """prepare run idx of the experiment inherited from the parent process,
+    returns its new attributes with numpy arrays in shared memory"""
+    run = _pool_experiment.runs[idx]
+    before = dict(run.__dict__)
+    _pool_experiment._init_run(idx)
+    changed = _changed_attrs(run, before)
+    arrays = {}
+    for key, value in changed.items():
+        if isinstance(value, np.ndarray):
+            arrays[key] = value
+        elif (isinstance(value, list) and value and
+              all(isinstance(val, np.ndarray) for val in value)):
+            arrays[key] = list(value)
+    attrs = {key: value for key, value in changed.items()
+             if key not in arrays}
+    name, layout = _pack_arrays(arrays)
+    return idx, name, layout, attrs
+
+
+def _changed_attrs(obj, before):
+    """returns the attributes of obj which were set after before was
+    copied from its __dict__"""
+    return {key: value for key, value in obj.__dict__.items()
+            if key not in before or value is not before[key]}
+
+
+def _pack_arrays(arrays):
+    """copy arrays and lists of arrays into one shared memory block, returns
+    its name and the layout for :func:`_unpack_arrays`"""
+    flat = [(key, pos, np.ascontiguousarray(arr))
+            for key, value in arrays.items()
+            for pos, arr in enumerate(value if isinstance(value, list)
+                                      else [value])]
+    size = sum(arr.nbytes for _, _, arr in flat)
+    if not size:
+        return None, {}
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    # the parent unlinks the block, the resource tracker of this process
+    # must not remove it when the process ends
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    layout = {key: (isinstance(value, list), [])
+              for key, value in arrays.items()}
+    offset = 0
+    for key, pos, arr in flat:
+        shm.buf[offset:offset+arr.nbytes] = arr.view(np.uint8).ravel()
+        layout[key][1].append((offset, arr.shape, arr.dtype.str))
+        offset += arr.nbytes
+    shm.close()
+    return shm.name, layout
+
+
+def _unpack_arrays(name, layout):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        attrs = {}
+        for key, (is_list, items) in layout.items():
+            values = [np.ndarray(shape, dtype, shm.buf, offset).copy()
+                      for offset, shape, dtype in items]
+            attrs[key] = values if is_list else values[0]
+        return attrs
+    finally:
+        shm.close()
+        shm.unlink()
+
+
 class AFCExperiment(Experiment):
     """This class provides basic functions for an N-AFC experiment using
     the methods :func:`generate_trial`, :func:`build_signal` and :func:`check_answer`.
@@ -489,8 +814,17 @@ class MatchingExperiment(Experiment):
         (0) set randomly,
         (1) the first one, or
         (2) the second one.
+    continuous : boolean
+        If **True** and audio is played from python, the signal of the first
+        trial of a run is played in a loop without stopping. Each answer only
+        changes the gain of the test signal in the loop, see
+        :func:`loop_gain`, instead of building a new signal.
+    loop_ramp : float
+        Duration of the gain ramp in continuous mode in seconds.
     """
     ref_position = 1 #default
+    continuous = False
+    loop_ramp = 0.02
     
     def correct_answer(self):
         """set correct answer for given trial
@@ -504,6 +838,66 @@ class MatchingExperiment(Experiment):
             depending on eperiment type return correct answer      
         """
         return 'd'
+
+    def next_trial(self, run):
+        """build next trial, see :func:`Experiment.next_trial`
+
+        In continuous mode the trial remembers its variable as
+        `loop_variable`, the variable its test signal was built for.
+        """
+        trial, signal = super().next_trial(run)
+        if self.continuous:
+            trial.loop_variable = trial.variable
+        return trial, signal
+
+    def next_loop_trial(self, run, loop_trial):
+        """build next trial of a run played in continuous mode
+
+        No signal is synthesized, the trial shares the signals of the
+        trial whose signal is played in the loop.
+
+        Parameters
+        ----------
+        run : :class:`Run`
+        loop_trial : :class:`Trial`
+            trial whose signal is played in the loop
+
+        Returns
+        -------
+        trial : :class:`Trial`
+        signal : list of numpy arrays
+            signal of the loop
+        """
+        if not run.prepared:
+            self.prepare_run(run)
+        trial = self.generate_trial(run)
+        trial.correct_answer = self.correct_answer()
+        trial.seed = loop_trial.seed
+        trial.test_signal = load_signal(loop_trial.test_signal)
+        trial.loop_variable = loop_trial.loop_variable
+        return trial, self.build_signal(trial)
+
+    def loop_parts(self, trial, signal):
+        """returns the indices of the test signal parts in `signal`"""
+        return [idx for idx, part in enumerate(signal)
+                if part is trial.test_signal]
+
+    def loop_gain(self, trial):
+        """linear gain of the test signal in continuous mode
+
+        By default the variable is the level of the test signal in dB.
+        Override this method for other variables.
+
+        Parameters
+        ----------
+        trial : :class:`Trial`
+
+        Returns
+        -------
+        gain : float
+            gain relative to the test signal of the loop
+        """
+        return 10**((trial.variable - trial.loop_variable)/20)
         
 
     def build_signal(self,trial):
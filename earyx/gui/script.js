@@ -1,6 +1,16 @@
 var context;
 var gainNode;
 var buffers = [];
+var stream = null;
+var streamJitter = 0.05; // seconds buffered before streamed playback starts
+var track = null;
+var protocolVersion = 1;
+// message type codes of the compact encoding, same order as
+// MESSAGE_TYPES in earyx/server.py
+var messageTypes = ['params', 'task', 'feedback', 'audio', 'but1', 'but2',
+                    'but3', 'but4', 'plot', 'desc', 'debug_state', 'name',
+                    'allow_plot', 'run_finished', 'quit', 'render',
+                    'stream_start', 'resume'];
 window.addEventListener('load', init, false);
 function init() {
   try {
@@ -30,8 +40,8 @@ for (var i = 0; i < metaTags.length; i++) {
 console.log(cid);
 
 
-var ws = new WebSocket("ws://"+window.location.hostname+":8888/earyx/"+cid)
-ws.binaryType = 'arraybuffer';
+var ws;
+connect();
 var exp_finish = false;
 var subject_name = false
 var allow_debug = false
@@ -70,16 +80,35 @@ function getRandomColor() {
 window.addEventListener('touchstart', unlock, false);
 
 
-ws.onclose = function() {
+function connect() {
+    /* function opens the websocket of this client. After a reconnect the
+       server presents the pending trial again.
+
+       Parameters:
+       -----------
+       no input arguments
+
+       Returns:
+       --------
+       no return arguments
+    */
+    ws = new WebSocket("ws://"+window.location.hostname+":8888/earyx/"+cid)
+    ws.binaryType = 'arraybuffer';
+    ws.onopen = ws_open;
+    ws.onclose = ws_close;
+    ws.onmessage = ws_message;
+}
+
+function ws_close() {
     if (exp_finish == false) {
         console.log('connection lost. Try to reconnect...')
-        ws = new WebSocket("ws://"+window.location.hostname+":8888/earyx/"+cid)
-        ws.binaryType = 'arraybuffer';
+        setTimeout(connect, 1000)
     }
 }
 
-ws.onopen = function() {
-    /* function gets called automatically on start of websocket
+function ws_open() {
+    /* function gets called automatically on start of websocket. Clients
+       opened with ?encoding=binary request the compact binary encoding.
        
        Parameters:
        -----------
@@ -90,10 +119,12 @@ ws.onopen = function() {
        no return arguments
        
     */
+    if (window.location.search.indexOf('encoding=binary') != -1)
+        send_msg('encoding', 'binary')
 };
 
 
-ws.onmessage = function (event) {
+function ws_message(event) {
     /* function handles incoming events
        
        Parameters:
@@ -105,25 +136,113 @@ ws.onmessage = function (event) {
        --------
        no return arguments
        
-       Function either sets texts in divs or sends messages to server via 
-       'send_msg' function
+       Function decodes the frame and passes all contained messages to
+       'handle_message'
        
     */
+    var data = null;
     if (event.data.constructor.name === "ArrayBuffer") {
         var headerLen = new Int32Array(event.data, 0, 1)[0];
+        if (headerLen == -1) {
+            dispatch(decode_compact(event.data), null);
+            return
+        }
         var header = String.fromCharCode.apply(null, new Uint8Array(event.data, 4, headerLen));
-        var data = event.data.slice(headerLen+4)
+        data = event.data.slice(headerLen+4)
     } else {
         var header = event.data;
     }
     try {
-        msg = JSON.parse(header);
+        var msg = JSON.parse(header);
     } catch (e) {
         console.error("Message", e.message, "is not a valid JSON object");
         return
     }
+    dispatch(msg, data)
+};
+
 
+function dispatch(msg, data) {
+    /* function handles a single message or all messages of an envelope
 
+       Parameters:
+       -----------
+       msg : message or envelope {v: version, msgs: [...]}
+
+       data : binary payload of a single message or null
+
+       Returns:
+       --------
+       no return arguments
+    */
+    if (msg.v == null) {
+        handle_message(msg, data)
+        return
+    }
+    if (msg.v > protocolVersion)
+        console.error('unsupported protocol version', msg.v)
+    for (var i = 0; i < msg.msgs.length; i++)
+        handle_message(msg.msgs[i], null)
+};
+
+
+function decode_compact(buffer) {
+    /* function decodes a binary envelope, see EchoWebSocket.encode_compact
+
+       Parameters:
+       -----------
+       buffer : ArrayBuffer starting with int32 -1
+
+       Returns:
+       --------
+       envelope {v: version, msgs: [...]}
+    */
+    var view = new DataView(buffer);
+    var decoder = new TextDecoder('utf-8');
+    var version = view.getUint8(4);
+    var count = view.getUint16(5, true);
+    var pos = 7;
+    var msgs = [];
+    for (var i = 0; i < count; i++) {
+        var type = messageTypes[view.getUint8(pos)];
+        var tag = view.getUint8(pos+1);
+        pos += 2;
+        var content = null;
+        if (tag == 1 || tag == 2)
+            content = (tag == 2);
+        else if (tag == 3) {
+            content = view.getFloat64(pos, true);
+            pos += 8;
+        }
+        else if (tag == 4 || tag == 5) {
+            var len = view.getUint32(pos, true);
+            content = decoder.decode(new Uint8Array(buffer, pos+4, len));
+            if (tag == 5)
+                content = JSON.parse(content);
+            pos += 4 + len;
+        }
+        msgs.push({type: type, content: content});
+    }
+    return {v: version, msgs: msgs}
+};
+
+
+function handle_message(msg, data) {
+    /* function handles a single message
+
+       Parameters:
+       -----------
+       msg : message {type: ..., content: ...}
+
+       data : binary payload or null
+
+       Returns:
+       --------
+       no return arguments
+
+       Function either sets texts in divs or sends messages to server via
+       'send_msg' function
+    */
     if (msg.type == 'params' || msg.type == 'feedback' || msg.type == 'task') {
 	    document.getElementById(msg.type).innerHTML = msg.content;
     }
@@ -136,12 +255,6 @@ ws.onmessage = function (event) {
    
 
     if (msg.type == 'play') {
-        var id = 0;
-        var times = msg.content
-        // calc sum length of all signals
-        var len = times.reduce(function(prev, cur) {
-            return prev + cur;
-        });
         context.decodeAudioData(data, function(decodedData) {
             var source = context.createBufferSource();
             source.buffer = decodedData
@@ -149,33 +262,24 @@ ws.onmessage = function (event) {
             gainNode.connect(context.destination);
             source.start(0);
         });
-
-        var delay = 0;
-        var btnNr = 1
-        for(var i=1;i<=times.length;i++) {
-            delay += times[i-1];
-            if (i % 2 == 0) {
-                btnNr++;
-            }
-            setTimeout(
-                (function(s, n) {
-                    return function() {
-                        if (s % 2 != 0) {
-                            document.getElementById('but'+n).style.backgroundColor = 'red'
-                            document.getElementById('but'+n).disabled = false
-                            console.log(n)
-                        } else {
-                            document.getElementById('but'+(n-1)).style.backgroundColor = 'white'
-                            console.log(n)
-                        }
-                    }
-                })(i,btnNr), delay*1000);
-        }
+        indicate(msg.content, 0)
     };
 
+    if (msg.type == 'render')
+        play_description(msg.content)
+
+    if (msg.type == 'stream_start')
+        stream_start(msg.content)
+
+    if (msg.type == 'chunk')
+        stream_chunk(msg.content, data)
+
+    if (msg.type == 'audio' && msg.content == 'clear')
+        stream_stop()
+
 
     if (msg.type == 'allow_plot') {
-        console.log(content)
+        console.log(msg.content)
         if (msg.content == false)
 	    document.getElementById("dbgBtn").hidden = true;
 	else
@@ -196,6 +300,11 @@ ws.onmessage = function (event) {
     else if (msg.type == 'desc')
 	alert(msg.content)
 
+    else if (msg.type == 'resume') {
+	subject_name = true
+	document.getElementById("sqBtn").value = "quit experiment"
+    }
+
     else if (msg.type == 'but1' || msg.type == 'but2'
 	     || msg.type == 'but3' || msg.type == 'but4') {
 	    document.getElementById(msg.type).style.backgroundColor = msg.content
@@ -210,7 +319,7 @@ ws.onmessage = function (event) {
     }
 
     else if (msg.type == 'plot')
-        plot(msg.content)
+        plot_update(msg.content)
 
     else if (msg.type == 'name') {
 	if (msg.content != '') {
@@ -220,6 +329,381 @@ ws.onmessage = function (event) {
 };
 
 
+function indicate(times, offset) {
+    /* function lets the answer buttons blink simultaneous to the signal parts
+
+       Parameters:
+       -----------
+       times : list of durations of all signal parts in seconds
+
+       offset : delay of the playback start in seconds
+
+       Returns:
+       --------
+       no return arguments
+    */
+    var delay = offset;
+    var btnNr = 1
+    for(var i=1;i<=times.length;i++) {
+        delay += times[i-1];
+        if (i % 2 == 0) {
+            btnNr++;
+        }
+        setTimeout(
+            (function(s, n) {
+                return function() {
+                    if (s % 2 != 0) {
+                        document.getElementById('but'+n).style.backgroundColor = 'red'
+                        document.getElementById('but'+n).disabled = false
+                        console.log(n)
+                    } else {
+                        document.getElementById('but'+(n-1)).style.backgroundColor = 'white'
+                        console.log(n)
+                    }
+                }
+            })(i,btnNr), delay*1000);
+    }
+};
+
+function stream_start(content) {
+    /* function prepares playback of a streamed signal
+
+       Parameters:
+       -----------
+       content : stream description containing id, times, sample_rate,
+       channels and number of chunks
+
+       Returns:
+       --------
+       no return arguments
+    */
+    stream_stop()
+    stream = {id: content.id,
+              times: content.times,
+              sample_rate: content.sample_rate,
+              channels: content.channels,
+              next_seq: 0,
+              pending: {},
+              sources: [],
+              next_time: null}
+};
+
+function stream_chunk(content, data) {
+    /* function puts a received chunk into the jitter buffer and schedules
+       all chunks which are complete in sequence
+
+       Parameters:
+       -----------
+       content : chunk header containing stream id and sequence number
+
+       data : interleaved float32 samples
+
+       Returns:
+       --------
+       no return arguments
+    */
+    if (stream == null || content.id != stream.id)
+        return
+    stream.pending[content.seq] = new Float32Array(data)
+    while (stream.next_seq in stream.pending) {
+        var samples = stream.pending[stream.next_seq]
+        delete stream.pending[stream.next_seq]
+        stream_schedule(samples)
+        stream.next_seq++
+    }
+};
+
+function stream_schedule(samples) {
+    /* function schedules one chunk gapless after the previous one. Playback
+       starts streamJitter seconds after the first chunk has arrived. If a
+       chunk arrives too late, the stream is re-anchored to the current time.
+
+       Parameters:
+       -----------
+       samples : interleaved float32 samples
+
+       Returns:
+       --------
+       no return arguments
+    */
+    var frames = samples.length / stream.channels
+    var buffer = context.createBuffer(stream.channels, frames, stream.sample_rate)
+    for (var ch = 0; ch < stream.channels; ch++) {
+        var channel = buffer.getChannelData(ch)
+        for (var i = 0; i < frames; i++)
+            channel[i] = samples[i*stream.channels + ch]
+    }
+    var source = context.createBufferSource()
+    source.buffer = buffer
+    source.connect(gainNode)
+    gainNode.connect(context.destination)
+    if (stream.next_time == null) {
+        stream.next_time = context.currentTime + streamJitter
+        indicate(stream.times, streamJitter)
+    }
+    else if (stream.next_time < context.currentTime) {
+        console.log('stream underrun')
+        stream.next_time = context.currentTime + streamJitter
+    }
+    source.start(stream.next_time)
+    stream.next_time += buffer.duration
+    stream.sources.push(source)
+};
+
+function stream_stop() {
+    /* function stops the playback of the current stream
+
+       Parameters:
+       -----------
+       no input arguments
+
+       Returns:
+       --------
+       no return arguments
+    */
+    if (stream == null)
+        return
+    for (var i = 0; i < stream.sources.length; i++)
+        stream.sources[i].stop()
+    stream = null
+};
+
+function play_description(content) {
+    /* function renders a stimulus description (see earyx/stimulus.py) and
+       plays it back
+
+       Parameters:
+       -----------
+       content : description containing parts, seed and sample_rate
+
+       Returns:
+       --------
+       no return arguments
+    */
+    var parts = [];
+    var times = [];
+    var len = 0;
+    for (var i = 0; i < content.parts.length; i++) {
+        var keys = new NoiseKeys(content.seed, i);
+        parts.push(render_node(content.parts[i], content.sample_rate, keys));
+        times.push(parts[i].length / content.sample_rate);
+        len += parts[i].length;
+    }
+    var buffer = context.createBuffer(1, Math.max(len, 1), content.sample_rate);
+    var channel = buffer.getChannelData(0);
+    var pos = 0;
+    for (var i = 0; i < parts.length; i++) {
+        channel.set(parts[i], pos);
+        pos += parts[i].length;
+    }
+    var source = context.createBufferSource();
+    source.buffer = buffer;
+    source.connect(gainNode);
+    gainNode.connect(context.destination);
+    source.start(0);
+    indicate(times, 0);
+};
+
+function render_node(node, fs, keys) {
+    /* function renders one stimulus node like Stimulus.render in
+       earyx/stimulus.py
+
+       Parameters:
+       -----------
+       node : JSON description of the node
+
+       fs : sampling rate
+
+       keys : NoiseKeys of the current signal part
+
+       Returns:
+       --------
+       Float64Array containing the rendered node
+    */
+    if (node.type == 'silence')
+        return new Float64Array(samples(node.duration, fs));
+
+    if (node.type == 'sine') {
+        var out = new Float64Array(samples(node.duration, fs));
+        for (var i = 0; i < out.length; i++)
+            out[i] = node.ampl * Math.sin(2*Math.PI*(node.freq*i/fs + node.phase/360));
+        return out;
+    }
+
+    if (node.type == 'htc') {
+        var out = new Float64Array(samples(node.duration, fs));
+        var start_nr = Math.ceil(node.f_start/node.f0);
+        var end_nr = Math.floor(node.f_end/node.f0);
+        var N = end_nr - start_nr + 1;
+        var comp_ampl_db = 10*((node.ampl/10) - Math.log10(N));
+        var ampl = Math.sqrt(2)*Math.pow(10, (comp_ampl_db-node.calib)/20);
+        for (var n = start_nr; n <= end_nr; n++) {
+            var phase = node.C*Math.PI*n*(n-1)/N;
+            for (var i = 0; i < out.length; i++)
+                out[i] += ampl * Math.sin(2*Math.PI*n*node.f0*i/fs + phase);
+        }
+        return out;
+    }
+
+    if (node.type == 'noise') {
+        var num = samples(node.duration, fs);
+        var key = keys.next(node.seed);
+        var out;
+        if (node.f1 == null || node.f2 == null)
+            out = gauss(key, num);
+        else {
+            var fft_len = 2;
+            while (fft_len < num)
+                fft_len *= 2;
+            var first = Math.min(Math.max(Math.ceil(node.f1*fft_len/fs), 0), fft_len/2);
+            var last = Math.min(Math.max(Math.floor(node.f2*fft_len/fs), first), fft_len/2);
+            var coeffs = gauss(key, 2*(last-first+1));
+            var re = new Float64Array(fft_len);
+            var im = new Float64Array(fft_len);
+            for (var k = first; k <= last; k++) {
+                re[k] = coeffs[2*(k-first)];
+                im[k] = (k == 0 || k == fft_len/2) ? 0 : coeffs[2*(k-first)+1];
+                if (k > 0 && k < fft_len/2) {
+                    re[fft_len-k] = re[k];
+                    im[fft_len-k] = -im[k];
+                }
+            }
+            ifft(re, im);
+            out = re.subarray(0, num);
+        }
+        var sum = 0;
+        for (var i = 0; i < out.length; i++)
+            sum += out[i]*out[i];
+        var noise_rms = Math.sqrt(sum/out.length);
+        if (noise_rms > 0)
+            for (var i = 0; i < out.length; i++)
+                out[i] = out[i]/noise_rms*node.ampl;
+        return out;
+    }
+
+    if (node.type == 'ramp') {
+        // same window as hanwin in earyx/utils.py
+        var out = render_node(node.input, fs, keys);
+        var flank = samples(node.ramp, fs);
+        var han = function(i, n) {
+            return 0.5*(1 + Math.cos(-Math.PI + 2*Math.PI/(n-1)*i));
+        };
+        if (2*flank > out.length) {
+            for (var i = 0; i < out.length; i++)
+                out[i] *= han(i, out.length);
+        }
+        else if (flank > 0) {
+            for (var i = 0; i <= flank; i++)
+                out[i] *= han(i, 2*flank);
+            for (var i = 0; i < flank-1; i++)
+                out[out.length-1-i] *= han(i, 2*flank);
+        }
+        return out;
+    }
+
+    if (node.type == 'gain') {
+        var out = render_node(node.input, fs, keys);
+        for (var i = 0; i < out.length; i++)
+            out[i] *= node.factor;
+        return out;
+    }
+
+    if (node.type == 'delay') {
+        var sig = render_node(node.input, fs, keys);
+        var out = new Float64Array(samples(node.time, fs) + sig.length);
+        out.set(sig, out.length - sig.length);
+        return out;
+    }
+
+    if (node.type == 'mix') {
+        var sigs = node.inputs.map(function(inp) { return render_node(inp, fs, keys); });
+        var out = new Float64Array(Math.max.apply(null, sigs.map(function(sig) { return sig.length; })));
+        for (var j = 0; j < sigs.length; j++)
+            for (var i = 0; i < sigs[j].length; i++)
+                out[i] += sigs[j][i];
+        return out;
+    }
+
+    if (node.type == 'concat') {
+        var sigs = node.inputs.map(function(inp) { return render_node(inp, fs, keys); });
+        var out = new Float64Array(sigs.reduce(function(len, sig) { return len + sig.length; }, 0));
+        var pos = 0;
+        for (var j = 0; j < sigs.length; j++) {
+            out.set(sigs[j], pos);
+            pos += sigs[j].length;
+        }
+        return out;
+    }
+    console.error('unknown stimulus node', node.type);
+    return new Float64Array(0);
+};
+
+function samples(time, fs) {
+    return Math.round(time*fs);
+};
+
+function hash(x) {
+    /* 32 bit integer hash, identical to _hash in earyx/stimulus.py */
+    x = x >>> 0;
+    x ^= x >>> 16;
+    x = Math.imul(x, 0x7feb352d);
+    x ^= x >>> 15;
+    x = Math.imul(x, 0x846ca68b);
+    x ^= x >>> 16;
+    return x >>> 0;
+};
+
+function gauss(key, num) {
+    /* num gaussian random numbers of noise stream key (Box-Muller) */
+    var out = new Float64Array(num);
+    for (var i = 0; i < num; i++) {
+        var u1 = (hash(key + 2*i) + 0.5) / 4294967296;
+        var u2 = (hash(key + 2*i + 1) + 0.5) / 4294967296;
+        out[i] = Math.sqrt(-2*Math.log(u1)) * Math.cos(2*Math.PI*u2);
+    }
+    return out;
+};
+
+function NoiseKeys(seed, part) {
+    /* hands out the keys of all noise streams of one signal part */
+    this.base = hash(hash(seed) + part);
+    this.counter = 0;
+    this.next = function(seed) {
+        if (seed != null)
+            return hash(seed);
+        this.counter++;
+        return hash(this.base + this.counter);
+    };
+};
+
+function ifft(re, im) {
+    /* in place inverse radix-2 FFT without normalisation */
+    var n = re.length;
+    for (var i = 1, j = 0; i < n; i++) {
+        var bit = n >> 1;
+        for (; j & bit; bit >>= 1)
+            j ^= bit;
+        j ^= bit;
+        if (i < j) {
+            var t = re[i]; re[i] = re[j]; re[j] = t;
+            t = im[i]; im[i] = im[j]; im[j] = t;
+        }
+    }
+    for (var len = 2; len <= n; len <<= 1) {
+        var ang = 2*Math.PI/len;
+        for (var i = 0; i < n; i += len) {
+            for (var k = 0; k < len/2; k++) {
+                var wr = Math.cos(ang*k), wi = Math.sin(ang*k);
+                var a = i + k, b = i + k + len/2;
+                var xr = re[b]*wr - im[b]*wi;
+                var xi = re[b]*wi + im[b]*wr;
+                re[b] = re[a] - xr; im[b] = im[a] - xi;
+                re[a] += xr; im[a] += xi;
+            }
+        }
+    }
+};
+
 function send_msg(type, content) {
     /* function sends message to server (Python) about ongoing events
        
@@ -331,6 +815,7 @@ function change() {
 	btn.style.color = 'red';
 	var plt = document.getElementById("plot")
 	plt.innerHTML = ''
+	track = null
 	document.getElementsByClassName('buttonGroup')[0].style.float = ''
     }
 
@@ -364,6 +849,93 @@ function start_quit() {
     }
 };
 
+function plot_update(content) {
+    /* function adds the new points of the run's track and redraws the plot
+
+       Parameters:
+       -----------
+       content : points, median and std of the measurement phase, on reset
+       also the title of the run
+
+       Returns:
+       --------
+       no return arguments
+    */
+    if (content.reset || track == null)
+        track = {title: content.title || '', points: []};
+    track.points = track.points.concat(content.points);
+    track.median = content.median;
+    track.std = content.std;
+    plot(track_svg(track));
+};
+
+function track_svg(track) {
+    /* function renders the track as svg: trials before the measurement phase
+       as dashed black line, the measurement phase as blue line. Wrong answers
+       are drawn as open circles.
+
+       Parameters:
+       -----------
+       track : title, points, median and std of the run
+
+       Returns:
+       --------
+       svg string
+    */
+    var width = 640, height = 480;
+    var left = 80, right = 20, top = 50, bottom = 60;
+    var ys = track.points.map(function(p) { return p.y; });
+    var ymin = Math.min.apply(null, ys) - 1;
+    var ymax = Math.max.apply(null, ys) + 1;
+    var xmax = track.points.length + 1;
+    var sx = function(x) { return left + x/xmax*(width-left-right); };
+    var sy = function(y) { return top + (ymax-y)/(ymax-ymin)*(height-top-bottom); };
+    var svg = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 ' +
+        width + ' ' + height + '" font-family="sans-serif" font-size="14">';
+    svg += '<rect x="' + left + '" y="' + top + '" width="' + (width-left-right) +
+        '" height="' + (height-top-bottom) + '" fill="white" stroke="black"/>';
+    var path = function(points, color, dash) {
+        if (points.length == 0)
+            return '';
+        var d = points.map(function(p, i) {
+            return (i == 0 ? 'M' : 'L') + sx(p.x) + ',' + sy(p.y);
+        }).join(' ');
+        var out = '<path d="' + d + '" fill="none" stroke="' + color + '"' +
+            (dash ? ' stroke-dasharray="6,4"' : '') + '/>';
+        points.forEach(function(p) {
+            out += '<circle cx="' + sx(p.x) + '" cy="' + sy(p.y) + '" r="4" stroke="' +
+                color + '" fill="' + (p.correct ? color : 'white') + '"/>';
+        });
+        return out;
+    };
+    var first = track.points.filter(function(p) { return !p.measurement; });
+    var measurement = track.points.filter(function(p) { return p.measurement; });
+    if (measurement.length > 0)
+        first.push(measurement[0]);
+    svg += path(first, 'black', true);
+    svg += path(measurement, 'blue', false);
+    if (track.median != null) {
+        svg += '<text x="' + (width-180) + '" y="' + (top+30) + '">Med: ' +
+            track.median.toFixed(2) + '</text>';
+        svg += '<text x="' + (width-180) + '" y="' + (top+50) + '">Std: ' +
+            track.std.toFixed(2) + '</text>';
+    }
+    svg += '<text x="' + (width/2) + '" y="' + (top-15) + '" text-anchor="middle">' +
+        track.title + '</text>';
+    svg += '<text x="' + ((width+left)/2) + '" y="' + (height-15) +
+        '" text-anchor="middle">Number of trial</text>';
+    svg += '<text x="20" y="' + ((height+top-bottom)/2) + '" text-anchor="middle" ' +
+        'transform="rotate(-90 20 ' + ((height+top-bottom)/2) + ')">Variable value</text>';
+    svg += '<text x="' + left + '" y="' + (height-bottom+20) + '" text-anchor="middle">0</text>';
+    svg += '<text x="' + sx(xmax-1) + '" y="' + (height-bottom+20) + '" text-anchor="middle">' +
+        (xmax-1) + '</text>';
+    svg += '<text x="' + (left-5) + '" y="' + sy(ymin+1) + '" text-anchor="end">' +
+        (ymin+1).toFixed(1) + '</text>';
+    svg += '<text x="' + (left-5) + '" y="' + sy(ymax-1) + '" text-anchor="end">' +
+        (ymax-1).toFixed(1) + '</text>';
+    return svg + '</svg>';
+};
+
 function plot(content) {
     var plt = document.getElementById("plot")
     plt.innerHTML = content
@@ -1,8 +1,177 @@
 """
-This module contains als Run related classes and mathods. Until now there is
-only one class :class:`Run` describing the basic functionality of a earyx Run.
+This module contains als Run related classes and mathods. :class:`Run`
+describes the basic functionality of a earyx Run, :class:`History` is the
+columnar record of its answered trials and :class:`RunningStats` the
+statistics of its measurement phase.
 
 """
+import heapq
+import numpy as np
+
+
+class History():
+    """Columnar record of the answered trials of a run
+
+    Adapt rules, plots and the export read the track from numpy columns
+    instead of scanning the list of :class:`Trial` objects. The columns grow
+    by doubling, so appending a trial costs O(1).
+
+    Attributes
+    ----------
+    variable : numpy array
+        variable of each trial
+    is_correct : numpy array of bool
+    step : numpy array
+        step returned by the adapt rule after each trial, 0 for the last
+        trial of a finished run
+    reversal : numpy array of bool
+        **True** if the adapt rule counted a reversal after the trial
+    answer : list
+        answers of the trials, int or str
+    """
+    _columns = [('variable', float), ('is_correct', bool), ('step', float),
+                ('reversal', bool)]
+
+    def __init__(self, capacity=32):
+        self._len = 0
+        self._data = {name: np.zeros(capacity, dtype=dtype)
+                      for name, dtype in self._columns}
+        self.answer = []
+
+    def __len__(self):
+        return self._len
+
+    def __getattr__(self, name):
+        if name in dict(self._columns):
+            return self._data[name][:self._len]
+        raise AttributeError(name)
+
+    def append(self, variable, answer, is_correct):
+        """add an answered trial, called by :func:`Experiment.set_answer`"""
+        if self._len == len(self._data['variable']):
+            for name, column in self._data.items():
+                self._data[name] = np.concatenate([column,
+                                                   np.zeros_like(column)])
+        self._data['variable'][self._len] = variable
+        self._data['is_correct'][self._len] = is_correct
+        self._data['step'][self._len] = 0
+        self._data['reversal'][self._len] = False
+        self.answer.append(answer)
+        self._len += 1
+
+    def adapted(self, step, reversal):
+        """record step and reversal of the adapt rule for the last trial"""
+        self._data['step'][self._len-1] = step
+        self._data['reversal'][self._len-1] = reversal
+
+    def to_json(self):
+        """returns JSON serializable columns"""
+        dct = {name: getattr(self, name).tolist() for name, _ in self._columns}
+        dct['answer'] = self.answer
+        return dct
+
+    @classmethod
+    def from_trials(cls, trials):
+        """create history from a list of :class:`Trial` objects, steps are
+        the differences of the variables and reversals are unknown"""
+        history = cls(max(len(trials), 1))
+        for idx, trial in enumerate(trials):
+            history.append(trial.variable, trial.answer, trial.is_correct)
+            if idx:
+                history._data['step'][idx-1] = (trial.variable -
+                                                 trials[idx-1].variable)
+        return history
+
+    @classmethod
+    def from_json(cls, dct):
+        """create history from the columns returned by :func:`to_json`"""
+        history = cls(max(len(dct['variable']), 1))
+        for variable, answer, is_correct, step, reversal in zip(
+                dct['variable'], dct['answer'], dct['is_correct'],
+                dct['step'], dct['reversal']):
+            history.append(variable, answer, is_correct)
+            history.adapted(step, reversal)
+        return history
+
+
+class RunningStats():
+    """Incremental statistics of the measurement phase of a run
+
+    Mean and variance are updated with Welford's algorithm, the median is
+    kept by two heaps. Adding a value costs O(log n), reading any statistic
+    O(1).
+
+    Attributes
+    ----------
+    count : int
+    mean : float
+    min, max : float
+        None before the first value
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+        self._low = []  # lower half, negated for a max heap
+        self._high = []
+
+    def add(self, value):
+        """add the variable of a measurement trial"""
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self._m2 += delta*(value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if not self._low or value <= -self._low[0]:
+            heapq.heappush(self._low, -value)
+        else:
+            heapq.heappush(self._high, value)
+        if len(self._low) > len(self._high) + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+        elif len(self._high) > len(self._low):
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+
+    @property
+    def median(self):
+        """median of all values, None before the first value"""
+        if not self.count:
+            return None
+        if len(self._low) > len(self._high):
+            return -self._low[0]
+        return (self._high[0] - self._low[0])/2
+
+    def variance(self, ddof=0):
+        """variance with `count - ddof` degrees of freedom, 0 if there are
+        not enough values"""
+        if self.count <= ddof:
+            return 0.0
+        return self._m2/(self.count - ddof)
+
+    def std(self, ddof=0):
+        """standard deviation, see :func:`variance`"""
+        return self.variance(ddof)**0.5
+
+    def to_json(self):
+        """returns JSON serializable summary, loaded runs rebuild the
+        statistics from their history"""
+        return {'count': self.count, 'mean': self.mean, 'std': self.std(1),
+                'median': self.median, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_run(cls, run):
+        """create statistics of the measurement phase of run from its
+        history"""
+        stats = cls()
+        if run.start_measurement_idx is not None:
+            for value in run.history.variable[run.start_measurement_idx:]:
+                stats.add(value)
+        return stats
+
 
 class Run():
     """This class contains all parameters, a list of trials and settings for a single run.     
@@ -20,6 +189,16 @@ class Run():
         if run is finished
     trials : list
         list of trials :class:`Trial`
+    history : :class:`History`
+        columns of the answered trials read by adapt rules and plots
+    prepared : boolean
+        **True** once :func:`Experiment.prepare_run` built the signals
+    stats : :class:`RunningStats`
+        statistics of the measurement phase
+    stopping_state : dict
+        state of the stopping rules, see :mod:`earyx.stopping`
+    stopped_by : str
+        type of the stopping rule which ended the run, or None
     test_signal : list 
     reference_signal : mumpy array 
         reference signal
@@ -67,6 +246,11 @@ class Run():
         self.calib = calib
         self.finished = False
         self.trials = []
+        self.history = History()
+        self.prepared = False
+        self.stats = RunningStats()
+        self.stopping_state = {}
+        self.stopped_by = None
         self.test_signal = []
         self.reference_signal = reference_signal
         self.between_signal = between_signal
@@ -2,9 +2,12 @@
 
 It is part of the earyx toolbox for psychoacoustic experiments. 
 """
-from earyx.run import Run
+from earyx.run import Run, History, RunningStats
+from earyx.adapt import Posterior
 from earyx.trial import Trial
+from earyx.stimulus import Stimulus, from_json
 import soundfile as sf
+import numpy as np
 import json
 import zipfile
 import hashlib
@@ -12,9 +15,10 @@ import os
 import datetime
 import tempfile
 import shutil
+from collections import OrderedDict
+import weakref
 import tkinter as tk
 from tkinter import filedialog
-import statistics
 
 
 class SaveLoad():
@@ -31,9 +35,8 @@ class SaveLoad():
         List of all hash names of the signals.
     file_name : str
         path and name of zip file to save to or load from.
-    files : dict
-        Dictonary containing all loaded signals as numpy arrays with their hash
-        name as keys
+    signals : :class:`SignalStore`
+        all signals as numpy arrays with their hash name as keys
     experiment : Experiment-like object
         reference to the experiment to save
     """
@@ -51,7 +54,7 @@ class SaveLoad():
         self.signal_names = ["pre_signal", "reference_signal", "between_signal",
                              "test_signal", "post_signal"]
         self._save_names = []
-        self.signals = {}
+        self.signals = SignalStore()
         self.experiment = experiment
         self.zip_path = None
         self.temp_path = tempfile.mkdtemp(prefix='tmp_', dir=os.getcwd())
@@ -61,9 +64,25 @@ class SaveLoad():
             if signal_name in obj._save_names:
                 continue
             signal = getattr(obj, signal_name)
-            if signal != []:
-                name = hashlib.md5(signal).hexdigest()
+            if isinstance(signal, Stimulus):
+                # descriptions are saved in the struct instead of a wav file
+                obj._save_names[signal_name] = signal.to_json()
+                continue
+            name = self.signals.name_of(signal)
+            if name is not None:
+                # array of self.signals, e.g. from the trial cache
+                obj._save_names[signal_name] = name
+                continue
+            if np.size(signal) != 0:
+                signal = np.ascontiguousarray(signal)
+                md5 = hashlib.md5(signal)
+                if signal.ndim > 1:
+                    # same samples in another channel layout are another signal
+                    md5.update(str(signal.shape).encode())
+                name = md5.hexdigest()
                 if name in self.signals:
+                    if self.signals.cached(name) is None:
+                        self.signals[name] = signal  # spilled, no need to read
                     setattr(obj, signal_name, self.signals[name])
                     # signal = self.signals[name]
                 else:
@@ -75,6 +94,18 @@ class SaveLoad():
                              samplerate = obj.sample_rate)
                 obj._save_names[signal_name] = name
 
+    def release_signals(self, obj):
+        """replace the saved numpy array signals of obj by
+        :class:`StoredSignal` handles
+
+        Called for trials after :func:`unify_signals`, so old trials keep no
+        signals in memory beyond the budget of :attr:`signals`.
+        """
+        for signal_name, name in obj._save_names.items():
+            if (isinstance(name, str) and
+                    isinstance(getattr(obj, signal_name, None), np.ndarray)):
+                setattr(obj, signal_name, self.signals.handle(name))
+
     def update_struct(self):
         sct = json.dumps(self.experiment, sort_keys=True, indent=4,
                          default=self.to_json)
@@ -92,9 +123,10 @@ class SaveLoad():
 
         Parameters
         ----------
-        python_object : Experiment, Run or Trial
+        python_object : Experiment, Run, History or Trial
             The python object to serialize. It can be a subtype of
-            :class:`Experiment`, subtype of :class:`Run` or :class:`Trial`.
+            :class:`Experiment`, subtype of :class:`Run`, :class:`History` or
+            :class:`Trial`.
 
         Returns
         -------
@@ -111,6 +143,8 @@ class SaveLoad():
             dct = self._create_dict(python_object)
             del dct['signals']
             del dct['_sl']
+            dct.pop('trial_cache', None)
+            dct.pop('stimulus_cache', None)
             return dct
         if issubclass(type(python_object), Run):
             dct = self._create_dict(python_object)
@@ -118,8 +152,15 @@ class SaveLoad():
                 dct['step'] = dct['start_step']
                 dct['variable'] = self.experiment.variable['start_val']
                 dct['trials'] = []
+                dct['history'] = History()
             del dct['_parameters']
             return dct
+        if isinstance(python_object, History):
+            return python_object.to_json()
+        if isinstance(python_object, RunningStats):
+            return python_object.to_json()
+        if isinstance(python_object, Posterior):
+            return None  # rebuilt from the history
         if isinstance(python_object, Trial):
             return self._create_dict(python_object)
         raise TypeError(repr(python_object) + ' is not JSON serializable')
@@ -189,7 +230,7 @@ class SaveLoad():
         """
 
         self._save_names = []
-        self.signals = {}
+        self.signals.clear()
 
         root = tk.Tk()
         root.withdraw()
@@ -227,8 +268,16 @@ class SaveLoad():
                 self.separate_signals(trial_obj)
                 run.trials.append(trial_obj)
             del sct["runs"][idx]["trials"]
+            history = sct["runs"][idx].pop("history", None)
             run.__dict__.update(sct["runs"][idx])
+            if history is None:  # saved before runs had a history
+                run.history = History.from_trials(run.trials)
+            else:
+                run.history = History.from_json(history)
+            run.stats = RunningStats.from_run(run)
             self.separate_signals(run)
+            if run._save_names:  # saved before runs were prepared lazily
+                run.prepared = True
         del sct["runs"]
         self.experiment.__dict__.update(sct)
         self.separate_signals(self.experiment)
@@ -253,6 +302,9 @@ class SaveLoad():
                     signal_temp = [sig for sig in
                                    self.signals[obj._save_names[signal_name]]]
                     setattr(obj, signal_name,  signal_temp)
+                elif isinstance(obj._save_names[signal_name], dict):
+                    setattr(obj, signal_name,
+                            from_json(obj._save_names[signal_name]))
                 else:
                     setattr(obj, signal_name, self.signals[obj._save_names[signal_name]])
                     # signal = self.signals[obj._save_names[signal_name]]
@@ -276,15 +328,15 @@ class SaveLoad():
                                                              getattr(run,par),
                                                              items['unit']))
                         f.write('%%----- VAL:')
-                        for trial in run.trials:
-                            f.write(' %d %d' % (trial.variable, trial.is_correct))
+                        for variable, is_correct in zip(run.history.variable,
+                                                        run.history.is_correct):
+                            f.write(' %d %d' % (variable, is_correct))
                         f.write('\n')
 
-                        measure = [val.variable for val in run.trials[run.start_measurement_idx:]]
-                        med = statistics.median(measure)
-                        std = statistics.stdev(measure)
-                        maxi = max(measure)
-                        mini = min(measure)
+                        med = run.stats.median
+                        std = run.stats.std(1)
+                        maxi = run.stats.max
+                        mini = run.stats.min
                         f.write('  %s %d %d %d %d %s\n' % (self.experiment.variable['name'],
                                                           med, std, maxi, mini,
                                                           self.experiment.variable['unit']))
@@ -295,3 +347,149 @@ class SaveLoad():
 
             
         
+
+
+class SignalStore():
+    """Signals by hash name with at most `max_bytes` in memory
+
+    The least recently used signals beyond the budget are written to `.npy`
+    files in a temporary spill directory and read again when they are
+    accessed. Their wav files in the save directory are 16 bit, the spill
+    files keep the exact samples. The spill directory is removed with the
+    store. Files registered by :func:`add_file`, e.g. the wav files of a
+    checkpoint, are read on first access as well. :func:`handle` returns one shared :class:`StoredSignal` per name,
+    so the trials of a run do not hold a handle each for the run signals.
+
+    Parameters
+    ----------
+    max_bytes : int (optional)
+        Default: 256 MiB, see the experiment option `signal_memory`
+    """
+
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.spill_path = None
+        self._memory = OrderedDict()
+        self._names = {}
+        self._spilled = {}
+        self._handles = weakref.WeakValueDictionary()
+        self._nbytes = 0
+
+    def __contains__(self, name):
+        return name in self._memory or name in self._spilled
+
+    def __getitem__(self, name):
+        signal = self.cached(name)
+        if signal is None:
+            path = self._spilled[name]
+            if path[-4:] == '.npy':
+                signal = np.load(path)
+            else:
+                signal = sf.read(path, always_2d=False)[0]
+            self[name] = signal
+        return signal
+
+    def __setitem__(self, name, signal):
+        self._remove(name)
+        self._memory[name] = signal
+        self._names[id(signal)] = name
+        self._nbytes += np.asarray(signal).nbytes
+        self._evict()
+
+    def __len__(self):
+        return len(set(self._memory) | set(self._spilled))
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def update(self, signals):
+        for name, signal in signals.items():
+            self[name] = signal
+
+    def cached(self, name):
+        """returns the signal if it is in memory, else None"""
+        signal = self._memory.get(name)
+        if signal is not None:
+            self._memory.move_to_end(name)
+        return signal
+
+    def add_file(self, name, path):
+        """register a saved `.npy` or sound file as spilled signal, it is
+        read when it is accessed"""
+        self._remove(name)
+        self._spilled[name] = path
+
+    def handle(self, name):
+        """returns the :class:`StoredSignal` of name"""
+        handle = self._handles.get(name)
+        if handle is None:
+            handle = self._handles[name] = StoredSignal(self, name)
+        return handle
+
+    def name_of(self, signal):
+        """returns the name of an array in memory without hashing it"""
+        name = self._names.get(id(signal))
+        if name is not None and self._memory.get(name) is signal:
+            return name
+        return None
+
+    def clear(self):
+        """drop all signals and the spill directory"""
+        self._memory.clear()
+        self._names.clear()
+        self._spilled.clear()
+        self._handles.clear()
+        self._nbytes = 0
+        if self.spill_path is not None:
+            self._cleanup()
+            self.spill_path = None
+
+    def _remove(self, name):
+        signal = self._memory.pop(name, None)
+        if signal is not None:
+            self._names.pop(id(signal), None)
+            self._nbytes -= np.asarray(signal).nbytes
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._memory) > 1:
+            name = next(iter(self._memory))
+            if name not in self._spilled:
+                if self.spill_path is None:
+                    self.spill_path = tempfile.mkdtemp(prefix='spill_')
+                    self._cleanup = weakref.finalize(
+                        self, shutil.rmtree, self.spill_path, True)
+                path = os.path.join(self.spill_path, name + '.npy')
+                np.save(path, self._memory[name])
+                self._spilled[name] = path
+            self._remove(name)
+
+
+class StoredSignal():
+    """Lazy handle of a saved signal, see :func:`SaveLoad.release_signals`
+
+    The samples are read from the :class:`SignalStore`, i.e. from memory or
+    its spill file, by :func:`load` or when the handle is converted with
+    :func:`numpy.asarray`.
+    """
+    __slots__ = ('signals', 'name', '__weakref__')
+
+    def __init__(self, signals, name):
+        self.signals = signals
+        self.name = name
+
+    def load(self):
+        """returns the signal as numpy array"""
+        return self.signals[self.name]
+
+    def __array__(self, dtype=None, copy=None):
+        signal = self.load()
+        return signal if dtype is None else signal.astype(dtype)
+
+    def __len__(self):
+        return len(self.load())
+
+
+def load_signal(signal):
+    """returns the samples of a :class:`StoredSignal`, other signals as they
+    are"""
+    return signal.load() if isinstance(signal, StoredSignal) else signal
@@ -2,15 +2,18 @@ import earyx.exception as expt
 from tornado.websocket import WebSocketHandler
 from tornado.web import Application, RequestHandler
 import earyx.exception
+import earyx.stimulus as stimulus
+from earyx.checkpoint import Checkpoint
+from earyx.audio import open_engine, num_channels, join_parts
 import tornado.web
 from tornado.ioloop import IOLoop
+from tornado import gen
+from collections import deque
 import uuid
 import re
 import os
 import json
 import time
-import sounddevice as sd
-import matplotlib.pyplot as plt
 from io import BytesIO
 import inspect
 import sys
@@ -20,16 +23,25 @@ import struct
 import numpy
 import socket
 
+PROTOCOL_VERSION = 1
+
+# message type codes of the compact encoding, same order as messageTypes
+# in gui/script.js
+MESSAGE_TYPES = ['params', 'task', 'feedback', 'audio', 'but1', 'but2', 'but3',
+                 'but4', 'plot', 'desc', 'debug_state', 'name', 'allow_plot',
+                 'run_finished', 'quit', 'render', 'stream_start', 'resume']
+
+
 def to_bytes(n):
     return struct.pack("@i", n)
 
 class EaryxServer(Application):
 
-    def __init__(self, path_to_exps=None):
+    def __init__(self, path_to_exps=None, checkpoint_path=None):
         if path_to_exps:
-            self.eh = ExperimentHandler(path_to_exps)
+            self.eh = ExperimentHandler(path_to_exps, checkpoint_path)
         else:
-            self.eh = ExperimentHandler()
+            self.eh = ExperimentHandler(checkpoint_path=checkpoint_path)
         
         dirnam = os.path.dirname(__file__)
         settings = {
@@ -92,15 +104,33 @@ class ActiveHandler(RequestHandler):
 
 
 class ExperimentHandler():
+    """This class holds all sessions of the server.
+
+    Each session is a dict containing the experiment, its ui settings and the
+    trial which is presented but not answered yet. Reconnecting clients
+    continue with this trial. If a checkpoint path is given, sessions of
+    experiments from the experiments folder are checkpointed after every
+    trial and restored when the server is restarted.
+
+    Parameters
+    ----------
+    exp_path : str
+        folder containing the experiments
+    checkpoint_path : str (optional)
+        folder for session checkpoints. Without it there is no checkpointing.
+    """
 
     def __init__(self, exp_path=os.path.abspath(os.path.join(
-            os.path.dirname(__file__),"experiments"))):
+            os.path.dirname(__file__),"experiments")), checkpoint_path=None):
         self.exps = {}
         self.aviable_exps = {}
         self.exp_path = exp_path
+        self.checkpoint_path = checkpoint_path
         sys.path.insert(0,self.exp_path)
         self.load_experiments()
         del sys.path[0]
+        if self.checkpoint_path:
+            self.restore_sessions()
 
     def load_experiments(self):
         for root, dirs, files in os.walk(self.exp_path, topdown=False):
@@ -113,9 +143,15 @@ class ExperimentHandler():
 
     def get_experiment_names(self):
         return self.aviable_exps.keys()
-                
+
+    def create_experiment(self, name):
+        """create experiment from the experiments folder by its file name"""
+        module = self.aviable_exps[name]
+        classname = re.sub(r'(?!^)_([a-zA-Z])', lambda m: m.group(1).upper(),
+                           name)
+        return getattr(module, classname[0].upper()+classname[1:])()
         
-    def add_existing_experiment(self, exp, debug, audio):
+    def add_existing_experiment(self, exp, debug, audio, name=None):
         cid = uuid.uuid4().hex
         if cid not in self.exps:
             self.exps[cid] = {}
@@ -123,8 +159,61 @@ class ExperimentHandler():
             self.exps[cid]['debug'] = debug
             self.exps[cid]['audio'] = audio
             self.exps[cid]['started'] = False
+            self.exps[cid]['connected'] = False
+            self.exps[cid]['run'] = None
+            self.exps[cid]['trial'] = None
+            self.exps[cid]['signal'] = None
+            self.exps[cid]['checkpoint'] = None
+            if name and self.checkpoint_path:
+                self.exps[cid]['checkpoint'] = Checkpoint(
+                    os.path.join(self.checkpoint_path, cid), exp,
+                    {'name': name, 'debug': debug, 'audio': audio})
         return cid
 
+    def restore_sessions(self):
+        """restore all sessions found in the checkpoint path"""
+        if not os.path.isdir(self.checkpoint_path):
+            return
+        for cid in os.listdir(self.checkpoint_path):
+            path = os.path.join(self.checkpoint_path, cid)
+            if not os.path.isfile(os.path.join(path, 'header.json')):
+                continue
+            info = Checkpoint.read_info(path)
+            if info['name'] not in self.aviable_exps:
+                continue
+            exp = self.create_experiment(info['name'])
+            checkpoint, pending = Checkpoint.restore(path, exp)
+            run, trial, signal = pending if pending else (None, None, None)
+            self.exps[cid] = {'exp': exp, 'debug': info['debug'],
+                              'audio': info['audio'], 'started': True,
+                              'connected': False, 'run': run, 'trial': trial,
+                              'signal': signal, 'checkpoint': checkpoint}
+            print('Restored session with id:', cid)
+
+    def trial_presented(self, cid, run, trial, signal):
+        """remember presented trial of session, so it can be resumed"""
+        session = self.exps[cid]
+        session['run'], session['trial'], session['signal'] = run, trial, signal
+        if session['checkpoint']:
+            session['checkpoint'].present(run, trial)
+
+    def trial_answered(self, cid, run, trial):
+        """checkpoint answered trial and state of its run after adapt"""
+        session = self.exps[cid]
+        session['trial'] = session['signal'] = None
+        if session['checkpoint']:
+            session['checkpoint'].answer(run, trial)
+
+    def run_changed(self, cid, run):
+        """checkpoint state of a run, e.g. after skipping it"""
+        if self.exps[cid]['checkpoint']:
+            self.exps[cid]['checkpoint'].update_run(run)
+
+    def close_checkpoint(self, cid):
+        if self.exps[cid]['checkpoint']:
+            self.exps[cid]['checkpoint'].close()
+            self.exps[cid]['checkpoint'] = None
+
     def get_experiment_type(self,cid):
 
         if hasattr(self.exps[cid]['exp'], 'num_afc'):
@@ -164,16 +253,9 @@ class IndexHandler(RequestHandler):
         except:
             deb = False
         print('debug:',deb)
-        module = self.__eh.aviable_exps[name]
-        classname = self._to_camelcase(name)
-        exp = getattr(module, classname)()
-        cid = self.__eh.add_existing_experiment(exp,deb,1)
+        exp = self.__eh.create_experiment(name)
+        cid = self.__eh.add_existing_experiment(exp,deb,1,name)
         self.redirect('/select/?cid='+cid)
-
-        
-    def _to_camelcase(self, s):
-        e = re.sub(r'(?!^)_([a-zA-Z])', lambda m: m.group(1).upper(), s)
-        return e[0].upper()+e[1:]
             
             
 
@@ -202,6 +284,18 @@ class EchoWebSocket(WebSocketHandler):
         self.exp = None
         self.terminated = False
         self.run = None
+        self.cid = None
+        self._stream_id = 0
+        self._plot_run = None
+        self._plot_len = 0
+        self._pending = []
+        self.encoding = 'json'
+        self.audio = None
+        self.playback = None
+        self.received = None
+        self.loop = None
+        self.loop_run = None
+        self.loop_trial = None
      
     def open(self, client_id):
         print("WebSocket opened")
@@ -211,12 +305,34 @@ class EchoWebSocket(WebSocketHandler):
         self.audio_flag = self.__eh.exps[client_id]['audio']
         if self.__eh.exps[client_id]['started'] == False:
             if hasattr(self.exp, 'description'):
-                self.write_message({'type':'desc', 'content':self.exp.description})
+                self.send_message('desc', self.exp.description)
             if self.exp.allow_debug:
-                self.write_message({'type': 'debug_state', 'content': self.exp.debug})
-            self.write_message({'type':'name','content': self.exp.subject_name})
+                self.send_message('debug_state', self.exp.debug)
+            self.send_message('name', self.exp.subject_name)
         self.__eh.exps[client_id]['started'] = True
-        self.write_message({'type': 'allow_plot', 'content': self.exp.allow_debug})
+        self.__eh.exps[client_id]['connected'] = True
+        self.send_message('allow_plot', self.exp.allow_debug)
+        if self.__eh.exps[client_id]['trial'] is not None:
+            self.resume()
+        self.flush()
+
+    def resume(self):
+        """present the pending trial of the session again
+
+        After a reconnect or a server restart the subject continues exactly
+        with the trial which was presented but not answered.
+        """
+        session = self.__eh.exps[self.cid]
+        self.run, self.trial = session['run'], session['trial']
+        self.send_message('resume', True)
+        self.send_message('params',
+                          self.run.get_param_string(self.exp.parameters))
+        self.send_message('task', self.exp.task)
+        if self.audio_flag == 3 and getattr(self.exp, 'continuous', False):
+            self.present_loop(self.run, self.trial, session['signal'])
+        else:
+            self.present_signal(session['signal'], self.trial.sample_rate,
+                                self.trial.seed)
   
     def on_message(self, message):
         """ sends and receives signals to and from the websocket client
@@ -226,6 +342,10 @@ class EchoWebSocket(WebSocketHandler):
         code. In this way an answer is set, a new run is started or the experiment
         gets quit. 
 
+        Each message is parsed once. All messages sent to the client while
+        handling it are batched into as few frames as possible, see
+        :func:`flush`.
+
         Parameters
         ----------
         message : JSON struct
@@ -234,42 +354,63 @@ class EchoWebSocket(WebSocketHandler):
         -------
         no return arguments, but sends messages to the client
         """
-        ans_type = json.loads(message)['type']
-        answer = json.loads(message)['content']
+        self.received = time.perf_counter_ns()
+        message = json.loads(message)
+        try:
+            self.handle_message(message['type'], message['content'])
+        finally:
+            self.flush()
 
+    def handle_message(self, ans_type, answer):
+        """ handles a single message of the client, see :func:`on_message`
+
+        Parameters
+        ----------
+        ans_type : str
+            message type
+        answer
+            message content
+        """
         if ans_type == "start_signal":
-            self.write_message({'type':'params',  #'params' for correct printing pos
-                                'content':'starting experiment...'})
+            self.send_message('params', 'starting experiment...')
+            self.flush()
             time.sleep(2)
-            self.write_message({'type':'feedback', 'content':' '})
+            self.send_message('feedback', ' ')
             self.run, self.trial = self.present_next_trial()
         
         elif ans_type == 'answer':
-            if not self.run:
+            if not self.run or self.trial.answer is not None:
                 return
+            self.trial.timing['answer'] = self.received
+            if self.playback is not None:
+                self.trial.timing.update(self.playback.timing())
             self.exp.set_answer(self.run, self.trial, answer)
+            self._stream_id += 1  # cancel running stream
+            if self.audio is not None and self.loop is None:
+                self.audio.stop()
             self.send_message('audio', 'clear')
             if self.exp.feedback and hasattr(self.exp,'num_afc'):
                 if self.trial.is_correct == True:
-                    self.write_message({'type':'feedback', 'content':'correct'})
+                    self.send_message('feedback', 'correct')
                 else:
-                    self.write_message({'type':'feedback',
-                                        'content':'not correct'})
+                    self.send_message('feedback', 'not correct')
+                self.flush()
                 time.sleep(1)                  # show feedback message for 1 sec
-                self.write_message({'type':'feedback', 'content':' '}) # del msg
+                self.send_message('feedback', ' ') # del msg
             try:
                 self.exp.adapt(self.run)
             except expt.RunFinishedException:
-                self.write_message({'type':'feedback',
-                                    'content':'Run finshed'})
-                self.write_message({'type':'run_finished',
-                                    'content':'run_finished'})
+                self.stop_loop()
+                self.send_message('feedback', 'Run finshed')
+                self.send_message('run_finished', 'run_finished')
                 return
             except expt.RunStartMeasurement:
-                self.write_message({'type': 'feedback',
-                                    'content': 'start measurement phase'})
+                self.send_message('feedback', 'start measurement phase')
+                self.flush()
                 time.sleep(1)                  # show feedback message for 1 sec
-                self.write_message({'type':'feedback', 'content':' '}) # del msg
+                self.send_message('feedback', ' ') # del msg
+            finally:
+                self.__eh.trial_answered(self.cid, self.run, self.trial)
 
             if self.exp.allow_debug and self.exp.debug:
                     self.plot(self.run, self.exp.parameters)
@@ -277,30 +418,30 @@ class EchoWebSocket(WebSocketHandler):
             self.run, self.trial = self.present_next_trial()
                 
         elif ans_type == "next_run":
+            self.stop_loop()
             self.exp.skip_run(self.run)
+            self.__eh.run_changed(self.cid, self.run)
             self.send_message('feedback', 'Next run started')
+            self.flush()
             time.sleep(3)                          # show feedback message for 3 sec
             self.send_message('feedback', ' ') # del. feedb. msg
             
             try:
                 self.run, self.trial = self.present_next_trial()
             except StopIteration:
-                self.on_message(json.dumps({"type": 'quit',
-                                            "content": 'save'}))
+                self.handle_message('quit', 'save')
                 
         elif ans_type == "quit":
+            self.__eh.close_checkpoint(self.cid)
             if answer == 'save':
                 path = self.exp.finalize(True)
-                self.write_message({'type': 'feedback', 'content':
-                                    'Experiment saved as %s ... finished' % path})
+                self.send_message('feedback', 'Experiment saved as %s ... finished' % path)
             elif answer == 'drop':
                 self.exp.finalize(False)
-                self.write_message({'type': 'feedback', 'content':
-                                    'Experiment was not saved! ...finished'})
+                self.send_message('feedback', 'Experiment was not saved! ...finished')
 
             self.__eh.remove_client(self.cid)
-            self.write_message({'type': 'quit',
-                                'content': 'all_done'})
+            self.send_message('quit', 'all_done')
             
         elif ans_type == 'name':
             self.exp.subject_name = answer
@@ -311,31 +452,35 @@ class EchoWebSocket(WebSocketHandler):
         elif ans_type == 'debug':
             if self.exp.allow_debug:
                self.exp.debug = not self.exp.debug
+               self._plot_run = None  # send whole track with next plot
                state = "on" if self.exp.debug else "off"
-               self.write_message({'type':'feedback',
-                                   'content':"Debugging is '%s' now" % state})
+               self.send_message('feedback', "Debugging is '%s' now" % state)
             else:
-               self.write_message({'type': 'feedback',
-                                   'content': 'Debugging not allowed'})
+               self.send_message('feedback', 'Debugging not allowed')
 
         elif ans_type == 'terminate':
             self.terminated = True
 
+        elif ans_type == 'encoding':
+            self.encoding = answer
+
     def send_message(self, msg_type, content, data=None):
         """Send a message.
         Arguments:
         msg_type  the message type as string.
         content   the message content as json-serializable data.
         data      raw bytes that are appended to the message.
+
+        Messages without data are queued and sent with the next
+        :func:`flush`. Messages with data are sent immediately in a frame of
+        their own after the queued messages. Returns the future of the write
+        or None if the message was queued or the write failed.
         """
 
         if data is None:
-            try:
-                self.write_message(json.dumps({"type": msg_type,
-                                           "content": content}).encode())
-            except:
-                pass
+            self._pending.append({'type': msg_type, 'content': content})
         else:
+            self.flush()
             header = json.dumps({'type': msg_type,
                                  'content': content}).encode()
             # append enough spaces so that the payload starts at an 8-byte
@@ -345,48 +490,155 @@ class EchoWebSocket(WebSocketHandler):
             # the length of the header as a binary 32 bit signed integer:
             prefix = to_bytes(len(header))
             try:
-                self.write_message(prefix + header + data, binary=True)
+                return self.write_message(prefix + header + data, binary=True)
             except:
                 pass
 
+    def flush(self):
+        """Send all queued messages in one frame
+
+        The frame is a versioned envelope ``{"v": 1, "msgs": [...]}``, either
+        as JSON or, if the client requested it, in the compact binary
+        encoding of :func:`encode_compact`.
+        """
+        if not self._pending:
+            return
+        msgs, self._pending = self._pending, []
+        try:
+            if self.encoding == 'binary':
+                self.write_message(self.encode_compact(msgs), binary=True)
+            else:
+                self.write_message(json.dumps({'v': PROTOCOL_VERSION,
+                                               'msgs': msgs}))
+        except:
+            pass
+
+    @staticmethod
+    def encode_compact(msgs):
+        """Encode messages in the compact binary envelope
+
+        The frame starts with the 32 bit integer -1 (which distinguishes it
+        from messages with data), the protocol version (uint8) and the number
+        of messages (uint16). Each message consists of its type code (uint8,
+        index in MESSAGE_TYPES), a content tag (uint8) and the content:
+        0 null, 1 false, 2 true, 3 float64, 4 string and 5 JSON, the last two
+        prefixed with their length (uint32). All numbers are little endian.
+
+        Parameters
+        ----------
+        msgs : list of dict
+            messages with type and content
+
+        Returns
+        -------
+        frame : bytes
+        """
+        parts = [struct.pack('<iBH', -1, PROTOCOL_VERSION, len(msgs))]
+        for msg in msgs:
+            parts.append(struct.pack('<B', MESSAGE_TYPES.index(msg['type'])))
+            content = msg['content']
+            if content is None:
+                parts.append(b'\x00')
+            elif isinstance(content, bool):
+                parts.append(b'\x02' if content else b'\x01')
+            elif isinstance(content, (int, float)):
+                parts.append(struct.pack('<Bd', 3, content))
+            else:
+                if isinstance(content, str):
+                    tag, raw = 4, content.encode()
+                else:
+                    tag, raw = 5, json.dumps(content).encode()
+                parts.append(struct.pack('<BI', tag, len(raw)) + raw)
+        return b''.join(parts)
+
+    @gen.coroutine
+    def stream_signal(self, signals, times, sample_rate):
+        """Stream signal to the client in chunks of PCM samples
+
+        The signal is sent as interleaved float32 chunks of
+        `exp.stream_chunk_size` samples, each tagged with the stream id and
+        its sequence number. At most `exp.stream_window` chunks are written
+        before the server waits for the connection to flush, so slow clients
+        do not pile up data in the server's buffers. A new stream or a closed
+        connection cancels the running one.
+
+        Parameters
+        ----------
+        signals : numpy array
+            complete trial signal with shape (SAMPLES, NUM_CHANNELS)
+        times : list of float
+            durations of the signal parts in seconds
+        sample_rate : int
+        """
+        self._stream_id += 1
+        stream_id = self._stream_id
+        signals = np.asarray(signals, dtype='float32', order='C')
+        chunk_size = self.exp.stream_chunk_size
+        num_chunks = -(-len(signals) // chunk_size)
+        self.send_message('stream_start', {'id': stream_id, 'times': times,
+                                           'sample_rate': sample_rate,
+                                           'channels': signals.shape[1],
+                                           'chunks': num_chunks})
+        self.flush()
+        pending = deque()
+        for seq in range(num_chunks):
+            if stream_id != self._stream_id or self.terminated:
+                return
+            chunk = signals[seq*chunk_size:(seq+1)*chunk_size]
+            future = self.send_message('chunk', {'id': stream_id, 'seq': seq},
+                                       chunk.tobytes())
+            if future is None:  # connection closed
+                return
+            pending.append(future)
+            if len(pending) > self.exp.stream_window:
+                try:
+                    yield pending.popleft()
+                except Exception:
+                    return
+
     def plot(self, runs, params):
-        variables = [trial.variable for trial in runs.trials]
-        length = len(variables)
-        f = plt.figure(111)
-        ax = f.add_subplot(111)
-        f.clear()
-        
-        if runs.start_measurement_idx == None:
-           x_axes = numpy.arange(1,length+1)
-           plt.plot(x_axes,variables,'o--',markerfacecolor='k',markersize=5)
-        else:
-            x1 = numpy.arange(1,runs.start_measurement_idx+1)
-            x2 = numpy.arange(runs.start_measurement_idx,length+1)
-            measurement_variables = variables[runs.start_measurement_idx-1:]
-            plt.plot(x1,variables[:runs.start_measurement_idx],'o--',markerfacecolor='k',markersize=5)
-            plt.plot(x2,measurement_variables,'ob-',markersize=5)
-            median_measurement = numpy.median(measurement_variables)
-            std_measurement = numpy.std(measurement_variables)
-            plt.text(0.7, 0.85,'Med:', ha='left', va='center',transform = ax.transAxes)
-            plt.text(0.82, 0.85,round(median_measurement,2), ha='left', va='center',transform = ax.transAxes)
-            plt.text(0.7, 0.77,'Std:', ha='left', va='center',transform = ax.transAxes)
-            plt.text(0.82, 0.77,round(std_measurement,2), ha='left', va='center',transform = ax.transAxes)
-        
-        title_string = runs.get_param_string(params)
-        plt.title(title_string)
-        plt.xlabel('Number of trial')
-        plt.ylabel('Variable value')
-        plt.xlim((0,length+1))
-        plt.ylim((min(variables)-1,max(variables)+1))
-        figfile = BytesIO()
-        f.savefig(figfile, format='svg')
-        figdata_svg = figfile.getvalue().decode('utf-8')
-        # figdata_svg = '<svg' + figfile.getvalue().decode('utf-8').split('<svg')[1]
-        self.write_message({'type':'plot', 'content':figdata_svg})
+        """Send the new points of the run's track to the client
+
+        The plot is rendered by the browser. Only trials not sent before are
+        transmitted together with median and standard deviation of the
+        measurement phase. The whole track is sent once if the run changed or
+        debugging was activated.
+
+        Parameters
+        ----------
+        runs : :class:`Run`
+        params : dict
+            parameters of the experiment
+        """
+        reset = runs is not self._plot_run
+        if reset:
+            self._plot_run = runs
+            self._plot_len = 0
+        start_idx = runs.start_measurement_idx
+        history = runs.history
+        points = [{'x': idx+1, 'y': float(history.variable[idx]),
+                   'correct': bool(history.is_correct[idx]),
+                   'measurement': start_idx is not None and idx >= start_idx}
+                  for idx in range(self._plot_len, len(history))]
+        self._plot_len = len(history)
+        content = {'reset': reset, 'points': points}
+        if reset:
+            content['title'] = runs.get_param_string(params)
+        if runs.stats.count:
+            content['median'] = runs.stats.median
+            content['std'] = runs.stats.std()
+        self.send_message('plot', content)
 
         
     def on_close(self):
         print("WebSocket closed")
+        self._stream_id += 1  # cancel running stream
+        if self.audio is not None:
+            self.audio.close()
+            self.audio = None
+            self.loop = self.loop_run = self.loop_trial = None
+        if self.cid in self.__eh.exps:
+            self.__eh.exps[self.cid]['connected'] = False
 
     def check_origin(self, origin):
         return True
@@ -394,55 +646,132 @@ class EchoWebSocket(WebSocketHandler):
     def present_next_trial(self):
             run = self.exp.next_run()
             string = run.get_param_string(self.exp.parameters)
-            self.write_message({'type':'params', 'content': string})
-            self.write_message({'type':'task', 'content':self.exp.task})
+            self.send_message('params', string)
+            self.send_message('task', self.exp.task)
+            if self.audio_flag == 3 and getattr(self.exp, 'continuous', False):
+                trial, signal = self.present_loop(run)
+                self.__eh.trial_presented(self.cid, run, trial, signal)
+                return run, trial
             trial, signal = self.exp.next_trial(run)
-            self.present_signal(signal, trial.sample_rate)
+            self.__eh.trial_presented(self.cid, run, trial, signal)
+            self.present_signal(signal, trial.sample_rate, trial.seed)
             return run, trial
 
-    def present_signal(self,signal, sample_rate):
-        """Play back signal """
-        signal = [np.tile(sig, (2, 1)).T for sig in signal
-                  if len(sig.shape) == 1 ]
+    def present_loop(self, run, trial=None, signal=None):
+        """Build next trial of a matching experiment in continuous mode
+
+        The first trial of a run starts a loop of its signal, all further
+        trials of the run only change the gain of the test signal in the
+        loop, see :class:`earyx.experiments.MatchingExperiment`.
+
+        Parameters
+        ----------
+        run : :class:`Run`
+        trial : :class:`Trial` (optional)
+            pending trial to present again after a resume
+        signal : list of numpy arrays (optional)
+            signal of the pending trial
+
+        Returns
+        -------
+        trial : :class:`Trial`
+        signal : list of numpy arrays
+        """
+        if trial is None and self.loop is not None and self.loop_run is run:
+            trial, signal = self.exp.next_loop_trial(run, self.loop_trial)
+            self.loop.set_gain(self.exp.loop_gain(trial))
+            self.playback = None
+            return trial, signal
+        self.stop_loop()
+        if trial is None:
+            trial, signal = self.exp.next_trial(run)
+        parts = self.exp.loop_parts(trial, signal)
+        rendered = stimulus.render_signal(signal, trial.sample_rate, trial.seed)
+        # loops need the callback in this process to change the gain
+        self.audio = open_engine('stream', trial.sample_rate,
+                                 num_channels(rendered), self.exp.channel_map,
+                                 self.audio)
+        self.loop = self.playback = self.audio.loop(rendered, parts,
+                                                    self.exp.loop_ramp)
+        self.loop.set_gain(self.exp.loop_gain(trial))
+        self.loop_run, self.loop_trial = run, trial
+        return trial, signal
+
+    def stop_loop(self):
+        if self.loop is not None:
+            self.audio.stop()
+            self.loop = self.loop_run = self.loop_trial = None
+
+    def present_signal(self,signal, sample_rate, seed=0):
+        """Play back signal
+
+        If the signal consists of :mod:`earyx.stimulus` descriptions and
+        silence only and audio is played in the browser exclusively, only the
+        description and the seed are sent and the browser renders the signal.
+        """
+        if self.audio_flag == 1:
+            description = stimulus.describe(signal, sample_rate)
+            if description is not None:
+                self.send_message('render', {'parts': description,
+                                             'seed': seed,
+                                             'sample_rate': sample_rate})
+                return
+        self.playback = None
+        signal = stimulus.render_signal(signal, sample_rate, seed)
         if (self.audio_flag == 1 or self.audio_flag == 2):
-            num_channels = signal[0].shape[0]
-            signals = np.concatenate(signal)
-            times = [part.size/num_channels/sample_rate for part in signal]
-            temp_file = BytesIO()
-            with sf.SoundFile(temp_file, mode='w', format='WAV',
-                              samplerate=sample_rate,
-                              channels=num_channels) as f:
-                f.write(signals)
-            self.send_message('play',times,temp_file.getvalue())
+            signals = join_parts(signal)[0]
+            times = [len(part)/sample_rate for part in signal]
+            if self.exp.stream_audio:
+                IOLoop.current().spawn_callback(self.stream_signal, signals,
+                                                times, sample_rate)
+            else:
+                temp_file = BytesIO()
+                with sf.SoundFile(temp_file, mode='w', format='WAV',
+                                  samplerate=sample_rate,
+                                  channels=signals.shape[1]) as f:
+                    f.write(signals)
+                self.send_message('play',times,temp_file.getvalue())
 
         if (self.audio_flag == 2 or self.audio_flag == 3):
-            blink = False
-            i = 1
-            with sd.Stream(samplerate=sample_rate, dtype='float32') as s:
-                for part in signal:
-                    if self.audio_flag == 3:
-                        if (self.exp.visual_indicator and hasattr(self.exp, 'num_afc')):
-                            if blink:
-                                self.write_message({'type':'but{}'.format(i),
-                                                    'content':'red'})
-                                i += 1
-                            else:
-                                self.write_message({'type':'but1',
-                                                    'content':'white'})
-                                self.write_message({'type':'but2',
-                                                    'content':'white'})
-                                self.write_message({'type':'but3',
-                                                    'content':'white'})
-                                self.write_message({'type':'but4',
-                                                    'content':'white'})
-                            blink = not blink
-                    s.write(np.asarray(part, dtype='float32', order='C'))
-                i = 1
+            self.audio = open_engine(self.exp.audio_backend, sample_rate,
+                                     num_channels(signal), self.exp.channel_map,
+                                     self.audio)
+            playback = self.playback = self.audio.play(signal)
+            if (self.audio_flag == 3 and self.exp.visual_indicator
+                    and hasattr(self.exp, 'num_afc')):
+                IOLoop.current().spawn_callback(self.indicate_playback,
+                                                playback)
+
+    @gen.coroutine
+    def indicate_playback(self, playback):
+        """switch the visual indicators at the onsets of the signal parts
+
+        Signal parts with odd index are the intervals, while an interval is
+        played its button is red.
+        """
+        stream_id = self._stream_id
+        while playback.onset is None:
+            if playback.wait(0) or stream_id != self._stream_id:
+                return
+            yield gen.sleep(0.005)
+        for idx, onset in enumerate(playback.onsets):
+            yield gen.sleep(max(onset - self.audio.time, 0))
+            if stream_id != self._stream_id:
+                return
+            if idx % 2:
+                self.send_message('but{}'.format((idx+1)//2), 'red')
+            else:
+                self.send_message('but1', 'white')
+                self.send_message('but2', 'white')
+                self.send_message('but3', 'white')
+                self.send_message('but4', 'white')
+            self.flush()
 
 
                     
 if __name__ == '__main__':
-    app = EaryxServer()
+    app = EaryxServer(checkpoint_path=os.path.join(os.getcwd(),
+                                                   'earyx_checkpoints'))
     port = 8888
     app.listen(port)
     your_ip =  socket.gethostbyname(socket.gethostname())
@@ -0,0 +1,541 @@
+"""
+This module simulates adaptive tracks to choose the settings of
+:func:`earyx.experiments.Experiment.add_adapt_setting` without running real
+sessions. Thousands of tracks are simulated at once as numpy arrays against a
+parametric psychometric function. The adapt rules are vectorised versions of
+the classes in :mod:`earyx.adapt` and behave exactly like them, including the
+start of the measurement phase set by :func:`Experiment.adapt`. Thresholds
+are the median of the measurement phase like in the psylab export.
+
+Example::
+
+    from earyx.simulate import simulate
+    for min_step in [1, 2]:
+        sim = simulate('1up2down', max_reversals=6, start_step=8,
+                       min_step=min_step, start=-20, threshold=-40, slope=0.5,
+                       guess=1/3)
+        print(min_step, sim.summary())
+
+Signal based observers (:class:`EnergyObserver`, :class:`GammatoneObserver`)
+listen to the rendered intervals of N-AFC trials instead of the variable, so
+new stimulus code can be checked offline with :func:`percent_correct` or
+:class:`earyx.ui.Model`.
+
+It is part of the earyx toolbox for psychoacoustic experiments.
+"""
+import numpy as np
+from earyx.stimulus import render_signal
+
+
+class Simulation():
+    """Result of :func:`simulate`
+
+    Attributes
+    ----------
+    thresholds : numpy array
+        median of the measurement phase of each track, nan if the
+        measurement phase of an unfinished track is empty
+    num_trials : numpy array
+        number of trials of each track
+    finished : numpy array of bool
+        **True** for tracks which reached `max_reversals`
+    threshold : float
+        threshold of the simulated observer
+    """
+
+    def __init__(self, thresholds, num_trials, finished, threshold):
+        self.thresholds = thresholds
+        self.num_trials = num_trials
+        self.finished = finished
+        self.threshold = threshold
+
+    def summary(self):
+        """returns bias and standard deviation of the thresholds and the
+        trials needed by finished tracks
+
+        Returns
+        -------
+        summary : dict
+            bias, std, mean_trials, median_trials and finished (fraction of
+            finished tracks)
+        """
+        thresholds = self.thresholds[self.finished]
+        trials = self.num_trials[self.finished]
+        if not len(thresholds):
+            return {'bias': np.nan, 'std': np.nan, 'mean_trials': np.nan,
+                    'median_trials': np.nan, 'finished': 0.0}
+        return {'bias': float(np.mean(thresholds) - self.threshold),
+                'std': float(np.std(thresholds)),
+                'mean_trials': float(np.mean(trials)),
+                'median_trials': float(np.median(trials)),
+                'finished': float(np.mean(self.finished))}
+
+
+class PsychometricObserver():
+    """Model observer answering trials of a real experiment
+
+    The probability of a correct answer depends on the variable of the trial
+    only, see :func:`psychometric`. The guess rate is 1/num_afc for N-AFC
+    experiments and 0 otherwise. Observers are called by
+    :class:`earyx.ui.Model`.
+
+    Parameters
+    ----------
+    threshold, slope, lapse : float
+        see :func:`psychometric`
+    seed : int (optional)
+        seed of the random answers
+    """
+
+    def __init__(self, threshold=0, slope=1, lapse=0, seed=None):
+        self.threshold = threshold
+        self.slope = slope
+        self.lapse = lapse
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, exp, trial, signal):
+        """returns the answer to a trial
+
+        Parameters
+        ----------
+        exp : :class:`Experiment`
+        trial : :class:`Trial`
+        signal : list
+            signal of the trial as returned by `build_signal`
+        """
+        guess = 1/exp.num_afc if hasattr(exp, 'num_afc') else 0
+        if self.rng.random() < psychometric(trial.variable, self.threshold,
+                                            self.slope, guess, self.lapse):
+            return trial.correct_answer
+        return _wrong_answer(exp, trial, self.rng)
+
+
+class SignalObserver():
+    """Base class of observers which listen to the intervals of N-AFC trials
+
+    The observer computes a decision statistic for each interval, adds
+    gaussian internal noise and chooses the interval with the largest value.
+    Subclasses implement :func:`statistic`.
+
+    Parameters
+    ----------
+    internal_noise : float
+        standard deviation of the internal noise in units of the statistic
+    seed : int (optional)
+        seed of the internal noise
+    """
+
+    def __init__(self, internal_noise=1, seed=None):
+        self.internal_noise = internal_noise
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, exp, trial, signal):
+        """returns the answer to a trial, see :class:`PsychometricObserver`"""
+        intervals = afc_intervals(exp, trial, signal)
+        return int(self.decide(intervals[None], exp.sample_rate)[0]) + 1
+
+    def decide(self, intervals, sample_rate):
+        """choose intervals of many trials at once
+
+        Parameters
+        ----------
+        intervals : numpy array
+            shape (trials, num_afc, samples)
+        sample_rate : int
+
+        Returns
+        -------
+        choice : numpy array of int
+            index of the chosen interval of each trial
+        """
+        values = self.statistic(intervals, sample_rate)
+        values = values + self.internal_noise*self.rng.standard_normal(
+            values.shape)
+        return np.argmax(values, axis=-1)
+
+    def statistic(self, intervals, sample_rate):
+        """returns the decision statistic of shape (trials, num_afc)"""
+        raise NotImplementedError
+
+
+class EnergyObserver(SignalObserver):
+    """Band-pass energy detector
+
+    The statistic is the level of each interval in dB after an ideal band-pass
+    filter.
+
+    Parameters
+    ----------
+    f1, f2 : float (optional)
+        edge frequencies of the band-pass in Hz. Default: whole spectrum
+    internal_noise : float
+        standard deviation of the internal noise in dB
+    seed : int (optional)
+    """
+
+    def __init__(self, f1=None, f2=None, internal_noise=1, seed=None):
+        SignalObserver.__init__(self, internal_noise, seed)
+        self.f1 = f1
+        self.f2 = f2
+
+    def statistic(self, intervals, sample_rate):
+        spectrum = np.fft.rfft(intervals, axis=-1)
+        freqs = np.fft.rfftfreq(intervals.shape[-1], 1/sample_rate)
+        band = np.ones(len(freqs), dtype=bool)
+        if self.f1 is not None:
+            band &= freqs >= self.f1
+        if self.f2 is not None:
+            band &= freqs <= self.f2
+        energy = np.sum(np.abs(spectrum[..., band])**2, axis=-1)
+        return 10*np.log10(energy + 1e-20)
+
+
+class GammatoneObserver(SignalObserver):
+    """Template observer with a gammatone filterbank
+
+    Each interval is filtered by 4th order gammatone filters, half-wave
+    rectified and averaged in frames. The level of each frame in dB is the
+    internal representation. The statistic is the correlation of the
+    difference between the representation of an interval and the one of the
+    masker with the template, the normalised difference between the
+    representations of target and masker.
+
+    Parameters
+    ----------
+    center_frequencies : list of float
+        center frequencies of the filters in Hz
+    target : numpy array or :class:`earyx.stimulus.Stimulus`
+        masker plus a clearly audible test signal
+    masker : numpy array or :class:`earyx.stimulus.Stimulus`
+        masker or reference interval alone
+    frame : float
+        length of the frames in seconds
+    internal_noise : float
+        standard deviation of the internal noise
+    seed : int (optional)
+    """
+
+    def __init__(self, center_frequencies, target, masker, frame=0.01,
+                 internal_noise=1, seed=None):
+        SignalObserver.__init__(self, internal_noise, seed)
+        self.center_frequencies = np.atleast_1d(center_frequencies)
+        self.target = target
+        self.masker = masker
+        self.frame = frame
+        self._template = {}
+
+    def representation(self, intervals, sample_rate):
+        """returns the internal representation of shape
+        (..., channels, frames)"""
+        num = intervals.shape[-1]
+        spectrum = np.fft.rfft(intervals, 2*num, axis=-1)
+        filtered = np.fft.irfft(spectrum[..., None, :] *
+                                self._filters(2*num, sample_rate),
+                                2*num, axis=-1)[..., :num]
+        frame = max(1, int(round(self.frame*sample_rate)))
+        num_frames = num//frame
+        rectified = np.maximum(filtered[..., :num_frames*frame], 0)
+        frames = rectified.reshape(rectified.shape[:-1] + (num_frames, frame))
+        return 10*np.log10(np.mean(frames**2, axis=-1) + 1e-20)
+
+    def statistic(self, intervals, sample_rate):
+        masker, template = self.template(intervals.shape[-1], sample_rate)
+        diff = self.representation(intervals, sample_rate) - masker
+        return np.sum(diff*template, axis=(-2, -1))
+
+    def template(self, num, sample_rate):
+        """returns the representation of the masker and the template for
+        intervals of num samples"""
+        key = (num, sample_rate)
+        if key not in self._template:
+            target, masker = [_fit(render_signal([sig], sample_rate)[0], num)
+                              for sig in (self.target, self.masker)]
+            target, masker = self.representation(np.array([target, masker]),
+                                                 sample_rate)
+            template = target - masker
+            template /= max(np.sqrt(np.sum(template**2)), 1e-20)
+            self._template[key] = masker, template
+        return self._template[key]
+
+    def _filters(self, num, sample_rate):
+        time = np.arange(num)/sample_rate
+        cf = self.center_frequencies[:, None]
+        erb = 24.7*(4.37*cf/1000 + 1)
+        impulse = (time**3*np.exp(-2*np.pi*1.019*erb*time) *
+                   np.cos(2*np.pi*cf*time))
+        response = np.fft.rfft(impulse, axis=-1)
+        return response/np.max(np.abs(response), axis=-1, keepdims=True)
+
+
+def afc_intervals(exp, trial, signal):
+    """returns the rendered intervals of an N-AFC trial
+
+    Parameters
+    ----------
+    exp : :class:`AFCExperiment`
+    trial : :class:`Trial`
+    signal : list
+        signal of the trial as returned by `build_signal`
+
+    Returns
+    -------
+    intervals : numpy array
+        shape (num_afc, samples), multichannel intervals are averaged over
+        the channels and shorter intervals are padded with zeros
+    """
+    if not hasattr(exp, 'num_afc'):
+        raise ValueError("signal observers need an N-AFC experiment")
+    parts = render_signal(signal, exp.sample_rate, trial.seed)
+    intervals = [np.asarray(parts[1+2*idx], dtype=float)
+                 for idx in range(exp.num_afc)]
+    intervals = [part.mean(axis=1) if part.ndim > 1 else part
+                 for part in intervals]
+    num = max(len(part) for part in intervals)
+    return np.array([_fit(part, num) for part in intervals])
+
+
+def percent_correct(exp, observer, variables, num_trials=100, run=None):
+    """estimate the psychometric function of a signal observer
+
+    Trials are synthesised by :func:`Experiment.next_trial` and all trials of
+    a variable are decided at once.
+
+    Parameters
+    ----------
+    exp : :class:`AFCExperiment`
+    observer : :class:`SignalObserver`
+    variables : list of float
+    num_trials : int
+        number of trials per variable
+    run : :class:`Run` (optional)
+        run whose parameters are used. Default: first run of the experiment
+
+    Returns
+    -------
+    p : numpy array
+        proportion of correct answers for each variable
+    """
+    if run is None:
+        run = exp.runs[0]
+    variable = run.variable
+    result = []
+    try:
+        for value in variables:
+            run.variable = value
+            intervals = []
+            correct = []
+            for _ in range(num_trials):
+                trial, signal = exp.next_trial(run)
+                intervals.append(afc_intervals(exp, trial, signal))
+                correct.append(trial.correct_answer - 1)
+            num = max(part.shape[-1] for part in intervals)
+            intervals = np.array([_fit(part, num) for part in intervals])
+            choice = observer.decide(intervals, exp.sample_rate)
+            result.append(np.mean(choice == np.array(correct)))
+    finally:
+        run.variable = variable
+    return np.array(result)
+
+
+def psychometric(variable, threshold=0, slope=1, guess=0, lapse=0):
+    """logistic psychometric function
+
+    Parameters
+    ----------
+    variable : numpy array
+    threshold : float
+        variable at the middle between guess rate and 1-lapse
+    slope : float
+        slope of the logistic function at threshold is slope/4 times
+        (1-guess-lapse)
+    guess : float
+        guess rate, 1/num_afc for N-AFC experiments
+    lapse : float
+        lapse rate
+
+    Returns
+    -------
+    p : numpy array
+        probability of a correct answer
+    """
+    return guess + (1-guess-lapse)/(1 + np.exp(-slope*(variable-threshold)))
+
+
+def simulate(adapt_method="1up2down", max_reversals=6, start_step=5,
+             min_step=1, start=0, threshold=0, slope=1, guess=0, lapse=0,
+             num_tracks=10000, max_trials=1000, seed=None, **kwargs):
+    """simulate adaptive tracks against a psychometric function
+
+    Parameters
+    ----------
+    adapt_method, max_reversals, start_step, min_step, kwargs
+        adapt setting, see :func:`Experiment.add_adapt_setting`
+    start : float
+        start value of the variable, see :func:`Experiment.set_variable`
+    threshold, slope, guess, lapse : float
+        simulated observer, see :func:`psychometric`
+    num_tracks : int
+        number of simulated tracks
+    max_trials : int
+        tracks which did not finish after max_trials are stopped
+    seed : int (optional)
+        seed of the random answers
+
+    Returns
+    -------
+    simulation : :class:`Simulation`
+    """
+    rng = np.random.default_rng(seed)
+
+    def respond(variable):
+        return rng.random(len(variable)) < psychometric(variable, threshold,
+                                                        slope, guess, lapse)
+
+    setting = {"max_reversals": max_reversals, "start_step": start_step,
+               "minstep": min_step}
+    setting.update(kwargs)
+    return run_tracks(adapt_method, setting, start, respond, num_tracks,
+                      max_trials, threshold)
+
+
+def run_tracks(adapt_method, setting, start, respond, num_tracks=10000,
+               max_trials=1000, threshold=np.nan):
+    """simulate adaptive tracks with any observer
+
+    Parameters
+    ----------
+    adapt_method : str
+        1up2down, 2up1down, 1up3down or WUD
+    setting : dict
+        adapt setting with the keys of :func:`Experiment.add_adapt_setting`
+    start : float
+        start value of the variable
+    respond : function
+        called with the variables of all running tracks, returns a numpy
+        array of bool which is **True** for correct answers
+    num_tracks : int
+    max_trials : int
+    threshold : float (optional)
+        threshold of the observer, stored in the result
+
+    Returns
+    -------
+    simulation : :class:`Simulation`
+    """
+    rule = _rules[adapt_method]
+    minstep = setting['minstep']
+    variable = np.full(num_tracks, float(start))
+    step = np.full(num_tracks, float(setting['start_step']))
+    reversals = np.full(num_tracks, -1)
+    # correct[0] is the answer of the last trial, correct[1] the one before
+    correct = np.zeros((4, num_tracks), dtype=bool)
+    history = np.empty((num_tracks, max_trials))
+    num_trials = np.zeros(num_tracks, dtype=int)
+    start_idx = np.zeros(num_tracks, dtype=int)
+    measuring = np.zeros(num_tracks, dtype=bool)
+    finished = np.zeros(num_tracks, dtype=bool)
+    active = np.arange(num_tracks)
+    for trial in range(max_trials):
+        if not len(active):
+            break
+        history[active, trial] = variable[active]
+        correct[1:, active] = correct[:-1, active]
+        correct[0, active] = respond(variable[active])
+        num_trials[active] = trial + 1
+        ret, step[active], reversals[active] = rule(correct[:, active],
+                                                    trial + 1, step[active],
+                                                    reversals[active], minstep,
+                                                    setting)
+        done = reversals[active] == setting['max_reversals']
+        finished[active[done]] = True
+        going = active[~done]
+        ret = ret[~done]
+        variable[going] += ret
+        begin = going[(np.abs(ret) == minstep) & ~measuring[going]]
+        start_idx[begin] = trial + 1
+        measuring[begin] = True
+        active = going
+
+    length = num_trials.max() if num_tracks else 0
+    columns = np.arange(length)
+    phase = ((columns >= start_idx[:, None]) &
+             (columns < num_trials[:, None]))
+    values = np.where(phase, history[:, :length], np.nan)
+    thresholds = np.full(num_tracks, np.nan)
+    rows = phase.any(axis=1)
+    if rows.any():
+        thresholds[rows] = np.nanmedian(values[rows], axis=1)
+    return Simulation(thresholds, num_trials, finished, threshold)
+
+
+def _fit(signal, num):
+    """cut or zero pad signal to num samples along the last axis"""
+    signal = np.asarray(signal, dtype=float)[..., :num]
+    pad = [(0, 0)]*(signal.ndim-1) + [(0, num-signal.shape[-1])]
+    return np.pad(signal, pad)
+
+
+def _wrong_answer(exp, trial, rng):
+    if hasattr(exp, 'num_afc'):
+        answers = [ans for ans in range(1, exp.num_afc+1)
+                   if ans != trial.correct_answer]
+        return answers[rng.integers(len(answers))]
+    return 'u' if trial.correct_answer == 'd' else 'd'
+
+
+def _1up2down(c, num, step, reversals, minstep, setting):
+    """vectorised :class:`earyx.adapt.Adapt1up2down`"""
+    if num >= 3:
+        down = c[0] & c[1] & ~c[2]
+        reversals = reversals + (down & (step == minstep))
+        step = np.where(down, np.maximum(minstep, step/2), step)
+        up = ~c[0] & c[1] & c[2]
+        reversals = reversals + (up & (step == minstep))
+    ret = np.where(~c[0], step, np.where(c[1] & (num >= 2), -step, 0.0))
+    return ret, step, reversals
+
+
+def _2up1down(c, num, step, reversals, minstep, setting):
+    """vectorised :class:`earyx.adapt.Adapt2up1down`"""
+    if num >= 3:
+        first = ~(c[1] & c[2]) & c[0]
+        reversals = reversals + (first & (step == minstep))
+        step = np.where(first, np.maximum(minstep, step/2), step)
+        second = c[2] & ~(c[0] & c[1])
+        reversals = reversals + (second & (step == minstep))
+    ret = np.where(c[0], -step, np.where(~c[1] & (num >= 2), step, 0.0))
+    return ret, step, reversals
+
+
+def _1up3down(c, num, step, reversals, minstep, setting):
+    """vectorised :class:`earyx.adapt.Adapt1up3down`"""
+    if num >= 4:
+        down = c[0] & c[1] & c[2] & ~c[3] & (step == minstep)
+        reversals = reversals + down
+        step = np.where(down, np.maximum(minstep, step/2), step)
+        up = ~c[0] & c[1] & c[2] & c[3]
+        reversals = reversals + (up & (step == minstep))
+    ret = np.where(~c[0], step,
+                   np.where(c[1] & c[2] & (num >= 3), -step, 0.0))
+    return ret, step, reversals
+
+
+def _wud(c, num, step, reversals, minstep, setting):
+    """vectorised :class:`earyx.adapt.AdaptWUD`"""
+    if num >= 2:
+        down = c[0] & ~c[1] & (step == minstep)
+        reversals = reversals + down
+        step = np.where(down, np.maximum(minstep, step/2), step)
+        up = ~c[0] & c[1]
+        reversals = reversals + (up & (step == minstep))
+    pc_convergence = setting['pc_convergence']
+    if pc_convergence >= 1:
+        raise ValueError("pc_convergence must be smaller than 1")
+    step_down = setting['start_step']
+    step_up = pc_convergence/(1-pc_convergence)*step_down
+    ret = np.where(c[0], -step_down, step_up)
+    return ret, step, reversals
+
+
+_rules = {'1up2down': _1up2down, '2up1down': _2up1down,
+          '1up3down': _1up3down, 'WUD': _wud}
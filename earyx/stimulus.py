@@ -0,0 +1,537 @@
+"""
+This module provides declarative stimulus descriptions. Instead of raw audio an
+experiment can assign a small graph of stimulus nodes to any of its signals,
+for example::
+
+    noise = Noise(0.3, 10**(run.noise_level/20), 1450, 1750, seed=42)
+    trial.test_signal = Mix(noise, Delay(Ramp(Sine(1600, ampl, 0.03), 0.005), 0.135))
+
+The description is rendered with the primitives of :mod:`earyx.utils` when the
+signal is played from python. The browser GUI receives only the JSON
+description plus the trial seed and synthesises the signal itself, so server
+CPU time and network traffic per trial do not depend on the stimulus length.
+
+Noise is generated from a counter based hash instead of numpy's random
+generator, so python and browser produce the same samples for the same seed.
+Noise nodes without an own seed are running noise: they are seeded from the
+trial seed, the position of the signal part and their position in the graph.
+Noise nodes with a seed are frozen noise.
+
+In python all nodes are evaluated by a :class:`Renderer`. It caches subgraphs
+which do not depend on the trial: a subgraph without running noise which is
+rendered a second time with the same description, e.g. a masker whose level
+is a run parameter, is afterwards copied from the cache. Nodes which only
+transform their inputs write into one preallocated output buffer, and the
+time spent per node type is collected in `Renderer.timings`.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+import time
+import numpy as np
+from earyx.utils import gensin, hanwin, htc
+
+
+class Stimulus():
+    """Base class of all stimulus nodes
+
+    Attributes
+    ----------
+    kind : str
+        node type used in the JSON description
+    cacheable : boolean
+        **True** if the samples only depend on the description and the
+        sample rate, see :class:`Renderer`
+    """
+    kind = None
+    cacheable = False
+
+    def length(self, sample_rate):
+        """returns length of the rendered node in samples"""
+        raise NotImplementedError
+
+    def render(self, sample_rate, seed=0, part=0):
+        """render node to numpy array
+
+        Parameters
+        ----------
+        sample_rate : int
+        seed : int
+            trial seed used for running noise
+        part : int
+            index of the signal part, see :func:`render_signal`
+
+        Returns
+        -------
+        signal : numpy array
+        """
+        return default_renderer.render(self, sample_rate, seed, part)
+
+    def _render(self, sample_rate, keys):
+        raise NotImplementedError
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        """write the samples of the node into out"""
+        out[:] = self._render(sample_rate, keys)
+
+    def to_json(self):
+        """returns JSON serializable description of the node"""
+        dct = {'type': self.kind}
+        for name, value in self.__dict__.items():
+            if isinstance(value, Stimulus):
+                value = value.to_json()
+            elif isinstance(value, list):
+                value = [val.to_json() for val in value]
+            dct[name] = value
+        return dct
+
+
+class Silence(Stimulus):
+    """zero signal of given duration in seconds"""
+    kind = 'silence'
+    cacheable = True
+
+    def __init__(self, duration):
+        self.duration = float(duration)
+
+    def length(self, sample_rate):
+        return _samples(self.duration, sample_rate)
+
+    def _render(self, sample_rate, keys):
+        return np.zeros(self.length(sample_rate))
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        out[:] = 0
+
+
+class Sine(Stimulus):
+    """sine tone, see :func:`earyx.utils.gensin`"""
+    kind = 'sine'
+    cacheable = True
+
+    def __init__(self, freq, ampl, duration, phase=0):
+        self.freq = float(freq)
+        self.ampl = float(ampl)
+        self.duration = float(duration)
+        self.phase = float(phase)
+
+    def length(self, sample_rate):
+        return _samples(self.duration, sample_rate)
+
+    def _render(self, sample_rate, keys):
+        num = self.length(sample_rate)
+        return gensin(self.freq, self.ampl, num/sample_rate, self.phase,
+                      sample_rate)[:num]
+
+
+class Htc(Stimulus):
+    """harmonic tone complex, see :func:`earyx.utils.htc`"""
+    kind = 'htc'
+    cacheable = True
+
+    def __init__(self, ampl, duration, f0, f_start, f_end, C, calib=0):
+        self.ampl = float(ampl)
+        self.duration = float(duration)
+        self.f0 = float(f0)
+        self.f_start = float(f_start)
+        self.f_end = float(f_end)
+        self.C = float(C)
+        self.calib = float(calib)
+
+    def length(self, sample_rate):
+        return _samples(self.duration, sample_rate)
+
+    def _render(self, sample_rate, keys):
+        return htc(self.ampl, sample_rate, self.length(sample_rate)/sample_rate,
+                   self.f0, self.f_start, self.f_end, self.C, self.calib)
+
+
+class Noise(Stimulus):
+    """gaussian noise scaled to given rms amplitude
+
+    If `f1` and `f2` are given, the noise has a rectangular spectrum between
+    both frequencies like noise filtered with :func:`earyx.utils.fft_rect_filt`.
+    If `seed` is given the noise is frozen, otherwise it is running noise.
+    """
+    kind = 'noise'
+
+    def __init__(self, duration, ampl, f1=None, f2=None, seed=None):
+        self.duration = float(duration)
+        self.ampl = float(ampl)
+        self.f1 = f1
+        self.f2 = f2
+        self.seed = seed
+
+    @property
+    def cacheable(self):
+        return self.seed is not None
+
+    def length(self, sample_rate):
+        return _samples(self.duration, sample_rate)
+
+    def _render(self, sample_rate, keys):
+        num = self.length(sample_rate)
+        key = keys.next(self.seed)
+        if self.f1 is None or self.f2 is None:
+            noise = _gauss(key, num)
+        else:
+            fft_len = 1 << max(num-1, 1).bit_length()
+            first = min(max(int(np.ceil(self.f1*fft_len/sample_rate)), 0),
+                        fft_len//2)
+            last = min(max(int(np.floor(self.f2*fft_len/sample_rate)), first),
+                       fft_len//2)
+            coeffs = _gauss(key, 2*(last-first+1))
+            spec = np.zeros(fft_len//2+1, dtype=complex)
+            spec[first:last+1] = coeffs[0::2] + 1j*coeffs[1::2]
+            spec[0] = spec[0].real
+            spec[-1] = spec[-1].real
+            noise = np.fft.irfft(spec, fft_len)[:num]
+        noise_rms = np.sqrt(np.mean(np.square(noise)))
+        if noise_rms > 0:
+            noise = noise/noise_rms*self.ampl
+        return noise
+
+
+class Ramp(Stimulus):
+    """hanning flanks of given length in seconds, see :func:`earyx.utils.hanwin`"""
+    kind = 'ramp'
+    cacheable = True
+
+    def __init__(self, input, ramp):
+        self.input = input
+        self.ramp = float(ramp)
+
+    def length(self, sample_rate):
+        return self.input.length(sample_rate)
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        renderer.fill(self.input, out, sample_rate, keys)
+        out *= _ramp_window(len(out), _samples(self.ramp, sample_rate))
+
+
+class Gain(Stimulus):
+    """input multiplied by a constant factor"""
+    kind = 'gain'
+    cacheable = True
+
+    def __init__(self, input, factor):
+        self.input = input
+        self.factor = float(factor)
+
+    def length(self, sample_rate):
+        return self.input.length(sample_rate)
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        renderer.fill(self.input, out, sample_rate, keys)
+        out *= self.factor
+
+
+class Delay(Stimulus):
+    """input preceded by silence of given length in seconds"""
+    kind = 'delay'
+    cacheable = True
+
+    def __init__(self, input, time):
+        self.input = input
+        self.time = float(time)
+
+    def length(self, sample_rate):
+        return _samples(self.time, sample_rate) + self.input.length(sample_rate)
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        num = _samples(self.time, sample_rate)
+        out[:num] = 0
+        renderer.fill(self.input, out[num:], sample_rate, keys)
+
+
+class Mix(Stimulus):
+    """sum of all inputs, shorter inputs are padded with zeros at the end"""
+    kind = 'mix'
+    cacheable = True
+
+    def __init__(self, *inputs):
+        self.inputs = list(inputs)
+
+    def length(self, sample_rate):
+        return max(inp.length(sample_rate) for inp in self.inputs)
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        inputs = self.inputs
+        if inputs[0].length(sample_rate) == len(out):
+            # the first input is rendered into out, the others are added
+            renderer.fill(inputs[0], out, sample_rate, keys)
+            inputs = inputs[1:]
+        else:
+            out[:] = 0
+        for inp in inputs:
+            buf = renderer.buffer(inp.length(sample_rate))
+            renderer.fill(inp, buf, sample_rate, keys)
+            out[:len(buf)] += buf
+            renderer.release(buf)
+
+
+class Concat(Stimulus):
+    """all inputs joined one after another"""
+    kind = 'concat'
+    cacheable = True
+
+    def __init__(self, *inputs):
+        self.inputs = list(inputs)
+
+    def length(self, sample_rate):
+        return sum(inp.length(sample_rate) for inp in self.inputs)
+
+    def _fill(self, renderer, out, sample_rate, keys):
+        pos = 0
+        for inp in self.inputs:
+            num = inp.length(sample_rate)
+            renderer.fill(inp, out[pos:pos+num], sample_rate, keys)
+            pos += num
+
+
+class Renderer():
+    """Evaluates stimulus graphs
+
+    A subgraph is kept in a least recently used cache when it is rendered the
+    second time with the same description and sample rate and all its nodes
+    are `cacheable`, i.e. it contains no running noise. Parts which depend
+    on the variable change their description every trial and are rendered
+    anew, constant parts are rendered once per run.
+
+    Every node writes into a buffer of its final length allocated by its
+    parent, so chains of gains, ramps, delays, mixes and concatenations do not
+    allocate intermediate signals.
+
+    Parameters
+    ----------
+    max_bytes : int (optional)
+        size of the cache. Default: 256 MiB
+
+    Attributes
+    ----------
+    timings : dict
+        for each node kind the number of renders, cache hits and nanoseconds
+        spent, including the inputs of the node
+    """
+
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.timings = {}
+        self._cache = OrderedDict()
+        self._seen = OrderedDict()
+        self._nbytes = 0
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def render(self, node, sample_rate, seed=0, part=0):
+        """render node to numpy array, see :func:`Stimulus.render`"""
+        out = np.empty(node.length(sample_rate))
+        self.fill(node, out, sample_rate, _NoiseKeys(seed, part))
+        return out
+
+    def fill(self, node, out, sample_rate, keys):
+        """write the samples of node into out"""
+        start = time.perf_counter_ns()
+        key = self._key(node, sample_rate, keys.nodes)
+        cached = self._lookup(key)
+        if cached is not None:
+            out[:] = cached
+        else:
+            node._fill(self, out, sample_rate, keys)
+            self._store(key, out)
+        timing = self.timings.setdefault(node.kind,
+                                         {'renders': 0, 'hits': 0, 'ns': 0})
+        timing['renders'] += 1
+        timing['hits'] += cached is not None
+        timing['ns'] += time.perf_counter_ns() - start
+
+    def buffer(self, num):
+        """returns a scratch buffer of num samples, see :func:`release`"""
+        free = self._buffers.get(num)
+        return free.pop() if free else np.empty(num)
+
+    def release(self, buf):
+        """return a buffer of :func:`buffer` for reuse"""
+        self._buffers.setdefault(len(buf), []).append(buf)
+
+    def clear(self):
+        """drop all cached subgraphs and timings"""
+        with self._lock:
+            self._cache.clear()
+            self._seen.clear()
+            self._nbytes = 0
+            self._buffers = {}
+            self.timings = {}
+
+    def _key(self, node, sample_rate, memo):
+        """returns the cache key of node or None if it is not cacheable"""
+        if id(node) in memo:
+            return memo[id(node)]
+        key = None
+        if node.cacheable:
+            items = [node.kind, sample_rate]
+            for name, value in sorted(node.__dict__.items()):
+                if isinstance(value, Stimulus):
+                    value = self._key(value, sample_rate, memo)
+                elif isinstance(value, list):
+                    value = tuple(self._key(val, sample_rate, memo)
+                                  for val in value)
+                if value is None and name in ('input', 'inputs'):
+                    break
+                if isinstance(value, tuple) and None in value:
+                    break
+                items.append((name, value))
+            else:
+                key = tuple(items)
+        memo[id(node)] = key
+        return key
+
+    def _lookup(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+            return cached
+
+    def _store(self, key, out):
+        if key is None or out.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key not in self._seen:
+                # only subgraphs rendered twice are constant for the run
+                self._seen[key] = True
+                if len(self._seen) > 4096:
+                    self._seen.popitem(last=False)
+                return
+            cached = out.copy()
+            cached.flags.writeable = False
+            self._cache[key] = cached
+            self._nbytes += cached.nbytes
+            while self._nbytes > self.max_bytes:
+                self._nbytes -= self._cache.popitem(last=False)[1].nbytes
+
+
+def from_json(dct):
+    """create stimulus node from its JSON description
+
+    Parameters
+    ----------
+    dct : dict
+        description as returned by :func:`Stimulus.to_json`
+
+    Returns
+    -------
+    node : :class:`Stimulus`
+    """
+    dct = dict(dct)
+    cls = _kinds[dct.pop('type')]
+    node = cls.__new__(cls)
+    for name, value in dct.items():
+        if isinstance(value, dict):
+            value = from_json(value)
+        elif name == 'inputs':
+            value = [from_json(val) for val in value]
+        setattr(node, name, value)
+    return node
+
+
+def render_signal(signal, sample_rate, seed=0):
+    """render all stimulus nodes of a signal list
+
+    Parameters
+    ----------
+    signal : list of numpy arrays or :class:`Stimulus`
+        signal as returned by `build_signal`
+    sample_rate : int
+    seed : int
+        trial seed used for running noise
+
+    Returns
+    -------
+    signal : list of numpy arrays
+    """
+    return [part.render(sample_rate, seed, idx)
+            if isinstance(part, Stimulus) else part
+            for idx, part in enumerate(signal)]
+
+
+def describe(signal, sample_rate):
+    """returns JSON description of a signal list
+
+    Zero signals, for example pre, between and post signals converted by
+    `time_to_signal`, are described as silence.
+
+    Parameters
+    ----------
+    signal : list of numpy arrays or :class:`Stimulus`
+    sample_rate : int
+
+    Returns
+    -------
+    description : list of dict or None
+        None if any part of the signal is raw, non-silent audio
+    """
+    description = []
+    for part in signal:
+        if isinstance(part, Stimulus):
+            description.append(part.to_json())
+        elif len(np.shape(part)) == 1 and not np.any(part):
+            description.append(Silence(len(part)/sample_rate).to_json())
+        else:
+            return None
+    return description
+
+
+def _samples(time, sample_rate):
+    return int(round(time*sample_rate))
+
+
+@lru_cache(maxsize=64)
+def _ramp_window(num, flank):
+    """window of :func:`earyx.utils.hanwin` for num samples"""
+    window = hanwin(np.ones(num), flank)
+    window.flags.writeable = False
+    return window
+
+
+def _hash(values):
+    """32 bit integer hash, identical to hash() in gui/script.js"""
+    values = (np.array(values, dtype=np.int64, ndmin=1) % 2**32).astype(np.uint32)
+    values ^= values >> np.uint32(16)
+    values *= np.uint32(0x7feb352d)
+    values ^= values >> np.uint32(15)
+    values *= np.uint32(0x846ca68b)
+    values ^= values >> np.uint32(16)
+    return values
+
+
+def _gauss(key, num):
+    """num gaussian random numbers of noise stream `key` (Box-Muller)"""
+    counter = np.arange(2*num, dtype=np.uint32) + np.uint32(key)
+    uniform = (_hash(counter) + 0.5)/4294967296.0
+    radius = np.sqrt(-2*np.log(uniform[0::2]))
+    return radius*np.cos(2*np.pi*uniform[1::2])
+
+
+class _NoiseKeys():
+    """hands out the keys of all noise streams of one signal part, `nodes`
+    holds the cache keys of its nodes during rendering"""
+
+    def __init__(self, seed, part):
+        self.base = int(_hash(int(_hash(seed)[0]) + part)[0])
+        self.counter = 0
+        self.nodes = {}
+
+    def next(self, seed=None):
+        if seed is not None:
+            return int(_hash(seed)[0])
+        self.counter += 1
+        return int(_hash(self.base + self.counter)[0])
+
+
+_kinds = {cls.kind: cls for cls in [Silence, Sine, Htc, Noise, Ramp, Gain,
+                                    Delay, Mix, Concat]}
+
+default_renderer = Renderer()
@@ -0,0 +1,111 @@
+"""
+This module contains rules which end adaptive runs as soon as their threshold
+estimate is precise enough. They are added with
+:func:`earyx.experiments.Experiment.add_stopping_rule` and checked after each
+:func:`Experiment.adapt` in addition to the end of the adapt rule. Rules keep
+their state on the run in `stopping_state` and read the statistics of the
+measurement phase from `run.stats`, so a check costs the same for every
+trial.
+
+It is part of the earyx toolbox for psychoacoustic experiments.
+"""
+import statistics
+
+
+class Stop():
+    """Base class of all stopping rules
+
+    Attributes
+    ----------
+    min_trials : int
+        number of measurement trials before the run may stop
+    """
+    min_trials = 4
+
+    def __init__(self, settings):
+        self.__dict__.update(settings)
+
+    def __call__(self, run):
+        """returns **True** if the run should end
+
+        Parameters
+        ----------
+        run : :class:`Run`
+        """
+        return self.check(run)
+
+    def check(self, run):
+        raise NotImplementedError
+
+    def state(self, run):
+        """returns the state of this rule for run"""
+        return run.stopping_state.setdefault(self.type, {})
+
+
+class StopConfidence(Stop):
+    """Stop when the confidence interval of the mean of the measurement
+    phase is narrower than `width`
+
+    Attributes
+    ----------
+    width : float
+        full width of the confidence interval in units of the variable
+    confidence : float
+        confidence level, default 0.95
+    """
+    width = 2
+    confidence = 0.95
+
+    def check(self, run):
+        num = run.stats.count
+        if num < max(self.min_trials, 2):
+            return False
+        width = (2*_t_quantile((1+self.confidence)/2, num-1) *
+                 run.stats.std(1)/num**0.5)
+        return width <= self.width
+
+
+class StopPosterior(Stop):
+    """Stop when the posterior standard deviation of the threshold of a
+    Bayesian adapt rule, see :class:`earyx.adapt.AdaptPsi`, is below `sd`
+
+    Attributes
+    ----------
+    sd : float
+    """
+    sd = 1
+
+    def check(self, run):
+        estimate_sd = getattr(run, 'estimate_sd', None)
+        return (estimate_sd is not None and
+                len(run.history) >= self.min_trials and
+                estimate_sd <= self.sd)
+
+
+class StopStableMedian(Stop):
+    """Stop when the median of the measurement phase changed by at most
+    `tolerance` during the last `window` trials
+
+    Attributes
+    ----------
+    window : int
+    tolerance : float
+    """
+    window = 6
+    tolerance = 1
+
+    def check(self, run):
+        if not run.stats.count:
+            return False
+        medians = self.state(run).setdefault('medians', [])
+        medians.append(run.stats.median)
+        del medians[:-self.window]
+        return (run.stats.count >= max(self.min_trials, self.window) and
+                max(medians) - min(medians) <= self.tolerance)
+
+
+def _t_quantile(p, dof):
+    """quantile of Student's t distribution (Cornish-Fisher expansion)"""
+    z = statistics.NormalDist().inv_cdf(p)
+    return (z + (z**3 + z)/(4*dof) + (5*z**5 + 16*z**3 + 3*z)/(96*dof**2) +
+            (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/(384*dof**3))
@@ -22,6 +22,14 @@ class Trial():
     parameters : dict
         containing name, value, unit and description.
     signal : list
+    seed : int
+        seed for running noise of :mod:`earyx.stimulus` descriptions
+    timing : dict
+        timestamps of the trial in :func:`time.perf_counter_ns`:
+        synthesis_start, synthesis_end, answer and adapt_done. If the
+        signal is played from python also first_sample_ns and onsets_ns
+        of all signal parts, plus first_sample and onsets in stream time
+        of the audio device.
     _save_names : dict    
     """
     def __init__(self, variable, parameters, reference_signal, pre_signal,
@@ -55,6 +63,8 @@ class Trial():
         self.variable = variable
         self.__dict__.update(parameters)
         self.signal = []
+        self.seed = 0
+        self.timing = {}
         self._save_names = {}
 
     @classmethod
@@ -1,6 +1,8 @@
-import sounddevice as sd
 import earyx.server as svr
 import earyx.exception as expt
+from earyx.stimulus import render_signal
+from earyx.audio import open_engine, num_channels
+from earyx.simulate import PsychometricObserver
 import matplotlib.pyplot as plt
 from tornado.ioloop import IOLoop
 import json
@@ -50,6 +52,19 @@ class Tui(Ui):
 
     
     def start(self, exp):
+        self.audio = None
+        self.loop = None
+        self.loop_run = None
+        self.loop_trial = None
+        self.audio_backend = exp.audio_backend
+        self.channel_map = exp.channel_map
+        try:
+            self.run_experiment(exp)
+        finally:
+            if self.audio is not None:
+                self.audio.close()
+
+    def run_experiment(self, exp):
         os.system('cls' if os.name == 'nt' else 'clear')
         self.message(self.welcome_screen)
         self.message("Your experiment:" + exp.cls+ "\n")
@@ -65,12 +80,19 @@ class Tui(Ui):
                 self.message("Experiment finished")
                 self.save(exp)
                 return
-            trial, signal  = exp.next_trial(run)
-            self.present_signal(signal, trial.sample_rate)
+            if getattr(exp, 'continuous', False):
+                trial = self.present_loop(exp, run)
+            else:
+                trial, signal  = exp.next_trial(run)
+                playback = self.present_signal(signal, trial.sample_rate,
+                                               trial.seed)
+                trial.timing.update(playback.timing())
             while trial.answer == None:
                 try:
                     answer = self.get_user_response(exp.task)
+                    trial.timing['answer'] = time.perf_counter_ns()
                 except expt.RunAbortException:
+                    self.stop_loop()
                     exp.skip_run(run)
                     break
                 except expt.ExperimentAbortException:
@@ -98,6 +120,7 @@ class Tui(Ui):
                     try:
                         exp.adapt(run)
                     except expt.RunFinishedException:
+                        self.stop_loop()
                         if self.confirm("\nRun completed. Continue?"):
                             continue
                         else:
@@ -116,14 +139,55 @@ class Tui(Ui):
         else:
             exp.finalize(False)
 
-    def present_signal(self,signal, sample_rate):
-        """Play back signal """
-        signal = [np.tile(sig, (2, 1)).T for sig in signal
-                  if len(sig.shape) == 1 ]
-        with sd.Stream(samplerate=sample_rate, dtype='float32') as s:
-            for part in signal:
-                s.write(np.asarray(part, dtype='float32', order='C'))
+    def present_signal(self,signal, sample_rate, seed=0):
+        """Play back signal and return its :class:`earyx.audio.Playback`
+
+        All trials are played by one audio engine, see :mod:`earyx.audio`,
+        which stays open until the experiment ends.
+        """
+        signal = render_signal(signal, sample_rate, seed)
+        self.audio = open_engine(self.audio_backend, sample_rate,
+                                 num_channels(signal), self.channel_map,
+                                 self.audio)
+        playback = self.audio.play(signal)
+        playback.wait()
+        return playback
+
+
+    def present_loop(self, exp, run):
+        """Build next trial of a matching experiment in continuous mode
 
+        The first trial of a run starts a loop of its signal, all further
+        trials of the run only change the gain of the test signal in the
+        loop, see :class:`earyx.experiments.MatchingExperiment`.
+
+        Returns
+        -------
+        trial : :class:`Trial`
+        """
+        if self.loop is not None and self.loop_run is run:
+            trial, signal = exp.next_loop_trial(run, self.loop_trial)
+            self.loop.set_gain(exp.loop_gain(trial))
+            return trial
+        self.stop_loop()
+        trial, signal = exp.next_trial(run)
+        parts = exp.loop_parts(trial, signal)
+        signal = render_signal(signal, trial.sample_rate, trial.seed)
+        # loops need the callback in this process to change the gain
+        self.audio = open_engine('stream', trial.sample_rate,
+                                 num_channels(signal), self.channel_map,
+                                 self.audio)
+        self.loop = self.audio.loop(signal, parts, exp.loop_ramp)
+        self.loop.set_gain(exp.loop_gain(trial))
+        self.loop_run, self.loop_trial = run, trial
+        self.loop.wait_started(1)
+        trial.timing.update(self.loop.timing())
+        return trial
+
+    def stop_loop(self):
+        if self.loop is not None:
+            self.audio.stop()
+            self.loop = self.loop_run = self.loop_trial = None
 
     def get_user_response(self, task):
         print ('\r')
@@ -153,7 +217,7 @@ class Tui(Ui):
         print(msg)
 
     def plot(self, runs, params):
-        variables = [trial.variable for trial in runs.trials]
+        variables = runs.history.variable
         length = len(variables)
         plt.ion()
         f = plt.figure(111)
@@ -164,13 +228,16 @@ class Tui(Ui):
            x_axes = numpy.arange(1,length+1)
            plt.plot(x_axes,variables,'o--',markerfacecolor='k',markersize=5)
         else:
-            x1 = numpy.arange(1,runs.start_measurement_idx+1)
-            x2 = numpy.arange(runs.start_measurement_idx,length+1)
-            measurement_variables = variables[runs.start_measurement_idx-1:]
-            plt.plot(x1,variables[:runs.start_measurement_idx],'o--',markerfacecolor='k',markersize=5)
+            # same trials as runs.stats and the export, the dashed line
+            # ends at the first measurement trial
+            first_variables = variables[:runs.start_measurement_idx+1]
+            x1 = numpy.arange(1,len(first_variables)+1)
+            x2 = numpy.arange(runs.start_measurement_idx+1,length+1)
+            measurement_variables = variables[runs.start_measurement_idx:]
+            plt.plot(x1,first_variables,'o--',markerfacecolor='k',markersize=5)
             plt.plot(x2,measurement_variables,'ob-',markersize=5)
-            median_measurement = numpy.median(measurement_variables)
-            std_measurement = numpy.std(measurement_variables)
+            median_measurement = runs.stats.median or 0
+            std_measurement = runs.stats.std()
             plt.text(0.7, 0.85,'Med:', ha='left', va='center',transform = ax.transAxes)
             plt.text(0.82, 0.85,round(median_measurement,2), ha='left', va='center',transform = ax.transAxes)
             plt.text(0.7, 0.77,'Std:', ha='left', va='center',transform = ax.transAxes)
@@ -199,28 +266,99 @@ class Gui(Ui):
         IOLoop.instance().start()
 
 class Model(Ui):
+    """Headless user interface for simulations and benchmarks
 
-    def __init__(self, model_func):
-        self.model_func = model_func
-        
-    
-    def start():
+    A model observer answers all trials and nothing is played back, so an
+    experiment runs from :func:`next_run` to :func:`finalize` at full speed.
+    At the end the trials per second and the time spent in each phase are
+    reported.
+
+    Parameters
+    ----------
+    experiment : :class:`Experiment`
+    observer : function (optional)
+        called with experiment, trial and signal, returns the answer.
+        Default: :class:`earyx.simulate.PsychometricObserver` with its
+        threshold at the start value of the variable
+    save : boolean (optional)
+        save the experiment at the end. Default: False
+    max_trials : int (optional)
+        runs with more trials are skipped. Default: 1000
+
+    Attributes
+    ----------
+    report : dict
+        number of runs and trials, duration in seconds, trials per second,
+        seconds spent in each phase and the threshold of each run
+    """
+    phases = ['next_run', 'next_trial', 'observer', 'set_answer', 'adapt',
+              'finalize']
+
+    def __init__(self, experiment, observer=None, save=False, max_trials=1000):
+        if observer is None:
+            observer = PsychometricObserver(experiment.variable['start_val'])
+        self.observer = observer
+        self.save = save
+        self.max_trials = max_trials
+        Ui.__init__(self, experiment)
+
+    def start(self, exp):
+        if exp.subject_name == '':
+            exp.subject_name = 'model'
+        timings = dict.fromkeys(self.phases, 0)
+        clock = [time.perf_counter_ns()]
+        begin = clock[0]
+
+        def lap(phase):
+            now = time.perf_counter_ns()
+            timings[phase] += now - clock[0]
+            clock[0] = now
+
+        num_trials = 0
         while True:
             try:
                 run = exp.next_run()
             except StopIteration:
-                exp.finalize(True)
-                return
+                lap('next_run')
+                break
+            lap('next_run')
+            if len(run.trials) >= self.max_trials:
+                exp.skip_run(run)
+                continue
             trial, signal = exp.next_trial(run)
-            answer = self.model_func(signal)
-            try:
-                answer = exp.check_answer(answer)
-            except expt.WrongAnswerFormat as e:
-                self.waring(e.msg)
-                return
+            lap('next_trial')
+            answer = exp.check_answer(self.observer(exp, trial, signal))
+            lap('observer')
+            exp.set_answer(run, trial, answer)
+            lap('set_answer')
             try:
-                exp.set_answer_and_adapt(run, trial, answer)
-            except expt.RunFinishedException:
-                continue
-            if exp.debug:
-                self.plot(run.trials)
+                exp.adapt(run)
+            except (expt.RunFinishedException, expt.RunStartMeasurement):
+                pass
+            lap('adapt')
+            num_trials += 1
+        exp.finalize(self.save)
+        lap('finalize')
+
+        seconds = (time.perf_counter_ns() - begin)/1e9
+        self.report = {'runs': len(exp.runs), 'trials': num_trials,
+                       'seconds': seconds,
+                       'trials_per_second': num_trials/seconds,
+                       'phases': {phase: timings[phase]/1e9
+                                  for phase in self.phases},
+                       'thresholds': [self.threshold(run) for run in exp.runs]}
+        self.message("%d trials in %d runs, %.3f s, %.1f trials/s" %
+                     (num_trials, len(exp.runs), seconds,
+                      self.report['trials_per_second']))
+        for phase in self.phases:
+            self.message("  %-10s %8.3f ms/trial %5.1f %%" %
+                         (phase, timings[phase]/1e6/max(num_trials, 1),
+                          timings[phase]/1e7/seconds))
+
+    def threshold(self, run):
+        """median of the measurement phase like in the psylab export, None
+        for runs without measurement trials"""
+        return run.stats.median
+
+    def message(self, msg):
+        print(msg)
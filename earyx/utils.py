@@ -120,8 +120,8 @@ def htc(ampl, fs, dur, f0, f_start, f_end, C, calib=0):
     comp_ampl_db = 10*((ampl/10)-np.log10(N))
     ampl = np.sqrt(2)*10**((comp_ampl_db-calib)/20)
 
-    htc_out = np.zeros(dur*fs)
+    htc_out = np.zeros(int(round(dur*fs)))
     for n in components:
         phase = (C*np.pi*n*(n-1)/N)*180/np.pi
-        htc_out += gensin(n*f0,ampl,dur,phase,fs)
+        htc_out += gensin(n*f0,ampl,dur,phase,fs)[:len(htc_out)]
     return htc_out
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+import earyx.exception as expt
+from earyx.adapt import AdaptKUpNDown, AdaptPsi, AdaptQuest
+from earyx.simulate import psychometric
+from earyx.run import History
+
+
+def steps(answers, **setting):
+    rule = AdaptKUpNDown.__new__(AdaptKUpNDown)
+    rule.__dict__.update(setting)
+    rule.step = setting['start_step']
+    history = History()
+    result = []
+    for answer in answers:
+        history.append(0, answer, answer)
+        result.append(rule.adapt(history))
+    return result, rule
+
+
+def test_kupndown():
+    result, rule = steps([1, 1, 1, 0, 1, 1, 1, 0, 0, 1, 1, 1], k=2, n=3,
+                         start_step=4, minstep=1, max_reversals=6)
+    assert result == [0, 0, -4, 0, 0, 0, -4, 0, 2, 0, 0, -1]
+    assert (rule.step, rule.reversals) == (1, -1)
+    with pytest.raises(expt.RunFinishedException):
+        steps([1, 0, 1, 0], k=1, n=1, start_step=1, minstep=1,
+              max_reversals=2)
+
+
+def test_bayesian():
+    rng = np.random.default_rng(1)
+    for adapt_class in [AdaptPsi, AdaptQuest]:
+        rule = adapt_class.__new__(adapt_class)
+        rule.__dict__.update(start_step=8, minstep=1, max_trials=60,
+                             variable=-10.0)
+        history = History()
+        with pytest.raises(expt.RunFinishedException):
+            while True:
+                history.append(rule.variable, 1, rng.random() < psychometric(
+                    rule.variable, -30, 0.5, 1/3, 0.02))
+                rule.variable += rule.adapt(history)
+        assert len(history) == 60
+        assert abs(rule.estimate + 30) < 3*rule.estimate_sd + 1
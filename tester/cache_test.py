@@ -0,0 +1,26 @@
+import os
+import time
+import numpy as np
+from earyx.cache import StimulusCache
+from earyx.stimulus import Sine
+
+
+def test_stimulus_cache(tmpdir):
+    cache = StimulusCache(str(tmpdir), max_bytes=20000)
+    signal = np.arange(1000.0)
+    assert cache.store('a', {'reference_signal': signal, 'note': 'x',
+                             'test_signal': Sine(1000, 1, 0.1)})
+    attrs = cache.load('a')
+    assert isinstance(attrs['reference_signal'], np.memmap)
+    assert np.array_equal(attrs['reference_signal'], signal)
+    attrs['reference_signal'] *= 2  # init_run may change loaded arrays
+    assert np.array_equal(cache.load('a')['reference_signal'], signal)
+    assert attrs['note'] == 'x'
+    assert attrs['test_signal'].to_json() == Sine(1000, 1, 0.1).to_json()
+    assert not cache.store('c', {'run': object()})
+    os.utime(os.path.join(str(tmpdir), 'a.json'), (0, 0))
+    time.sleep(0.01)
+    cache.store('b', {'reference_signal': signal})
+    cache.store('d', {'reference_signal': signal})
+    assert cache.load('a') is None
+    assert cache.load('b') is not None and cache.load('d') is not None
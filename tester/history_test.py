@@ -0,0 +1,29 @@
+import statistics
+import numpy as np
+from earyx.run import History, RunningStats
+
+
+def test_history():
+    history = History(2)
+    for idx in range(5):
+        history.append(-10.0 - idx, idx % 3 + 1, idx % 2 == 0)
+        history.adapted(-1, idx == 3)
+    assert len(history) == 5
+    assert history.variable.tolist() == [-10, -11, -12, -13, -14]
+    assert history.is_correct.tolist() == [True, False, True, False, True]
+    assert history.reversal.tolist() == [False, False, False, True, False]
+    assert history.answer == [1, 2, 3, 1, 2]
+    copy = History.from_json(history.to_json())
+    for name in ['variable', 'is_correct', 'step', 'reversal', 'answer']:
+        assert np.array_equal(getattr(copy, name), getattr(history, name))
+
+
+def test_running_stats():
+    values = np.random.default_rng(0).normal(-30, 3, 101).round()
+    stats = RunningStats()
+    for num, value in enumerate(values, 1):
+        stats.add(value)
+        assert stats.median == statistics.median(values[:num])
+    assert np.isclose(stats.mean, np.mean(values))
+    assert np.isclose(stats.std(1), np.std(values, ddof=1))
+    assert (stats.min, stats.max) == (min(values), max(values))
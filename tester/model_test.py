@@ -0,0 +1,124 @@
+from earyx.experiments import AFCExperiment
+from earyx.order import Sequential
+from earyx.simulate import PsychometricObserver
+import numpy as np
+import earyx.ui
+
+
+def test_model(tmpdir):
+    ModelSession(tmpdir).test_report()
+
+
+def test_lazy_runs(tmpdir):
+    ModelSession(tmpdir, lazy_runs=True).test_lazy_runs()
+
+
+def test_finished_run_signals(tmpdir):
+    ModelSession(tmpdir).test_finished_run_signals()
+
+
+def test_parallel_init_run(tmpdir):
+    signals = [ModelSession(tmpdir, lazy_runs=False, run_seed=3,
+                            init_processes=processes).reference_signals()
+               for processes in [1, 2]]
+    assert not np.array_equal(*signals[0])
+    assert np.array_equal(signals[0], signals[1])
+
+
+def test_trial_cache(tmpdir):
+    ModelSession(tmpdir, trial_cache_size=4).test_trial_cache()
+
+
+def test_psi_measurement(tmpdir):
+    psi = {"type": "Psi", "max_reversals": 6, "start_step": 8, "minstep": 1,
+           "max_trials": 12, "guess": 1/3}
+    ModelSession(tmpdir, adapt_settings=[psi]).test_psi_measurement()
+
+
+class ModelExperiment(AFCExperiment, Sequential):
+    options = {}
+
+    def init_experiment(self, exp):
+        exp.add_parameter("frequency", [1000, 2000], "Hz")
+        exp.set_variable("sine_level", -20, "dB")
+        exp.add_adapt_setting("1up2down", 6, 8, 1)
+        exp.num_afc = 3
+        exp.sample_rate = 8000
+        exp.task = "In which Interval do you hear the test tone (1,2,3)?"
+        exp.__dict__.update(self.options)
+
+    def init_run(self, cur_run):
+        cur_run.reference_signal = np.random.randn(8)
+        cur_run.pre_signal = np.zeros(4)
+        cur_run.between_signal = np.zeros(4)
+        cur_run.post_signal = np.zeros(4)
+
+    def init_trial(self, cur_trial):
+        cur_trial.test_signal = np.ones(8)*10**(cur_trial.variable/20)
+
+
+class ModelSession():
+    """:class:`ModelExperiment` with the experiment options given as keyword
+    arguments, answered by a simulated listener"""
+
+    def __init__(self, tmpdir, **options):
+        tmpdir.chdir()
+        experiment_class = type('ModelExperiment', (ModelExperiment,),
+                                {'options': options})
+        self.exp = experiment_class()
+        self.report = None
+
+    def run(self):
+        """run all runs to completion"""
+        model = earyx.ui.Model(self.exp, PsychometricObserver(-40, 0.5,
+                                                              seed=1))
+        self.report = model.report
+        assert all(run.finished for run in self.exp.runs)
+
+    def reference_signals(self):
+        return [run.reference_signal for run in self.exp.runs]
+
+    def test_report(self):
+        self.run()
+        assert self.report['runs'] == 2
+        assert self.report['trials'] == sum(len(run.trials)
+                                            for run in self.exp.runs)
+        assert all(abs(thr + 40) < 15 for thr in self.report['thresholds'])
+        assert set(self.report['phases']) == set(earyx.ui.Model.phases)
+
+    def test_lazy_runs(self):
+        runs = self.exp.runs
+        assert not any(run.prepared for run in runs)
+        trial, signal = self.exp.next_trial(runs[1])
+        assert [run.prepared for run in runs] == [False, True]
+        assert len(signal[1]) == 8
+        self.run()
+        assert all(run.prepared for run in runs)
+        assert all(run.reference_signal == [] for run in runs)
+
+    def test_finished_run_signals(self):
+        assert all(run.prepared for run in self.exp.runs)
+        signals = self.reference_signals()
+        self.run()
+        for run, signal in zip(self.exp.runs, signals):
+            assert np.array_equal(run.reference_signal, signal)
+            assert np.array_equal(run.post_signal, np.zeros(4))
+
+    def test_trial_cache(self):
+        self.run()
+        cache = self.exp.trial_cache
+        assert cache.hits > 0
+        assert cache.hits + cache.misses == self.report['trials']
+        assert len(cache) <= 4
+        signals = self.exp._sl.signals
+        for run in self.exp.runs:
+            for trial in run.trials:
+                name = trial._save_names['test_signal']
+                assert np.allclose(signals[name], 10**(trial.variable/20))
+
+    def test_psi_measurement(self):
+        self.run()
+        for run in self.exp.runs:
+            assert run.start_measurement_idx == 0
+            assert run.stats.count == len(run.history) == 12
+            assert np.isclose(run.stats.mean, np.mean(run.history.variable))
@@ -0,0 +1,31 @@
+from earyx.saveload import SignalStore
+import numpy as np
+import os
+import soundfile as sf
+
+
+def test_signal_store():
+    store = SignalStore(max_bytes=2000)
+    signals = {str(idx): np.random.randn(100) for idx in range(5)}
+    store.update(signals)
+    assert len(store) == 5 and store._nbytes <= 2000
+    assert store.cached('0') is None and store.name_of(signals['4']) == '4'
+    handle = store.handle('0')
+    assert store.handle('0') is handle
+    assert np.array_equal(np.asarray(handle), signals['0'])
+    assert store.cached('0') is not None
+    path = store.spill_path
+    assert os.path.isdir(path)
+    store.clear()
+    assert not os.path.exists(path) and '0' not in store
+
+
+def test_signal_store_file(tmpdir):
+    signal = np.linspace(-0.5, 0.5, 100)
+    path = str(tmpdir.join('0.wav'))
+    sf.write(path, signal, samplerate=8000)
+    store = SignalStore()
+    store.add_file('0', path)
+    assert '0' in store and store.cached('0') is None
+    assert np.allclose(store['0'], signal, atol=1e-4)
+    assert store.cached('0') is not None
@@ -0,0 +1,79 @@
+import statistics
+import numpy as np
+import earyx.adapt as adapt
+import earyx.exception as expt
+from earyx.run import History
+from earyx.simulate import (run_tracks, simulate, psychometric, EnergyObserver,
+                            GammatoneObserver)
+
+
+def answers(variable, num):
+    """deterministic answers of an observer with threshold -30"""
+    uniform = (np.sin(variable*12.9898 + num*78.233)*43758.5453) % 1
+    return uniform < psychometric(variable, -30, 0.4, 1/3)
+
+
+def track(adapt_class, setting, start):
+    """run one track with an adapt class like Experiment.adapt does"""
+    rule = adapt_class.__new__(adapt_class)
+    rule.__dict__.update(setting)
+    rule.step = setting['start_step']
+    history = History()
+    variable = start
+    start_idx = None
+    while True:
+        history.append(variable, None, bool(
+            answers(np.array([variable]), len(history))[0]))
+        try:
+            step = rule.adapt(history)
+        except expt.RunFinishedException:
+            return (statistics.median(history.variable[start_idx:]),
+                    len(history))
+        variable += step
+        if abs(step) == rule.minstep and not start_idx:
+            start_idx = len(history)
+
+
+def test_same_as_adapt_classes():
+    methods = [('1up2down', adapt.Adapt1up2down, {}),
+               ('2up1down', adapt.Adapt2up1down, {}),
+               ('1up3down', adapt.Adapt1up3down, {}),
+               ('WUD', adapt.AdaptWUD, {'pc_convergence': 0.75})]
+    for name, adapt_class, extra in methods:
+        for start in [-10.0, -20.0, -45.0]:
+            setting = dict(max_reversals=4, start_step=4, minstep=4, **extra)
+            num = []
+
+            def respond(variable):
+                num.append(0)
+                return answers(variable, len(num)-1)
+            sim = run_tracks(name, setting, start, respond, 1, 500)
+            assert sim.finished[0]
+            assert (sim.thresholds[0], sim.num_trials[0]) == track(
+                adapt_class, setting, start)
+
+
+def test_summary():
+    sim = simulate('1up2down', 6, 8, 1, start=-10, threshold=-30, slope=0.5,
+                   guess=0.5, num_tracks=2000, seed=0)
+    summary = sim.summary()
+    assert summary['finished'] == 1
+    assert np.isclose(summary['bias'], np.mean(sim.thresholds) + 30)
+    assert summary['std'] > 0
+    assert summary['mean_trials'] == np.mean(sim.num_trials)
+
+
+def test_signal_observers():
+    rng = np.random.default_rng(0)
+    time = np.arange(1600)/16000
+    tone = np.sin(2*np.pi*1000*time)
+    noise = rng.standard_normal((500, 3, 1600))
+    intervals = noise.copy()
+    intervals[:, 1] += 2*tone
+    energy = EnergyObserver(900, 1100, internal_noise=0.1, seed=0)
+    assert np.mean(energy.decide(intervals, 16000) == 1) > 0.95
+    assert np.mean(energy.decide(noise, 16000) == 1) < 0.5
+    gammatone = GammatoneObserver([1000], rng.standard_normal(1600) + 2*tone,
+                                  rng.standard_normal(1600), seed=0)
+    assert gammatone.statistic(intervals, 16000).shape == (500, 3)
+    assert np.mean(gammatone.decide(intervals, 16000) == 1) > 0.9
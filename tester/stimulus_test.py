@@ -0,0 +1,42 @@
+import json
+import numpy as np
+from earyx.stimulus import (Sine, Noise, Ramp, Mix, Delay, Silence, from_json,
+                            render_signal, describe, Renderer)
+
+
+def test_running_and_frozen_noise():
+    running = Noise(0.1, 1, 500, 1500)
+    frozen = Noise(0.1, 1, seed=3)
+    first = render_signal([running, running, frozen, frozen], 8000, seed=1)
+    second = render_signal([running, running, frozen, frozen], 8000, seed=1)
+    for a, b in zip(first, second):
+        assert np.array_equal(a, b)
+    assert not np.allclose(first[0], first[1])
+    assert np.array_equal(first[2], first[3])
+    assert np.isclose(np.sqrt(np.mean(np.square(first[0]))), 1)
+
+
+def test_json_roundtrip():
+    node = Mix(Noise(0.05, 0.1), Delay(Ramp(Sine(1000, 0.5, 0.02), 0.005), 0.01))
+    copy = from_json(json.loads(json.dumps(node.to_json())))
+    assert np.array_equal(node.render(8000, 5), copy.render(8000, 5))
+    assert len(node.render(8000)) == node.length(8000) == 400
+
+
+def test_describe():
+    assert describe([np.zeros(80), Silence(0.01)], 8000) is not None
+    assert describe([np.zeros(80), np.ones(80)], 8000) is None
+
+
+def test_renderer_cache():
+    renderer = Renderer()
+    masker = Noise(0.05, 0.1, 500, 1500, seed=3)
+    signals = []
+    for level in [-10, -20, -10]:
+        node = Mix(masker, Ramp(Sine(1000, 10**(level/20), 0.02), 0.005),
+                   Noise(0.01, 0.01))
+        signals.append(renderer.render(node, 8000, seed=1))
+        assert np.array_equal(signals[-1], Renderer().render(node, 8000, 1))
+    assert renderer.timings['noise']['hits'] == 1
+    assert renderer.timings['sine']['hits'] == 0
+    assert np.array_equal(signals[0], signals[2])
@@ -0,0 +1,30 @@
+import types
+from earyx.run import History, RunningStats
+from earyx.stopping import (StopConfidence, StopStableMedian, StopPosterior,
+                            _t_quantile)
+
+
+def feed(rule, values, start_idx=2):
+    run = types.SimpleNamespace(history=History(), stats=RunningStats(),
+                                stopping_state={},
+                                start_measurement_idx=start_idx)
+    for idx, value in enumerate(values):
+        run.history.append(value, 1, True)
+        if idx >= start_idx:
+            run.stats.add(value)
+        if rule(run):
+            return idx + 1
+    return None
+
+
+def test_stopping_rules():
+    assert abs(_t_quantile(0.975, 10) - 2.228) < 0.01
+    confidence = StopConfidence({'type': 'Confidence', 'width': 2})
+    assert feed(confidence, [0, 8, -30, -30, -30, -30, -30]) == 6
+    assert feed(confidence, [0, 0, -20, -40, -20, -40, -20, -40]) is None
+    median = StopStableMedian({'type': 'StableMedian', 'window': 3,
+                               'tolerance': 0.5})
+    assert feed(median, [0, 0, -30, -31, -30, -31, -30, -30]) == 6
+    posterior = StopPosterior({'type': 'Posterior', 'sd': 1})
+    run = types.SimpleNamespace(history=[0]*4, estimate_sd=0.9)
+    assert posterior(run)